@@ -2,10 +2,17 @@
 API Dependencies
 FastAPI dependency injection
 """
-from typing import Generator
+import httpx
+from fastapi import Request
 from ..database import Database, db
 
 
-def get_db() -> Generator[Database, None, None]:
-    """Get database instance"""
-    yield db
+# async def: FastAPI chạy dependency sync (kể cả generator) trong threadpool -> 1 lần nhảy thread / request
+async def get_db() -> Database:
+    """Get the shared database instance"""
+    return db
+
+
+async def get_http(request: Request) -> httpx.AsyncClient:
+    """Get shared pooled HTTP client (created in app lifespan)"""
+    return request.app.state.http
@@ -3,17 +3,26 @@ API Routes v1 - Full Reader & Crawler APIs
 Following the Frontend API Specification
 """
 import uuid
+import time
+import hashlib
+import base64
+import asyncio
+import httpx
 from datetime import datetime, timezone
 from typing import Optional, List
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Query
+from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Query, Request, Response
+from fastapi.responses import ORJSONResponse
 
+from ..config import get_settings
 from ..database import Database
 from ..schemas.story import (
     TaskStatus,
     HealthResponse,
 )
-from ..crawler.crawler import StoryCrawler
-from .dependencies import get_db
+from ..crawler.crawler import StoryCrawler, polite_slot
+from ..crawler.robots import RobotsDisallowed
+from ..worker_pool import worker_pool
+from .dependencies import get_db, get_http
 
 
 router = APIRouter()
@@ -35,6 +44,12 @@ async def health_check():
 # PHẦN 1: CRAWLER API (Dành cho Admin/Tool)
 # ==========================================================================
 
+def _log_create_task_error(task: asyncio.Task):
+    """Done-callback for the background crawl_tasks insert"""
+    if not task.cancelled() and task.exception():
+        print(f"Warning: Could not create task: {task.exception()}")
+
+
 @router.post("/api/v1/crawler/init", tags=["Crawler"])
 async def init_crawl(
     request: dict,
@@ -65,30 +80,23 @@ async def init_crawl(
         "created_at": datetime.now(timezone.utc).isoformat(),
     }
     
-    try:
-        await db.create_task(task_data)
-    except Exception as e:
-        print(f"Warning: Could not create task: {e}")
-    
-    # Chạy crawl trong background process độc lập (Fix lỗi Asyncio Windows)
-    import subprocess
-    import sys
+    # Không chờ insert: response trả về ngay, lỗi chỉ được log (như trước)
+    create_task = asyncio.create_task(db.create_task(task_data))
+    create_task.add_done_callback(_log_create_task_error)
     
-    cmd = [
-        sys.executable, 
-        "-m", 
-        "app.crawler.runner", 
-        task_id, 
-        url, 
-        str(crawl_chapters)
-    ]
-    
-    # Popen chạy process không chờ (non-blocking)
-    subprocess.Popen(cmd)
+    # Đẩy vào worker pool (chạy trong process hiện tại, không spawn subprocess)
+    # Worker chờ "ready" trước khi chạy để update_task không đến trước insert
+    await worker_pool.submit({
+        "kind": "story",
+        "task_id": task_id,
+        "url": url,
+        "crawl_chapters": crawl_chapters,
+        "ready": create_task,
+    })
     
     return {
         "status": 200,
-        "message": "Đã tiếp nhận yêu cầu. Đang xử lý ngầm (Subprocess).",
+        "message": "Đã tiếp nhận yêu cầu. Đang xử lý ngầm.",
         "task_id": task_id
     }
 
@@ -116,6 +124,12 @@ async def check_crawl_status(task_id: str, db: Database = Depends(get_db)):
             "novel_id": task.get("novel_id"),
             "total_chapters": task.get("total_chapters", 0)
         }
+    elif status in ("cancelling", "cancelled"):
+        return {
+            "status": status,
+            "progress": task.get("message", ""),
+            "percent": task.get("progress", 0)
+        }
     else:  # failed
         return {
             "status": "failed",
@@ -123,6 +137,28 @@ async def check_crawl_status(task_id: str, db: Database = Depends(get_db)):
         }
 
 
+@router.post("/api/v1/crawler/tasks/{task_id}/cancel", tags=["Crawler"])
+async def cancel_crawl(task_id: str, db: Database = Depends(get_db)):
+    """
+    Hủy task đang chạy (runner kiểm tra cờ mỗi vài giây, chương đã tải vẫn được lưu)
+    """
+    task = await db.get_task(task_id)
+    if not task:
+        raise HTTPException(status_code=404, detail="Task không tồn tại")
+    
+    if task.get("status") != "processing":
+        raise HTTPException(status_code=409, detail=f"Task không chạy (status: {task.get('status')})")
+    
+    await db.update_task(task_id, {
+        "status": "cancelling",
+        "message": "Đang hủy...",
+    })
+    return {
+        "status": "cancelling",
+        "task_id": task_id
+    }
+
+
 @router.post("/api/v1/crawler/update/{novel_id}", tags=["Crawler"])
 async def update_novel(
     novel_id: str,
@@ -145,6 +181,11 @@ async def update_novel(
     }
 
 
+# Backpressure: tối đa N bulk crawl (đang chờ + đang chạy), vượt quá -> 429
+MAX_BULK_CRAWLS = 2
+_BULK_SEM = asyncio.Semaphore(MAX_BULK_CRAWLS)
+
+
 @router.post("/api/v1/crawler/bulk-crawl", tags=["Crawler"])
 async def bulk_crawl(
     request: dict,
@@ -163,23 +204,28 @@ async def bulk_crawl(
     max_pages = request.get("max_pages", 5)
     crawl_chapters = request.get("crawl_chapters", True)
     
+    if _BULK_SEM.locked():
+        raise HTTPException(
+            status_code=429,
+            detail=f"Đang có {MAX_BULK_CRAWLS} bulk crawl chạy, thử lại sau"
+        )
+    await _BULK_SEM.acquire()  # không chờ: semaphore chưa locked
+    
     # Tạo bulk task ID
     bulk_task_id = f"bulk_{uuid.uuid4().hex[:12]}"
     
-    import subprocess
-    import sys
-    
-    cmd = [
-        sys.executable,
-        "-m",
-        "app.crawler.bulk_runner",
-        bulk_task_id,
-        ",".join(categories),
-        str(max_pages),
-        str(crawl_chapters)
-    ]
-    
-    subprocess.Popen(cmd)
+    try:
+        await worker_pool.submit({
+            "kind": "bulk",
+            "task_id": bulk_task_id,
+            "categories": categories,
+            "max_pages": max_pages,
+            "crawl_chapters": crawl_chapters,
+            "on_done": _BULK_SEM.release,
+        })
+    except Exception:
+        _BULK_SEM.release()
+        raise
     
     return {
         "status": 200,
@@ -259,30 +305,87 @@ async def clear_all_data(db: Database = Depends(get_db)):
 # PHẦN 2: READER API (Dành cho Web đọc truyện)
 # ==========================================================================
 
+# Columns actually rendered by list endpoints (+ updated_at for the cursor)
+STORY_LIST_COLUMNS = "id,title,author,cover_url,total_chapters,status,updated_at"
+
+def _story_card(s: dict) -> dict:
+    """Story item shape shared by list + search endpoints"""
+    return {
+        "id": s.get("id"),
+        "title": s.get("title"),
+        "author": s.get("author"),
+        "cover_url": s.get("cover_url"),
+        "latest_chapter": s.get("total_chapters", 0),
+        "status": s.get("status", "Đang ra")
+    }
+
+
+# Chỉ cho phép OFFSET (page=) ở vài trang đầu, sâu hơn phải dùng cursor
+MAX_OFFSET_PAGE = 5
+
+
+def _encode_cursor(*parts) -> str:
+    """Encode keyset values of the last row into an opaque cursor"""
+    raw = "|".join(str(p) for p in parts)
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+
+def _decode_cursor(cursor: str, num_parts: int) -> list:
+    """Decode cursor back to its keyset values (400 if malformed)"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8")
+    except Exception:
+        raise HTTPException(status_code=400, detail="Cursor không hợp lệ")
+    parts = raw.split("|")
+    if len(parts) != num_parts or not all(parts):
+        raise HTTPException(status_code=400, detail="Cursor không hợp lệ")
+    return parts
+
+
+def _check_offset_page(page: int):
+    """page= is deprecated; OFFSET only for the first few pages"""
+    if page > MAX_OFFSET_PAGE:
+        raise HTTPException(
+            status_code=400,
+            detail=f"page > {MAX_OFFSET_PAGE} không còn hỗ trợ, dùng cursor (next_cursor)"
+        )
+
+
 @router.get("/api/v1/novels", tags=["Reader"])
 async def get_novels(
-    page: int = Query(1, ge=1),
+    cursor: Optional[str] = Query(None),
+    page: Optional[int] = Query(None, ge=1, deprecated=True),
     limit: int = Query(20, ge=1, le=100),
     sort: str = Query("newest", regex="^(newest|popular)$"),
     db: Database = Depends(get_db)
 ):
     """
     4. Lấy danh sách truyện (Home Page / Filter)
+    
+    Keyset pagination: truyền `next_cursor` của response trước vào `cursor`.
+    `page` vẫn nhận nhưng chỉ cho các trang đầu (OFFSET).
     """
-    offset = (page - 1) * limit
-    stories = await db.get_stories(limit=limit, offset=offset)
+    if cursor:
+        last_ts, last_id = _decode_cursor(cursor, 2)
+        # Giá trị cursor đi thẳng vào filter PostgREST -> chỉ nhận timestamp/uuid hợp lệ
+        try:
+            last_ts = datetime.fromisoformat(last_ts).isoformat()
+            last_id = str(uuid.UUID(last_id))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Cursor không hợp lệ")
+        stories = await db.get_stories(limit=limit, after=(last_ts, last_id), columns=STORY_LIST_COLUMNS)
+    else:
+        page = page or 1
+        _check_offset_page(page)
+        stories = await db.get_stories(limit=limit, offset=(page - 1) * limit, columns=STORY_LIST_COLUMNS)
     
     # Format response
-    data = []
-    for s in stories:
-        data.append({
-            "id": s.get("id"),
-            "title": s.get("title"),
-            "author": s.get("author"),
-            "cover_url": s.get("cover_url"),
-            "latest_chapter": s.get("total_chapters", 0),
-            "status": s.get("status", "Đang ra")
-        })
+    data = [_story_card(s) for s in stories]
+    
+    next_cursor = None
+    if len(stories) == limit:
+        last = stories[-1]
+        next_cursor = _encode_cursor(last.get("updated_at"), last.get("id"))
     
     total = len(data)  # TODO: Get actual total count
     
@@ -291,13 +394,50 @@ async def get_novels(
         "pagination": {
             "total_items": total,
             "total_pages": max(1, (total + limit - 1) // limit),
-            "current_page": page
+            "current_page": page,
+            "next_cursor": next_cursor
         }
     }
 
 
+# Reader data only changes when the crawler runs -> cho phép cache ngắn + revalidate
+READER_CACHE_CONTROL = "public, max-age=60, stale-while-revalidate=300"
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+def _make_etag(*parts) -> str:
+    """Short strong ETag from the values that determine a response"""
+    raw = ":".join(str(p) for p in parts)
+    return '"' + hashlib.blake2b(raw.encode("utf-8"), digest_size=8).hexdigest() + '"'
+
+
+def _not_modified(request: Request, etag: str, cache_control: str = READER_CACHE_CONTROL) -> Response | None:
+    """304 response if the client already has this ETag, else None"""
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": cache_control})
+    return None
+
+
+def _accepts_gzip(request: Request) -> bool:
+    """Accept-Encoding allows gzip (gzip, else *, với q > 0)"""
+    weights = {}
+    for item in request.headers.get("accept-encoding", "").split(","):
+        coding, _, params = item.partition(";")
+        params = params.strip()
+        try:
+            weights[coding.strip().lower()] = float(params[2:]) if params.startswith("q=") else 1.0
+        except ValueError:
+            weights[coding.strip().lower()] = 1.0
+    return weights.get("gzip", weights.get("*", 0.0)) > 0
+
+
+def _cached_json(payload: dict, etag: str, cache_control: str = READER_CACHE_CONTROL) -> ORJSONResponse:
+    """JSON response carrying ETag + Cache-Control"""
+    return ORJSONResponse(content=payload, headers={"ETag": etag, "Cache-Control": cache_control})
+
+
 @router.get("/api/v1/novels/{novel_id}", tags=["Reader"])
-async def get_novel_detail(novel_id: str, db: Database = Depends(get_db)):
+async def get_novel_detail(novel_id: str, request: Request, db: Database = Depends(get_db)):
     """
     5. Xem thông tin chi tiết truyện (Novel Detail)
     """
@@ -305,7 +445,12 @@ async def get_novel_detail(novel_id: str, db: Database = Depends(get_db)):
     if not story:
         raise HTTPException(status_code=404, detail="Truyện không tồn tại")
     
-    return {
+    etag = _make_etag(story.get("id"), story.get("total_chapters"), story.get("updated_at"))
+    not_modified = _not_modified(request, etag)
+    if not_modified:
+        return not_modified
+    
+    return _cached_json({
         "id": story.get("id"),
         "title": story.get("title"),
         "description": story.get("description"),
@@ -315,50 +460,78 @@ async def get_novel_detail(novel_id: str, db: Database = Depends(get_db)):
         "status": story.get("status", "Đang ra"),
         "total_chapters": story.get("total_chapters", 0),
         "categories": story.get("genres", [])
-    }
+    }, etag)
 
 
 @router.get("/api/v1/novels/{novel_id}/chapters", tags=["Reader"])
 async def get_chapter_list(
     novel_id: str,
-    page: int = Query(1, ge=1),
+    request: Request,
+    cursor: Optional[str] = Query(None),
+    page: Optional[int] = Query(None, ge=1, deprecated=True),
     limit: int = Query(50, ge=1),  # No max limit
     db: Database = Depends(get_db)
 ):
     """
     6. Lấy danh sách chương (Chapter List)
+    
+    Keyset pagination theo chapter_number (xem `next_cursor`).
     """
-    story = await db.get_story_by_id(novel_id)
+    # Story header + page of chapters in 1 round-trip
+    if cursor:
+        (after_number,) = _decode_cursor(cursor, 1)
+        if not after_number.lstrip("-").isdigit():
+            raise HTTPException(status_code=400, detail="Cursor không hợp lệ")
+        story = await db.get_story_chapters_page(novel_id, limit=limit, after_number=int(after_number))
+    else:
+        page = page or 1
+        _check_offset_page(page)
+        story = await db.get_story_chapters_page(novel_id, limit=limit, offset=(page - 1) * limit)
+    
     if not story:
         raise HTTPException(status_code=404, detail="Truyện không tồn tại")
+    chapters = story["chapters"]
     
-    offset = (page - 1) * limit
-    chapters = await db.get_chapters_by_story(novel_id, limit=limit, offset=offset)
-    
-    data = []
-    for ch in chapters:
-        data.append({
-            "id": ch.get("id"),
-            "chapter_number": ch.get("chapter_number"),
-            "title": ch.get("title"),
-            "source_url": ch.get("source_url"),
-            "created_at": ch.get("created_at"),
-        })
+    # Rows are already projected to the response shape by the query
+    data = chapters
     
-    return {
+    next_cursor = None
+    if len(chapters) == limit:
+        next_cursor = _encode_cursor(chapters[-1].get("chapter_number"))
+    
+    # Chapters may still be inserting after the story row is saved -> hash the page itself
+    etag = _make_etag(
+        story.get("total_chapters"), story.get("updated_at"),
+        *[(ch.get("id"), ch.get("title")) for ch in chapters]
+    )
+    not_modified = _not_modified(request, etag)
+    if not_modified:
+        return not_modified
+    
+    return _cached_json({
         "data": data,
-        "total_chapters": story.get("total_chapters", 0)
-    }
+        "total_chapters": story.get("total_chapters", 0),
+        "next_cursor": next_cursor
+    }, etag)
 
 
 @router.get("/api/v1/chapters/{chapter_id}", tags=["Reader"])
-async def read_chapter(chapter_id: str, db: Database = Depends(get_db)):
+async def read_chapter(
+    chapter_id: str,
+    request: Request,
+    include_content: bool = Query(True),
+    db: Database = Depends(get_db),
+    http: httpx.AsyncClient = Depends(get_http)
+):
     """
     7. Đọc nội dung chương (Read Chapter)
     Storage-first: Check Storage -> DB -> Crawl from source
     Saves new content to Storage (GZIP compressed)
+    
+    include_content=false: chỉ trả metadata, client tải nội dung qua `content_url`
     """
-    chapter = await db.get_chapter_by_id(chapter_id)
+    # Chapter + prev/next ids trong 1 query
+    chapter = await db.get_chapter_window(chapter_id)
     if not chapter:
         raise HTTPException(status_code=404, detail="Chương không tồn tại")
     
@@ -366,83 +539,140 @@ async def read_chapter(chapter_id: str, db: Database = Depends(get_db)):
     chapter_num = chapter.get("chapter_number", 0)
     content = ""
     
-    # Step 1: Try Storage first (GZIP compressed)
+    # Lazy-load: archived content is served raw (gzip) by /content
+    lazy = not include_content and chapter.get("is_archived")
+    
+    # Archived content is immutable; only navigation can change (chương mới được thêm)
+    etag = None
     if chapter.get("is_archived"):
+        etag = _make_etag(
+            chapter.get("id"), lazy,
+            chapter.get("prev_chapter_id"), chapter.get("next_chapter_id")
+        )
+        not_modified = _not_modified(request, etag)
+        if not_modified:
+            return not_modified
+    
+    # Step 1: Try Storage first (GZIP compressed)
+    if chapter.get("is_archived") and not lazy:
         content = await db.download_chapter_content(story_id, chapter_num)
         if content:
             print(f"[Chapter] Loaded from Storage: {chapter.get('title')}")
     
     # Step 2: Fallback to DB column (legacy)
-    if not content:
+    if not content and not lazy:
         content = chapter.get("content", "")
         if content:
             print(f"[Chapter] Loaded from DB column: {chapter.get('title')}")
     
     # Step 3: Crawl from source if still no content
-    if not content and chapter.get("source_url"):
+    if not content and not lazy and chapter.get("source_url"):
         try:
-            import httpx
             from ..crawler.parsers import parse_chapter_content
             
-            headers = {
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-                "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8",
-                "Accept-Language": "vi-VN,vi;q=0.9,en;q=0.8",
-                "Referer": "https://truyenfull.vision/",
-            }
+            print(f"[Chapter] Crawling from source: {chapter['source_url']}")
+            await polite_slot(chapter["source_url"])
+            response = await http.get(chapter["source_url"])
+            response.raise_for_status()
             
-            async with httpx.AsyncClient(timeout=30.0, follow_redirects=True, headers=headers) as client:
-                print(f"[Chapter] Crawling from source: {chapter['source_url']}")
-                response = await client.get(chapter["source_url"])
-                response.raise_for_status()
-                
-                parsed = parse_chapter_content(response.text, chapter["source_url"])
-                content = parsed.get("content", "")
-                
-                # Save to Storage (GZIP) instead of DB
-                if content:
-                    success = await db.upload_chapter_content(story_id, chapter_num, content)
-                    if success:
-                        print(f"[Chapter] Saved to Storage: {chapter.get('title')}")
-                    else:
-                        # Fallback: save to DB if storage fails
-                        await db.upsert_chapter({
-                            "story_id": story_id,
-                            "chapter_number": chapter_num,
-                            "title": chapter["title"],
-                            "source_url": chapter["source_url"],
-                            "content": content,
-                        })
-                        print(f"[Chapter] Saved to DB (fallback): {chapter.get('title')}")
+            parsed = parse_chapter_content(response.content, chapter["source_url"])
+            content = parsed.get("content", "")
+            
+            # Save to Storage (GZIP) instead of DB
+            if content:
+                success = await db.upload_chapter_content(story_id, chapter_num, content)
+                if success:
+                    print(f"[Chapter] Saved to Storage: {chapter.get('title')}")
+                else:
+                    # Fallback: save to DB if storage fails
+                    await db.upsert_chapter({
+                        "story_id": story_id,
+                        "chapter_number": chapter_num,
+                        "title": chapter["title"],
+                        "source_url": chapter["source_url"],
+                        "content": content,
+                    })
+                    print(f"[Chapter] Saved to DB (fallback): {chapter.get('title')}")
+        except RobotsDisallowed:
+            print(f"[Chapter] Disallowed by robots.txt: {chapter['source_url']}")
+            content = "Lỗi tải nội dung: robots.txt của nguồn không cho phép tải chương này"
         except Exception as e:
             print(f"[Chapter ERROR] Fetching failed: {e}")
             content = f"Lỗi tải nội dung: {str(e)}"
     
-    # Get prev/next chapters
-    prev_chapter = await db.get_chapter(story_id, chapter_num - 1)
-    next_chapter = await db.get_chapter(story_id, chapter_num + 1)
-    
-    return {
+    payload = {
         "id": chapter.get("id"),
         "novel_id": story_id,
         "chapter_number": chapter_num,
         "title": chapter.get("title"),
-        "content": content,
+        "content": None if lazy else content,
+        "content_url": f"/api/v1/chapters/{chapter.get('id')}/content",
         "is_archived": chapter.get("is_archived", False),
         "navigation": {
-            "prev_chapter_id": prev_chapter.get("id") if prev_chapter else None,
-            "next_chapter_id": next_chapter.get("id") if next_chapter else None
+            "prev_chapter_id": chapter.get("prev_chapter_id"),
+            "next_chapter_id": chapter.get("next_chapter_id")
         }
     }
+    
+    if etag and content is not None and not content.startswith("Lỗi tải nội dung"):
+        return _cached_json(payload, etag)
+    return payload
+
+
+@router.get("/api/v1/chapters/{chapter_id}/content", tags=["Reader"])
+async def read_chapter_content(chapter_id: str, request: Request, db: Database = Depends(get_db)):
+    """
+    7b. Nội dung chương dạng text/plain
+    Archived chapters: trả nguyên GZIP blob từ Storage (Content-Encoding: gzip),
+    không giải nén rồi nén lại. Hỗ trợ ETag / If-None-Match.
+    """
+    chapter = await db.get_chapter_by_id(chapter_id)
+    if not chapter:
+        raise HTTPException(status_code=404, detail="Chương không tồn tại")
+    
+    story_id = chapter.get("story_id")
+    chapter_num = chapter.get("chapter_number", 0)
+    
+    if chapter.get("is_archived"):
+        # Archived content never changes for a given (story, chapter)
+        # gzip / identity là 2 representation khác nhau -> 2 ETag khác nhau
+        gzip_ok = _accepts_gzip(request)
+        etag = f'"{story_id}-{chapter_num}"' if gzip_ok else f'"{story_id}-{chapter_num}-identity"'
+        not_modified = _not_modified(request, etag, IMMUTABLE_CACHE_CONTROL)
+        if not_modified:
+            not_modified.headers["Vary"] = "Accept-Encoding"
+            return not_modified
+        
+        blob = await db.download_chapter_blob(story_id, chapter_num)
+        if blob:
+            headers = {"ETag": etag, "Vary": "Accept-Encoding", "Cache-Control": IMMUTABLE_CACHE_CONTROL}
+            if gzip_ok:
+                headers["Content-Encoding"] = "gzip"
+                return Response(content=blob, media_type="text/plain; charset=utf-8", headers=headers)
+            # Client không hỗ trợ gzip -> giải nén (ngoài event loop)
+            import gzip
+            text = await asyncio.to_thread(gzip.decompress, blob)
+            return Response(content=text, media_type="text/plain; charset=utf-8", headers=headers)
+    
+    # Legacy: content in DB column
+    if chapter.get("content"):
+        return Response(content=chapter["content"], media_type="text/plain; charset=utf-8")
+    
+    raise HTTPException(status_code=404, detail="Chương chưa có nội dung, gọi /api/v1/chapters/{id} để tải")
 
 
 from fastapi import BackgroundTasks
 
+# Số chương upload xong trước khi ghi is_archived 1 lần
+SYNC_ARCHIVE_BATCH = 50
+
+
 @router.post("/api/v1/novels/{story_id}/sync-offline", tags=["Reader"])
 async def sync_story_offline(
     story_id: str, 
     background_tasks: BackgroundTasks,
-    db: Database = Depends(get_db)
+    db: Database = Depends(get_db),
+    http: httpx.AsyncClient = Depends(get_http)
 ):
     """
     9. Tải Offline toàn bộ nội dung truyện (Sync Offline)
@@ -453,41 +683,48 @@ async def sync_story_offline(
     if not story:
         raise HTTPException(status_code=404, detail="Truyện không tồn tại")
     
-    # Get all chapters that need syncing (not yet archived)
-    chapters = await db.get_chapters_by_story(story_id, limit=10000)
-    chapters_to_sync = [c for c in chapters if not c.get("is_archived")]
+    # Counts + chapters that need syncing (not yet archived) đều do Postgres tính/lọc
+    total, archived_count = await db.get_archive_counts(story_id)
+    chapters_to_sync = await db.get_unarchived_chapters(story_id) if archived_count < total else []
     
     if not chapters_to_sync:
         return {
             "message": "Đã có sẵn offline!",
             "story_id": story_id,
-            "total_chapters": len(chapters),
-            "already_archived": len(chapters),
+            "total_chapters": total,
+            "already_archived": total,
             "to_sync": 0
         }
     
     # Start background sync task
     async def sync_chapters_task():
-        import httpx
         from ..crawler.parsers import parse_chapter_content
         
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36",
-            "Accept-Language": "vi-VN,vi;q=0.9",
-            "Referer": "https://truyenfull.vision/",
-        }
+        total = len(chapters_to_sync)
+        concurrency = get_settings().sync_concurrency
+        sem = asyncio.Semaphore(concurrency)
+        counters = {"done": 0, "synced": 0, "errors": 0}
         
-        synced = 0
-        errors = 0
+        # Uploaded chapter numbers waiting for a batched is_archived update
+        pending_archive = []
         
-        async with httpx.AsyncClient(timeout=30.0, follow_redirects=True, headers=headers) as client:
-            for i, chapter in enumerate(chapters_to_sync):
-                try:
-                    # Fetch content
+        async def flush_archived():
+            """Mark buffered chapters archived in one DB call"""
+            if not pending_archive:
+                return
+            batch = pending_archive[:]
+            pending_archive.clear()
+            await db.mark_chapters_archived(story_id, batch)
+        
+        async def fetch_one(client, chapter):
+            """Fetch + parse + upload 1 chapter (bounded by semaphore)"""
+            try:
+                async with sem:
+                    await polite_slot(chapter["source_url"])
                     response = await client.get(chapter["source_url"])
                     response.raise_for_status()
                     
-                    parsed = parse_chapter_content(response.text, chapter["source_url"])
+                    parsed = parse_chapter_content(response.content, chapter["source_url"])
                     content = parsed.get("content", "")
                     
                     if content:
@@ -495,25 +732,31 @@ async def sync_story_offline(
                         success = await db.upload_chapter_content(
                             chapter["story_id"], 
                             chapter["chapter_number"], 
-                            content
+                            content,
+                            mark_archived=False
                         )
                         if success:
-                            synced += 1
-                    
-                    # Rate limiting - 0.5s between requests
-                    if i < len(chapters_to_sync) - 1:
-                        import asyncio
-                        await asyncio.sleep(0.5)
-                        
-                except Exception as e:
-                    print(f"[Sync ERROR] Chapter {chapter.get('chapter_number')}: {e}")
-                    errors += 1
-                
-                # Log progress every 50 chapters
-                if (i + 1) % 50 == 0:
-                    print(f"[Sync] Progress: {i+1}/{len(chapters_to_sync)} (synced: {synced}, errors: {errors})")
+                            counters["synced"] += 1
+                            pending_archive.append(chapter["chapter_number"])
+                            if len(pending_archive) >= SYNC_ARCHIVE_BATCH:
+                                await flush_archived()
+            except Exception as e:
+                print(f"[Sync ERROR] Chapter {chapter.get('chapter_number')}: {e}")
+                counters["errors"] += 1
+            
+            # Log progress every 50 chapters
+            counters["done"] += 1
+            if counters["done"] % 50 == 0:
+                print(f"[Sync] Progress: {counters['done']}/{total} (synced: {counters['synced']}, errors: {counters['errors']})")
+        
+        # Rate limit = độ rộng semaphore (không sleep cứng giữa các request)
+        await asyncio.gather(
+            *[fetch_one(http, c) for c in chapters_to_sync],
+            return_exceptions=True
+        )
+        await flush_archived()
         
-        print(f"[Sync COMPLETE] Story {story_id}: {synced}/{len(chapters_to_sync)} chapters synced")
+        print(f"[Sync COMPLETE] Story {story_id}: {counters['synced']}/{total} chapters synced")
     
     # Run in background
     background_tasks.add_task(sync_chapters_task)
@@ -522,8 +765,8 @@ async def sync_story_offline(
         "message": "Đang tải offline...",
         "story_id": story_id,
         "story_title": story.get("title"),
-        "total_chapters": len(chapters),
-        "already_archived": len(chapters) - len(chapters_to_sync),
+        "total_chapters": total,
+        "already_archived": archived_count,
         "to_sync": len(chapters_to_sync),
         "status": "processing"
     }
@@ -538,16 +781,15 @@ async def get_offline_status(story_id: str, db: Database = Depends(get_db)):
     if not story:
         raise HTTPException(status_code=404, detail="Truyện không tồn tại")
     
-    chapters = await db.get_chapters_by_story(story_id, limit=10000)
-    archived_count = sum(1 for c in chapters if c.get("is_archived"))
+    total, archived_count = await db.get_archive_counts(story_id)
     
     return {
         "story_id": story_id,
         "story_title": story.get("title"),
-        "total_chapters": len(chapters),
+        "total_chapters": total,
         "archived_chapters": archived_count,
-        "percent_complete": round(archived_count / len(chapters) * 100, 1) if chapters else 0,
-        "is_complete": archived_count == len(chapters)
+        "percent_complete": round(archived_count / total * 100, 1) if total else 0,
+        "is_complete": archived_count == total
     }
 
 
@@ -561,18 +803,9 @@ async def search_novels(
     """
     8. Tìm kiếm truyện (Search)
     """
-    results = await db.search_stories(q, limit=limit)
-    
-    data = []
-    for s in results:
-        data.append({
-            "id": s.get("id"),
-            "title": s.get("title"),
-            "author": s.get("author"),
-            "cover_url": s.get("cover_url"),
-            "latest_chapter": s.get("total_chapters", 0),
-            "status": s.get("status", "Đang ra")
-        })
+    results = await db.search_stories(q, limit=limit, columns=STORY_LIST_COLUMNS)
+    
+    data = [_story_card(s) for s in results]
     
     return {
         "data": data,
@@ -590,10 +823,7 @@ async def search_novels(
 
 from fastapi.responses import HTMLResponse
 
-@router.get("/admin/dashboard", response_class=HTMLResponse, tags=["Admin"])
-async def admin_dashboard():
-    """Dashboard quản lý crawl"""
-    html_content = """
+_ADMIN_DASHBOARD_HTML = """
 <!DOCTYPE html>
 <html lang="vi">
 <head>
@@ -673,6 +903,7 @@ async def admin_dashboard():
         .status.completed { background: #10b981; }
         .status.processing { background: #f59e0b; }
         .status.failed { background: #ef4444; }
+        .status.cancelling, .status.cancelled { background: #6b7280; }
         .refresh-info {
             text-align: center;
             opacity: 0.7;
@@ -795,46 +1026,99 @@ async def admin_dashboard():
     </script>
 </body>
 </html>
+"""
+
+# Build response once; body is static, dữ liệu thật lấy qua /admin/stats
+_ADMIN_DASHBOARD_RESPONSE = HTMLResponse(
+    content=_ADMIN_DASHBOARD_HTML,
+    headers={"Cache-Control": "public, max-age=300"},
+)
+
+
+@router.get("/admin/dashboard", response_class=HTMLResponse, tags=["Admin"])
+async def admin_dashboard():
+    """Dashboard quản lý crawl"""
+    return _ADMIN_DASHBOARD_RESPONSE
+
+
+# Dashboard poll mỗi 3s -> cache kết quả để không đếm lại bảng mỗi lần
+STATS_CACHE_TTL = 10  # seconds
+_stats_cache = {"data": None, "ts": 0.0}
+
+
+def _estimate_count(client, table: str) -> int:
+    """
+    Fast row estimate from pg_class.reltuples (RPC estimate_row_count)
+    Falls back to exact count if the RPC is missing or table chưa ANALYZE
     """
-    return HTMLResponse(content=html_content)
+    try:
+        result = client.rpc("estimate_row_count", {"table_name": table}).execute()
+        if result.data is not None and int(result.data) >= 0:
+            return int(result.data)
+    except Exception as e:
+        print(f"[Stats] estimate_row_count({table}) failed, using exact count: {e}")
+    result = client.table(table).select("id", count="exact").limit(1).execute()
+    return result.count or 0
+
+
+def _count_archived_chapters(client) -> int:
+    """Exact count of chapters whose content is in Storage"""
+    result = client.table("chapters").select("id", count="exact").eq("is_archived", True).limit(1).execute()
+    return result.count or 0
+
+
+def _count_tasks(client, status: str) -> int:
+    """Exact count of crawl_tasks by status (small table)"""
+    result = client.table("crawl_tasks").select("id", count="exact").eq("status", status).limit(1).execute()
+    return result.count or 0
 
 
 @router.get("/admin/stats", tags=["Admin"])
 async def admin_stats(db: Database = Depends(get_db)):
     """API lấy stats cho dashboard"""
+    now = time.monotonic()
+    if _stats_cache["data"] is not None and now - _stats_cache["ts"] < STATS_CACHE_TTL:
+        return _stats_cache["data"]
+    
     try:
-        # Total stories & chapters (Supabase Python client is SYNC, not async)
-        total_stories_result = db.client.table("stories").select("id", count="exact").execute()
-        total_stories = total_stories_result.count or 0
-        
-        total_chapters_result = db.client.table("chapters").select("id", count="exact").execute()
-        total_chapters = total_chapters_result.count or 0
-        
-        # Recent stories
-        recent_stories_result = db.client.table("stories").select("*").order("created_at", desc=True).limit(5).execute()
-        recent_stories = recent_stories_result.data or []
-        
-        # Tasks stats
-        completed_tasks_result = db.client.table("crawl_tasks").select("id", count="exact").eq("status", "completed").execute()
-        completed_tasks = completed_tasks_result.count or 0
-        
-        processing_tasks_result = db.client.table("crawl_tasks").select("id", count="exact").eq("status", "processing").execute()
-        processing_tasks = processing_tasks_result.count or 0
+        # Supabase Python client is SYNC -> chạy song song trong thread pool
+        client = db.client
+        (
+            total_stories,
+            total_chapters,
+            recent_stories_result,
+            completed_tasks,
+            processing_tasks,
+            recent_tasks_result,
+        ) = await asyncio.gather(
+            asyncio.to_thread(_estimate_count, client, "stories"),
+            asyncio.to_thread(_estimate_count, client, "chapters"),
+            asyncio.to_thread(
+                lambda: client.table("stories").select("id,title,author,total_chapters,status,created_at").order("created_at", desc=True).limit(5).execute()
+            ),
+            asyncio.to_thread(_count_tasks, client, "completed"),
+            asyncio.to_thread(_count_tasks, client, "processing"),
+            asyncio.to_thread(
+                lambda: client.table("crawl_tasks").select("id,story_url,status,progress,created_at").order("created_at", desc=True).limit(5).execute()
+            ),
+        )
         
-        # Recent tasks
-        recent_tasks_result = db.client.table("crawl_tasks").select("*").order("created_at", desc=True).limit(5).execute()
-        recent_tasks = recent_tasks_result.data or []
-        
-        return {
+        data = {
             "total_stories": total_stories,
             "total_chapters": total_chapters,
             "completed_tasks": completed_tasks,
             "processing_tasks": processing_tasks,
-            "recent_stories": recent_stories,
-            "recent_tasks": recent_tasks
+            "recent_stories": recent_stories_result.data or [],
+            "recent_tasks": recent_tasks_result.data or []
         }
+        _stats_cache["data"] = data
+        _stats_cache["ts"] = now
+        return data
     except Exception as e:
         print(f"Dashboard stats error: {e}")
+        # Serve stale cache if we have one
+        if _stats_cache["data"] is not None:
+            return _stats_cache["data"]
         # Return default values if error
         return {
             "total_stories": 0,
@@ -882,15 +1166,14 @@ async def get_system_health(db: Database = Depends(get_db)):
     
     # Database stats
     try:
-        stories_count = await db.get_stories_count()
-        
-        # Get total chapters count
-        result = db.client.table("chapters").select("id", count="exact").execute()
-        chapters_count = result.count or 0
-        
-        # Get archived chapters count (content in storage)
-        archived_result = db.client.table("chapters").select("id", count="exact").eq("is_archived", True).execute()
-        archived_count = archived_result.count or 0
+        # Supabase client is SYNC -> chạy trong thread pool để không block event loop
+        client = db.client
+        stories_count, chapters_count, archived_count = await asyncio.gather(
+            asyncio.to_thread(_estimate_count, client, "stories"),
+            asyncio.to_thread(_estimate_count, client, "chapters"),
+            # Archived chapters count (content in storage)
+            asyncio.to_thread(_count_archived_chapters, client),
+        )
         
         # Estimate DB size (rough: ~1KB per chapter metadata, ~500 bytes per story)
         estimated_db_mb = round((chapters_count * 0.001) + (stories_count * 0.0005), 2)
@@ -2,11 +2,13 @@
 Cloudinary Image Upload Utility
 Uploads cover images to Cloudinary with automatic WebP conversion
 """
+import asyncio
+import hashlib
 import httpx
 import cloudinary
 import cloudinary.uploader
 from functools import lru_cache
-from .config import get_settings
+from .config import get_settings, DEFAULT_HEADERS, HTTP2_AVAILABLE
 
 
 @lru_cache()
@@ -28,17 +30,81 @@ def init_cloudinary():
     return True
 
 
+# Configure once at import; uploads just check the flag
+CLOUDINARY_READY = init_cloudinary()
+
+
+# Headers for cover downloads (built once)
+IMAGE_HEADERS = {
+    "User-Agent": DEFAULT_HEADERS["User-Agent"],
+    "Accept": "image/*",
+    "Referer": DEFAULT_HEADERS["Referer"],
+}
+
+
+# Shared client: reuse TCP/TLS (+ HTTP/2 multiplexing nếu có h2) cho mọi cover
+_client: httpx.AsyncClient | None = None
+
+
+def get_client() -> httpx.AsyncClient:
+    """Get (lazily create) the pooled client for image downloads"""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            http2=HTTP2_AVAILABLE,
+            timeout=30.0,
+            follow_redirects=True,
+            headers=IMAGE_HEADERS,
+            limits=httpx.Limits(max_connections=32, max_keepalive_connections=32),
+        )
+    return _client
+
+
+async def close_client():
+    """Close the pooled client (app shutdown)"""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+# 64 KB chunks: ít lần gọi hơn mà không giữ buffer lớn
+DOWNLOAD_CHUNK_SIZE = 65536
+
+
 async def download_image(url: str) -> bytes | None:
-    """Download image from URL"""
+    """Download image from URL (streamed into one preallocated buffer)"""
     try:
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36",
-            "Accept": "image/*",
-        }
-        async with httpx.AsyncClient(timeout=30.0, follow_redirects=True) as client:
-            response = await client.get(url, headers=headers)
+        async with get_client().stream("GET", url) as response:
             response.raise_for_status()
-            return response.content
+            
+            size = int(response.headers.get("content-length") or 0)
+            if size and "content-encoding" not in response.headers:
+                # Known size: write chunks in place, no buffer regrowth
+                buf = bytearray(size)
+                view = memoryview(buf)
+                pos = 0
+                async for chunk in response.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+                    end = pos + len(chunk)
+                    if view is not None and end > size:
+                        # Server lied about length: stop writing in place, grow the buffer
+                        view.release()
+                        view = None
+                        del buf[pos:]
+                    if view is None:
+                        buf.extend(chunk)
+                    else:
+                        view[pos:end] = chunk
+                    pos = end
+                if view is not None:
+                    view.release()
+                del buf[pos:]
+                return bytes(buf)
+            
+            buf = bytearray()
+            async for chunk in response.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+                buf.extend(chunk)
+            return bytes(buf)
     except Exception as e:
         print(f"[Cloudinary] Download failed for {url}: {e}")
         return None
@@ -60,7 +126,7 @@ def upload_image_to_cloudinary(
     Returns:
         Cloudinary URL (WebP format) or None if failed
     """
-    if not init_cloudinary():
+    if not CLOUDINARY_READY:
         return None
     
     try:
@@ -108,12 +174,70 @@ async def upload_cover_from_url(source_url: str, story_slug: str) -> str | None:
         print(f"[Cloudinary] Using original URL: {source_url}")
         return source_url
     
-    # Upload to Cloudinary
-    cloudinary_url = upload_image_to_cloudinary(image_data, story_slug)
+    # Upload to Cloudinary (SDK is blocking -> worker thread)
+    cloudinary_url = await asyncio.to_thread(upload_image_to_cloudinary, image_data, story_slug)
     
     return cloudinary_url or source_url
 
 
+def hash_image(image_data: bytes) -> str:
+    """Content hash of cover bytes (stored in stories.cover_hash)"""
+    return hashlib.blake2b(image_data, digest_size=16).hexdigest()
+
+
+async def probe_cover(url: str) -> str | None:
+    """HEAD the source image, return its ETag / Last-Modified (None if unknown)"""
+    try:
+        response = await get_client().head(url)
+        if response.status_code >= 400:
+            return None
+        return response.headers.get("etag") or response.headers.get("last-modified")
+    except Exception:
+        return None
+
+
+async def sync_cover(source_url: str, story_slug: str, existing: dict | None = None) -> dict:
+    """
+    Upload cover to Cloudinary only if it changed since the last upload
+    
+    Args:
+        source_url: Original cover image URL
+        story_slug: Story slug for naming
+        existing: Current story row (cover_url, cover_hash, cover_etag) or None
+        
+    Returns:
+        Story fields to save: cover_url (+ cover_hash, cover_etag when known)
+    """
+    if not source_url:
+        return {}
+    
+    existing = existing or {}
+    cached_url = existing.get("cover_url") or ""
+    if "cloudinary.com" not in cached_url:
+        cached_url = None
+    
+    # 1. Source validator unchanged -> skip download entirely
+    etag = await probe_cover(source_url)
+    if cached_url and etag and etag == existing.get("cover_etag"):
+        return {"cover_url": cached_url}
+    
+    image_data = await download_image(source_url)
+    if not image_data:
+        print(f"[Cloudinary] Using original URL: {source_url}")
+        return {"cover_url": cached_url or source_url}
+    
+    # 2. Same bytes as last upload -> reuse Cloudinary URL
+    cover_hash = hash_image(image_data)
+    if cached_url and cover_hash == existing.get("cover_hash"):
+        return {"cover_url": cached_url, "cover_etag": etag}
+    
+    cloudinary_url = await asyncio.to_thread(upload_image_to_cloudinary, image_data, story_slug)
+    if not cloudinary_url:
+        return {"cover_url": cached_url or source_url}
+    
+    return {"cover_url": cloudinary_url, "cover_hash": cover_hash, "cover_etag": etag}
+
+
 async def migrate_story_cover(story: dict, db) -> str | None:
     """
     Migrate story cover from truyenfull to Cloudinary
@@ -136,13 +260,38 @@ async def migrate_story_cover(story: dict, db) -> str | None:
     if "cloudinary.com" in original_url:
         return original_url
     
-    # Upload to Cloudinary
-    new_url = await upload_cover_from_url(original_url, slug)
+    # Upload to Cloudinary (records hash/etag so re-runs can skip it)
+    fields = await sync_cover(original_url, slug)
+    new_url = fields.get("cover_url")
     
     if new_url and new_url != original_url:
         # Update database
-        await db.update_story(story["id"], {"cover_url": new_url})
+        await db.update_story(story["id"], fields)
         print(f"[Cloudinary] Migrated cover: {slug}")
         return new_url
     
     return original_url
+
+
+# Số cover migrate song song (Cloudinary giới hạn ~200 rps/token, 16 là an toàn)
+MIGRATE_CONCURRENCY = 16
+
+
+async def migrate_covers_bulk(stories: list, db, concurrency: int = MIGRATE_CONCURRENCY) -> list:
+    """
+    Migrate many story covers concurrently (bounded window)
+    
+    Returns:
+        List of resulting URLs, same order as stories (None on failure)
+    """
+    sem = asyncio.Semaphore(concurrency)
+    
+    async def guarded(story: dict):
+        async with sem:
+            try:
+                return await migrate_story_cover(story, db)
+            except Exception as e:
+                print(f"[Cloudinary] Migrate failed for {story.get('slug')}: {e}")
+                return None
+    
+    return await asyncio.gather(*(guarded(s) for s in stories))
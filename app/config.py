@@ -3,6 +3,7 @@ Application Configuration
 Load settings from environment variables with validation
 """
 import os
+import importlib.util
 from functools import lru_cache
 from pydantic_settings import BaseSettings
 from dotenv import load_dotenv
@@ -16,6 +17,8 @@ class Settings(BaseSettings):
     # Supabase
     supabase_url: str = os.getenv("SUPABASE_URL", "")
     supabase_key: str = os.getenv("SUPABASE_KEY", "")
+    database_url: str = os.getenv("DATABASE_URL", "")  # Direct Postgres DSN (asyncpg), "" = PostgREST only
+    database_statement_cache: int = int(os.getenv("DATABASE_STATEMENT_CACHE", "1024"))  # Prepared statements / connection
     
     # Redis
     redis_url: str = os.getenv("REDIS_URL", "redis://localhost:6379/0")
@@ -27,7 +30,15 @@ class Settings(BaseSettings):
     # Crawler
     crawl_delay_min: int = int(os.getenv("CRAWL_DELAY_MIN", "3"))
     crawl_delay_max: int = int(os.getenv("CRAWL_DELAY_MAX", "10"))
+    crawl_rate: float = float(os.getenv("CRAWL_RATE", "2"))  # Requests/second to the source site, all workers
     max_concurrent_crawls: int = int(os.getenv("MAX_CONCURRENT_CRAWLS", "2"))
+    sync_concurrency: int = int(os.getenv("SYNC_CONCURRENCY", "8"))  # Offline sync parallel fetches
+    chapter_concurrency: int = int(os.getenv("CHAPTER_CONCURRENCY", "4"))  # Playwright pages per story (~RAM)
+    pagination_concurrency: int = int(os.getenv("PAGINATION_CONCURRENCY", "5"))  # Chapter-list pages fetched at once
+    browser_profile_dir: str = os.getenv("BROWSER_PROFILE_DIR", ".cache/browser-profile")  # "" = ephemeral context
+    chapter_cache_dir: str = os.getenv("CHAPTER_CACHE_DIR", ".cache/chapters")  # Crawl checkpoint, "" = off
+    chapter_cache_ttl: int = int(os.getenv("CHAPTER_CACHE_TTL", "86400"))  # Seconds a checkpoint stays valid
+    respect_robots: bool = os.getenv("RESPECT_ROBOTS", "true").lower() == "true"  # robots.txt Disallow + Crawl-delay
     
     # API
     api_host: str = os.getenv("API_HOST", "0.0.0.0")
@@ -66,3 +77,15 @@ USER_AGENTS = [
     "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/119.0.0.0 Safari/537.36",
     "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:120.0) Gecko/20100101 Firefox/120.0",
 ]
+
+
+# Default headers for fetching pages from the target website
+DEFAULT_HEADERS = {
+    "User-Agent": USER_AGENTS[0],
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8",
+    "Accept-Language": "vi-VN,vi;q=0.9,en;q=0.8",
+    "Referer": "https://truyenfull.vision/",
+}
+
+# httpx chỉ bật HTTP/2 khi có package h2 (httpx[http2])
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
@@ -3,56 +3,178 @@ Playwright Browser Manager
 Handles browser lifecycle and page creation with stealth mode
 """
 import asyncio
-from typing import Optional
+import os
+import psutil
+try:
+    import fcntl
+except ImportError:  # Windows: chỉ tránh trùng slot trong cùng process
+    fcntl = None
+from typing import Optional, List
 from contextlib import asynccontextmanager
 from playwright.async_api import async_playwright, Browser, BrowserContext, Page
 
+from ..config import get_settings
 from .stealth import get_stealth_context_options, inject_stealth_scripts, simulate_human_behavior, human_delay
 
 
+# Chromium stealth args + RENDER OPTIMIZATION (512MB RAM)
+CHROMIUM_ARGS = (
+    "--disable-blink-features=AutomationControlled",
+    "--disable-dev-shm-usage",  # Critical for Render
+    "--no-sandbox",
+    "--disable-setuid-sandbox",
+    "--disable-web-security",
+    "--disable-features=IsolateOrigins,site-per-process",
+    "--disable-infobars",
+    "--window-size=1280,720",  # Reduced from 1920x1080
+    "--disable-gpu",
+    "--disable-software-rasterizer",
+    "--disable-extensions",
+    "--disable-background-networking",
+    "--disable-sync",
+    "--metrics-recording-only",
+)
+
+# Chỉ dùng khi thiếu RAM (Render 512MB): 1 process cho cả renderer -> render chậm hơn
+LOW_MEMORY_ARGS = CHROMIUM_ARGS + ("--single-process",)
+
+# Dưới ngưỡng RAM trống này thì bật low-memory mode
+LOW_MEMORY_THRESHOLD = 1024 * 1024 * 1024  # 1 GB
+
+
+def _detect_low_memory() -> bool:
+    """True khi máy ít RAM trống (hoặc không đo được)"""
+    try:
+        return psutil.virtual_memory().available < LOW_MEMORY_THRESHOLD
+    except Exception:
+        return True
+
+# Resources không cần cho việc lấy HTML
+_BLOCKED_EXTENSIONS = (
+    "png", "jpg", "jpeg", "gif", "svg", "ico", "webp",
+    "woff", "woff2", "ttf", "otf", "css", "mp4",
+)
+
+# Tracker / quảng cáo: không ảnh hưởng nội dung chương
+_BLOCKED_HOSTS = (
+    "google-analytics.com", "googletagmanager.com", "googlesyndication.com",
+    "doubleclick.net", "adservice.google.com", "connect.facebook.net",
+)
+
+# "*.png" không khớp "a.png?v=2" -> thêm pattern có query string
+BLOCKED_URL_PATTERNS = [
+    *(f"*.{ext}" for ext in _BLOCKED_EXTENSIONS),
+    *(f"*.{ext}?*" for ext in _BLOCKED_EXTENSIONS),
+    *(f"*{host}/*" for host in _BLOCKED_HOSTS),
+]
+
+# Chromium khóa user_data_dir -> mỗi BrowserManager đang chạy giữ 1 slot riêng
+# Slot được giữ bằng flock trên {slot}.lock: API + các Celery worker dùng chung volume
+# không tranh cùng 1 profile (lock tự nhả khi process chết)
+_profile_slots_in_use: set = set()
+
+
+def _claim_profile_slot(profile_dir: str):
+    """Claim the first free profile slot -> (slot, lock file hoặc None)"""
+    os.makedirs(profile_dir, exist_ok=True)
+    slot = 0
+    while True:
+        if slot not in _profile_slots_in_use:
+            if fcntl is None:
+                _profile_slots_in_use.add(slot)
+                return slot, None
+            lock = open(os.path.join(profile_dir, f"{slot}.lock"), "w")
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock.close()  # Process khác đang dùng slot này
+            else:
+                _profile_slots_in_use.add(slot)
+                return slot, lock
+        slot += 1
+
+
+def _release_profile_slot(slot: int, lock) -> None:
+    _profile_slots_in_use.discard(slot)
+    if lock is not None:
+        lock.close()  # đóng file -> nhả flock
+
+
 class BrowserManager:
     """
     Manages Playwright browser instance with stealth configuration
     """
     
-    def __init__(self):
+    def __init__(self, low_memory: Optional[bool] = None):
+        """
+        Args:
+            low_memory: Thêm --single-process (None = tự phát hiện theo RAM trống)
+        """
+        self._low_memory = _detect_low_memory() if low_memory is None else low_memory
+        self._launch_args = LOW_MEMORY_ARGS if self._low_memory else CHROMIUM_ARGS
         self._playwright = None
         self._browser: Optional[Browser] = None
         self._context: Optional[BrowserContext] = None
+        self._user_agent: Optional[str] = None
+        self._profile_dir = get_settings().browser_profile_dir
+        self._profile_slot: Optional[int] = None
+        self._profile_lock = None
     
     async def start(self) -> None:
         """Initialize browser"""
         self._playwright = await async_playwright().start()
         
-        # Launch Chromium with stealth args + RENDER OPTIMIZATION (512MB RAM)
+        if self._profile_dir:
+            # Persistent profile: HTTP cache, cookies (Cloudflare) giữ lại giữa các lần chạy
+            self._profile_slot, self._profile_lock = _claim_profile_slot(self._profile_dir)
+            await self._new_context()
+            return
+        
         self._browser = await self._playwright.chromium.launch(
             headless=True,
-            args=[
-                "--disable-blink-features=AutomationControlled",
-                "--disable-dev-shm-usage",  # Critical for Render
-                "--no-sandbox",
-                "--disable-setuid-sandbox",
-                "--disable-web-security",
-                "--disable-features=IsolateOrigins,site-per-process",
-                "--disable-infobars",
-                "--window-size=1280,720",  # Reduced from 1920x1080
-                "--disable-gpu",
-                "--disable-software-rasterizer",
-                "--disable-extensions",
-                "--disable-background-networking",
-                "--disable-sync",
-                "--metrics-recording-only",
-                "--single-process",  # Less RAM, slightly slower
-            ]
+            args=self._launch_args,
         )
         
-        # Create context with stealth options
+        await self._new_context()
+    
+    async def _new_context(self) -> None:
+        """Create context with stealth options"""
         context_options = get_stealth_context_options()
-        self._context = await self._browser.new_context(**context_options)
+        self._user_agent = context_options["user_agent"]
+        
+        if self._browser:
+            self._context = await self._browser.new_context(**context_options)
+        else:
+            user_data_dir = os.path.join(self._profile_dir, str(self._profile_slot))
+            os.makedirs(user_data_dir, exist_ok=True)
+            self._context = await self._playwright.chromium.launch_persistent_context(
+                user_data_dir,
+                headless=True,
+                args=self._launch_args,
+                **context_options,
+            )
         
-        # Block unnecessary resources to speed up crawling
-        await self._context.route("**/*.{png,jpg,jpeg,gif,svg,ico,woff,woff2}", 
-                                   lambda route: route.abort())
+        # Stealth script đăng ký 1 lần cho context, mọi page mới đều được inject
+        await inject_stealth_scripts(self._context)
+    
+    async def recycle_context(self) -> None:
+        """
+        Replace the browser context
+        Dùng trong crawl dài để tránh leak của context/route và đổi fingerprint
+        (persistent profile: relaunch Chromium, cache/cookies vẫn giữ trên disk)
+        """
+        if self._context:
+            await self._context.close()
+        await self._new_context()
+    
+    @property
+    def user_agent(self) -> Optional[str]:
+        """User-Agent of the current context"""
+        return self._user_agent
+    
+    async def cookies(self) -> List[dict]:
+        """Cookies of the current context (vd cookie clearance sau JS challenge)"""
+        return await self._context.cookies() if self._context else []
     
     async def stop(self) -> None:
         """Close browser and cleanup"""
@@ -62,27 +184,40 @@ class BrowserManager:
             await self._browser.close()
         if self._playwright:
             await self._playwright.stop()
+        if self._profile_slot is not None:
+            _release_profile_slot(self._profile_slot, self._profile_lock)
+            self._profile_slot = None
+            self._profile_lock = None
     
     @asynccontextmanager
     async def new_page(self):
-        """Create a new page with stealth scripts"""
+        """Create a new page (stealth scripts come from the context)"""
         if not self._context:
             await self.start()
         
         page = await self._context.new_page()
         
-        # Inject stealth scripts
-        await inject_stealth_scripts(page)
+        # Block unnecessary resources inside Chromium (no per-request round trip to Python)
+        cdp = await self._context.new_cdp_session(page)
+        await cdp.send("Network.enable")
+        await cdp.send("Network.setBlockedURLs", {"urls": BLOCKED_URL_PATTERNS})
         
         try:
             yield page
         finally:
             await page.close()
     
-    async def navigate(self, page: Page, url: str, wait_until: str = "domcontentloaded") -> None:
-        """Navigate to URL with human-like behavior"""
+    async def navigate(
+        self, page: Page, url: str, wait_until: str = "domcontentloaded", polite: bool = True
+    ) -> None:
+        """
+        Navigate to URL with human-like behavior
+        
+        polite=False: bỏ human_delay trước/sau (caller tự giới hạn tốc độ bằng crawl_limiter)
+        """
         # Add human delay before navigation
-        await human_delay(1, 3)
+        if polite:
+            await human_delay(1, 3)
         
         await page.goto(url, wait_until=wait_until, timeout=30000)
         
@@ -90,7 +225,8 @@ class BrowserManager:
         await simulate_human_behavior(page)
         
         # Additional delay after navigation
-        await human_delay(2, 4)
+        if polite:
+            await human_delay(2, 4)
     
     async def get_page_content(self, page: Page) -> str:
         """Get page HTML content"""
@@ -99,7 +235,7 @@ class BrowserManager:
 
 # Context manager for easy usage
 @asynccontextmanager
-async def create_browser():
+async def create_browser(low_memory: Optional[bool] = None):
     """
     Context manager to create and manage browser instance
     
@@ -109,7 +245,7 @@ async def create_browser():
                 await browser.navigate(page, url)
                 content = await browser.get_page_content(page)
     """
-    browser = BrowserManager()
+    browser = BrowserManager(low_memory)
     try:
         await browser.start()
         yield browser
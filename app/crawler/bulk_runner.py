@@ -5,131 +5,204 @@ import asyncio
 import sys
 import os
 from pathlib import Path
-from datetime import datetime, timezone
+from typing import Optional
 
 # Setup path
 project_root = str(Path(__file__).parent.parent.parent)
 if project_root not in sys.path:
     sys.path.append(project_root)
 
-if sys.platform == "win32":
-    asyncio.set_event_loop_policy(asyncio.WindowsProactorEventLoopPolicy())
+# Loop policy chỉ đặt khi chạy như script; import từ worker pool (trong API)
+# thì giữ nguyên loop của uvicorn (loop="auto" đã dùng uvloop)
+if __name__ == "__main__":
+    if sys.platform == "win32":
+        asyncio.set_event_loop_policy(asyncio.WindowsProactorEventLoopPolicy())
+    else:
+        # uvloop: event loop nhanh hơn cho crawler nhiều I/O (Linux/Render)
+        try:
+            import uvloop
+            asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+        except ImportError:
+            pass
+
+from app.database import Database, ChapterBuffer, db as shared_db
+from app.crawler.crawler import StoryCrawler, StoryRecord, CATEGORY_URLS
+from app.crawler.chapter_cache import discard_chapter_cache
+from app.crawler.browser import BrowserManager
+from app.log import get_logger
+
+logger = get_logger("crawler.bulk")
+
+# Đổi browser context sau mỗi N truyện (tránh leak khi chạy lâu)
+CONTEXT_RECYCLE_EVERY = 50
+
+# Số chapters gom lại cho 1 lần upsert (1 round trip thay vì 100)
+CHAPTER_FLUSH_SIZE = 100
 
-from app.database import Database
-from app.crawler.crawler import StoryCrawler
+# Pipeline: listing -> url_queue -> story workers -> record_queue -> db writer
+URL_QUEUE_SIZE = 200
+STORY_BATCH_SIZE = 50
+# Chỉ metadata: N workers song song; crawl chapters: 1 worker (dùng chung 1 Chromium)
+STORY_WORKERS = 4
 
-async def bulk_crawl_stories(bulk_task_id: str, categories: list, max_pages: int, crawl_chapters: bool):
+
+async def bulk_crawl_stories(
+    bulk_task_id: str,
+    categories: list,
+    max_pages: int,
+    crawl_chapters: bool,
+    db: Optional[Database] = None,
+):
     """
     Crawl toàn bộ truyện từ các trang danh sách
+    Listing, crawl truyện và ghi DB chạy chồng lên nhau thay vì 2 bước tuần tự
     """
-    print(f"🚀 Bulk Crawler: Starting task {bulk_task_id}")
-    print(f"📚 Categories: {categories}, Max pages: {max_pages}")
+    logger.info("🚀 Bulk Crawler: Starting task %s", bulk_task_id)
+    logger.info("📚 Categories: %s, Max pages: %s", categories, max_pages)
     
-    db = Database()
+    db = db or shared_db
+    # Dùng trong `async with`: listing/story page bị chặn dùng chung 1 Chromium của crawler
     crawler = StoryCrawler()
     
-    # Map categories to URLs
-    category_urls = {
-        "hot": f"{crawler.settings.base_url}/danh-sach/truyen-hot/",
-        "new": f"{crawler.settings.base_url}/danh-sach/truyen-moi/",
-        "completed": f"{crawler.settings.base_url}/danh-sach/truyen-full/",
-    }
+    # Chromium đó launch ngay khi crawl nội dung chương (K pages / truyện)
+    browser: Optional[BrowserManager] = None
+    num_workers = 1 if crawl_chapters else STORY_WORKERS
     
-    all_stories_urls = []
+    url_queue: asyncio.Queue = asyncio.Queue(maxsize=URL_QUEUE_SIZE)
+    record_queue: asyncio.Queue = asyncio.Queue(maxsize=STORY_BATCH_SIZE * 4)
+    stats = {"unique": 0, "processed": 0}
     
-    try:
-        # Bước 1: Lấy danh sách URLs của tất cả truyện
-        for category in categories:
-            if category not in category_urls:
-                print(f"⚠️ Unknown category: {category}")
-                continue
-            
-            print(f"\n📖 Crawling category: {category}")
-            list_url = category_urls[category]
-            
-            stories = await crawler.crawl_story_list(list_url, max_pages=max_pages)
-            print(f"✅ Found {len(stories)} stories in {category}")
+    async def list_producer():
+        """Bước 1: stream URLs truyện từ listing pages (khử trùng ngay khi thêm)"""
+        seen_urls: dict[str, None] = {}
+        try:
+            for category in categories:
+                if category not in CATEGORY_URLS:
+                    logger.warning("⚠️ Unknown category: %s", category)
+                    continue
+                
+                logger.info("\n📖 Crawling category: %s", category)
+                async for stories in crawler.iter_story_list(CATEGORY_URLS[category], max_pages=max_pages):
+                    for story in stories:
+                        url = story.get("source_url")
+                        if url and url not in seen_urls:
+                            seen_urls[url] = None
+                            await url_queue.put(url)
+        finally:
+            stats["unique"] = len(seen_urls)
+            logger.info("\n🎯 Total unique stories: %s", len(seen_urls))
+            for _ in range(num_workers):
+                await url_queue.put(None)
+    
+    async def save_story_with_chapters(story_data: dict, story_record: StoryRecord):
+        """Lưu truyện (cần story_id ngay) rồi crawl + lưu chapters"""
+        saved_story = await db.upsert_story(story_record.to_row())
+        story_id = saved_story.get("id") if saved_story else None
+        
+        if not story_id:
+            logger.error("❌ Failed to save story: %s", story_data['title'])
+            return
+        
+        logger.info("✅ Saved story: %s (%s chapters)", story_data['title'], story_data.get('total_chapters', 0))
+        
+        if not story_data.get("chapters"):
+            return
+        
+        chapters = story_data["chapters"]
+        total_chapters = len(chapters)
+        logger.info("📄 Crawling %s chapters...", total_chapters)
+        
+        buffer = ChapterBuffer(db, max_rows=CHAPTER_FLUSH_SIZE)
+        
+        async def save_chapter(j: int, chapter_data: dict):
+            """Buffer one crawled chapter (flush every CHAPTER_FLUSH_SIZE or ~1M chars of content)"""
+            # Log mỗi 10 chương
+            if j % 10 == 0:
+                logger.info("  [%s/%s] Crawling chapters...", j+1, total_chapters)
             
-            # Lấy URL của từng truyện
-            for story in stories:
-                if story.get("source_url"):
-                    all_stories_urls.append(story["source_url"])
+            chapter_info = chapters[j]
+            if chapter_data and chapter_data.get("content"):
+                chapter_record = {
+                    "story_id": story_id,
+                    "chapter_number": chapter_info.get("chapter_number", j + 1),
+                    "title": chapter_data.get("title") or chapter_info.get("title"),
+                    "content": chapter_data.get("content", ""),
+                    "source_url": chapter_info["source_url"],
+                }
+                await buffer.add(chapter_record)
+        
+        try:
+            await crawler.crawl_chapters_parallel(browser, chapters, on_chapter=save_chapter)
+        finally:
+            # Lưu phần còn lại (kể cả khi crawl lỗi giữa chừng)
+            await buffer.flush()
+            if buffer.skipped:
+                logger.info("⏭️ %s unchanged chapters skipped", buffer.skipped)
         
-        # Loại bỏ trùng lặp
-        all_stories_urls = list(set(all_stories_urls))
-        print(f"\n🎯 Total unique stories: {len(all_stories_urls)}")
+        # Mọi chương đã vào DB -> checkpoint không còn cần
+        if not buffer.failed:
+            discard_chapter_cache(chapters[0]["source_url"])
         
-        # Bước 2: Crawl từng truyện
-        for i, story_url in enumerate(all_stories_urls):
+        logger.info("✅ Finished crawling chapters for: %s", story_data['title'])
+    
+    async def story_worker():
+        """Bước 2: crawl từng truyện ngay khi URL có trong queue"""
+        while (story_url := await url_queue.get()) is not None:
+            stats["processed"] += 1
+            i = stats["processed"]
             try:
-                print(f"\n[{i+1}/{len(all_stories_urls)}] Crawling: {story_url}")
+                logger.info("\n[%s] Crawling: %s", i, story_url)
+                
+                if browser and i > 1 and (i - 1) % CONTEXT_RECYCLE_EVERY == 0:
+                    await browser.recycle_context()
                 
                 # Crawl story info
                 story_data = await crawler.crawl_story(story_url, include_chapters=False)
+                story_record = StoryRecord.from_crawl(story_data)
                 
-                # Save story to DB
-                story_record = {
-                    "slug": story_data["slug"],
-                    "title": story_data["title"],
-                    "author": story_data.get("author"),
-                    "description": story_data.get("description"),
-                    "genres": story_data.get("genres", []),
-                    "status": "Full" if story_data.get("status") == "completed" else "Đang ra",
-                    "total_chapters": story_data.get("total_chapters", 0),
-                    "cover_url": story_data.get("cover_url"),
-                    "source_url": story_data.get("source_url"),
-                    "updated_at": datetime.now(timezone.utc).isoformat(),
-                }
-                
-                saved_story = await db.upsert_story(story_record)
-                story_id = saved_story.get("id") if saved_story else None
-                
-                if not story_id:
-                    existing = await db.get_story_by_slug(story_data["slug"])
-                    story_id = existing["id"] if existing else None
-                
-                if not story_id:
-                    print(f"❌ Failed to save story: {story_data['title']}")
-                    continue
-                
-                print(f"✅ Saved story: {story_data['title']} ({story_data.get('total_chapters', 0)} chapters)")
-                
-                # Crawl chapters nếu được yêu cầu
-                if crawl_chapters and story_data.get("chapters"):
-                    total_chapters = len(story_data["chapters"])
-                    print(f"📄 Crawling {total_chapters} chapters...")
-                    
-                    for j, chapter_info in enumerate(story_data["chapters"]):
-                        try:
-                            # Update mỗi 10 chương
-                            if j % 10 == 0:
-                                print(f"  [{j+1}/{total_chapters}] Crawling chapters...")
-                            
-                            chapter_data = await crawler.crawl_single_chapter(chapter_info["source_url"])
-                            
-                            if chapter_data and chapter_data.get("content"):
-                                chapter_record = {
-                                    "story_id": story_id,
-                                    "chapter_number": chapter_info.get("chapter_number", j + 1),
-                                    "title": chapter_data.get("title") or chapter_info.get("title"),
-                                    "content": chapter_data.get("content", ""),
-                                    "source_url": chapter_info["source_url"],
-                                }
-                                await db.upsert_chapter(chapter_record)
-                        except Exception as e:
-                            print(f"  ❌ Error chapter {j+1}: {e}")
-                            continue
-                    
-                    print(f"✅ Finished crawling chapters for: {story_data['title']}")
+                if crawl_chapters:
+                    await save_story_with_chapters(story_data, story_record)
+                else:
+                    await record_queue.put(story_record.to_row())
                 
             except Exception as e:
-                print(f"❌ Error crawling {story_url}: {e}")
-                continue
+                logger.error("❌ Error crawling %s: %s", story_url, e)
+    
+    async def db_writer():
+        """Bước 3: upsert truyện theo batch (chỉ metadata)"""
+        # slug -> row (1 batch upsert không được chạm cùng 1 dòng 2 lần)
+        batch = {}
+        while True:
+            row = await record_queue.get()
+            if row is not None:
+                batch[row["slug"]] = row
+            if batch and (row is None or len(batch) >= STORY_BATCH_SIZE):
+                try:
+                    saved = await db.upsert_stories_bulk(list(batch.values()))
+                    logger.info("✅ Saved %s/%s stories", len(saved), len(batch))
+                except Exception as e:
+                    logger.error("❌ Failed to save %s stories: %s", len(batch), e)
+                batch = {}
+            if row is None:
+                return
+    
+    try:
+        async with crawler:
+            if crawl_chapters:
+                async with crawler.use_browser() as browser:
+                    pass
+            
+            writer = asyncio.create_task(db_writer())
+            try:
+                await asyncio.gather(list_producer(), *(story_worker() for _ in range(num_workers)))
+            finally:
+                await record_queue.put(None)
+                await writer
         
-        print(f"\n🎉 Bulk crawl completed! Total stories processed: {len(all_stories_urls)}")
+        logger.info("\n🎉 Bulk crawl completed! Total stories processed: %s", stats['processed'])
         
     except Exception as e:
-        print(f"❌ Bulk crawler failed: {e}")
+        logger.error("❌ Bulk crawler failed: %s", e)
 
 if __name__ == "__main__":
     if len(sys.argv) < 4:
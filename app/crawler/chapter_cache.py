@@ -0,0 +1,143 @@
+"""
+Chapter Cache - Checkpoint nội dung chương đã crawl trên disk (SQLite, 1 file / truyện)
+Crawl bị crash giữa chừng -> chạy lại chỉ tải các chương chưa có
+
+Vòng đời: file của truyện bị xóa khi mọi chương đã lưu vào DB (discard_chapter_cache).
+Checkpoint cũ hơn CHAPTER_CACHE_TTL bị bỏ qua (crawl lại lấy nội dung mới) và file
+không được ghi quá TTL bị xóa khi mở cache lần đầu trong process
+"""
+import json
+import os
+import sqlite3
+import time
+from typing import Optional, Dict, Any
+from urllib.parse import urlparse
+
+from ..config import get_settings
+from ..log import get_logger
+
+logger = get_logger("crawler.cache")
+
+# Commit sau mỗi N chương (checkpoint), phần còn lại commit khi close()
+COMMIT_EVERY = 20
+
+# Đọc 1 lần: open_chapter_cache được gọi cho từng chương
+_CACHE_DIR = get_settings().chapter_cache_dir
+_CACHE_TTL = get_settings().chapter_cache_ttl
+
+# Dọn file hết hạn 1 lần / process
+_pruned = False
+
+
+class ChapterCache:
+    """
+    Parsed chapters keyed by source_url
+    """
+    
+    def __init__(self, path: str):
+        self._conn = sqlite3.connect(path, timeout=5)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS chapters "
+            "(url TEXT PRIMARY KEY, parsed TEXT NOT NULL, stored_at REAL NOT NULL DEFAULT 0)"
+        )
+        try:
+            # File tạo trước khi có TTL: dòng cũ có stored_at = 0 -> hết hạn
+            self._conn.execute("ALTER TABLE chapters ADD COLUMN stored_at REAL NOT NULL DEFAULT 0")
+        except sqlite3.OperationalError:
+            pass
+        self._uncommitted = 0
+    
+    def get(self, url: str) -> Optional[Dict[str, Any]]:
+        """Cached parsed chapter or None (also None once older than CHAPTER_CACHE_TTL)"""
+        try:
+            row = self._conn.execute(
+                "SELECT parsed FROM chapters WHERE url = ? AND stored_at >= ?",
+                (url, time.time() - _CACHE_TTL),
+            ).fetchone()
+        except sqlite3.Error:
+            return None
+        return json.loads(row[0]) if row else None
+    
+    def put(self, url: str, chapter: Dict[str, Any]) -> None:
+        """Store a successfully parsed chapter"""
+        try:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO chapters (url, parsed, stored_at) VALUES (?, ?, ?)",
+                (url, json.dumps(chapter, ensure_ascii=False), time.time()),
+            )
+            self._uncommitted += 1
+            if self._uncommitted >= COMMIT_EVERY:
+                self._conn.commit()
+                self._uncommitted = 0
+        except sqlite3.Error as e:
+            logger.warning("[ChapterCache] Write failed for %s: %s", url, e)
+    
+    def close(self) -> None:
+        try:
+            self._conn.commit()
+        finally:
+            self._conn.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _cache_path(chapter_url: str) -> Optional[str]:
+    """{CHAPTER_CACHE_DIR}/{story slug}.db, None when the cache is off"""
+    if not _CACHE_DIR:
+        return None
+    slug = urlparse(chapter_url).path.strip("/").split("/")[0]
+    if not slug:
+        return None
+    return os.path.join(_CACHE_DIR, f"{slug}.db")
+
+
+def _prune_expired() -> None:
+    """Delete story caches not written for CHAPTER_CACHE_TTL (crawl bỏ dở, không bao giờ xong)"""
+    global _pruned
+    if _pruned:
+        return
+    _pruned = True
+    cutoff = time.time() - _CACHE_TTL
+    try:
+        with os.scandir(_CACHE_DIR) as entries:
+            for entry in entries:
+                if entry.name.endswith(".db") and entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+    except OSError as e:
+        logger.warning("[ChapterCache] Prune failed: %s", e)
+
+
+def open_chapter_cache(chapter_url: str) -> Optional[ChapterCache]:
+    """
+    Open the cache of the story a chapter URL belongs to
+    (None nếu CHAPTER_CACHE_DIR rỗng hoặc không mở được)
+    """
+    path = _cache_path(chapter_url)
+    if not path:
+        return None
+    
+    try:
+        os.makedirs(_CACHE_DIR, exist_ok=True)
+        _prune_expired()
+        return ChapterCache(path)
+    except (OSError, sqlite3.Error) as e:
+        logger.warning("[ChapterCache] Disabled for %s: %s", path, e)
+        return None
+
+
+def discard_chapter_cache(chapter_url: str) -> None:
+    """Delete a story's checkpoint once its chapters are persisted"""
+    path = _cache_path(chapter_url)
+    if not path:
+        return
+    for file in (path, f"{path}-journal"):
+        try:
+            os.remove(file)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning("[ChapterCache] Could not delete %s: %s", file, e)
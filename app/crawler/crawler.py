@@ -3,19 +3,203 @@ Main Crawler Module
 High-level crawling functions including chapter content
 """
 import asyncio
-from typing import Dict, Any, List, Optional
-from datetime import datetime
+import random
+import weakref
+import aiohttp
+from contextlib import nullcontext, asynccontextmanager
+from http.cookies import SimpleCookie
+from dataclasses import dataclass, field, asdict
+from typing import Dict, Any, List, Optional, Union, Callable, Awaitable, AsyncIterator
+from datetime import datetime, timezone
 
 from .browser import create_browser, BrowserManager
 from .parsers import (
     parse_story_list,
     parse_story_detail,
+    parse_chapter_list,
     parse_chapter_content,
     get_pagination_info,
-    extract_slug_from_url,
+    get_total_pages,
+    parse_html,
 )
-from .stealth import human_delay
-from ..config import get_settings
+from .stealth import crawl_limiter
+from .robots import get_robots, RobotsDisallowed
+from .chapter_cache import open_chapter_cache
+from ..config import get_settings, DEFAULT_HEADERS
+from ..log import get_logger
+
+logger = get_logger("crawler")
+
+# Settings không đổi trong process -> đọc 1 lần, dùng chung cho mọi StoryCrawler
+_SETTINGS = get_settings()
+
+# Chương lẻ chỉ log ở DEBUG; ở INFO chỉ báo tiến độ mỗi N chương
+PROGRESS_LOG_EVERY = 50
+
+# Tải 1 chương quá N giây -> bỏ qua (không giữ worker mãi vì 1 chương bị treo)
+CHAPTER_TIMEOUT = 60
+
+# Chương lỗi ở lượt chính: thử lại tuần tự ở cuối, backoff RETRY_BASE_DELAY * 2^n (+ jitter)
+# Lần thử đầu chỉ chờ khi chương bị 429/503; cả lượt retry dừng sau RETRY_BUDGET giây
+CHAPTER_RETRIES = 3
+RETRY_BASE_DELAY = 2.0
+RETRY_BUDGET = 300
+
+# Retry-After lớn hơn mức này thì không chờ (coi như bị chặn lâu, để browser xử lý)
+MAX_RETRY_AFTER = 120
+
+# Listing pages theo category (build 1 lần)
+CATEGORY_URLS = {
+    "hot": f"{_SETTINGS.base_url}/danh-sach/truyen-hot/",
+    "new": f"{_SETTINGS.base_url}/danh-sach/truyen-moi/",
+    "completed": f"{_SETTINGS.base_url}/danh-sach/truyen-full/",
+}
+
+
+class CrawlCancelled(Exception):
+    """Raised from an on_chapter callback to stop crawl_chapters_parallel early"""
+
+
+@dataclass(slots=True)
+class StoryRecord:
+    """Row for the stories table built from crawl_story() output"""
+    slug: str
+    title: str
+    author: Optional[str] = None
+    description: Optional[str] = None
+    genres: List[str] = field(default_factory=list)
+    status: str = "Đang ra"
+    total_chapters: int = 0
+    cover_url: Optional[str] = None
+    source_url: Optional[str] = None
+    updated_at: str = ""
+    
+    @classmethod
+    def from_crawl(cls, story_data: Dict[str, Any]) -> "StoryRecord":
+        return cls(
+            slug=story_data["slug"],
+            title=story_data["title"],
+            author=story_data.get("author"),
+            description=story_data.get("description"),
+            genres=story_data.get("genres", []),
+            status="Full" if story_data.get("status") == "completed" else "Đang ra",
+            total_chapters=story_data.get("total_chapters", 0),
+            cover_url=story_data.get("cover_url"),
+            source_url=story_data.get("source_url"),
+            updated_at=datetime.now(timezone.utc).isoformat(),
+        )
+    
+    def to_row(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+# Trang HTML nhỏ hơn mức này coi như bị chặn / JS challenge
+MIN_HTML_LENGTH = 2000
+CHALLENGE_STATUS = {403, 429, 503}
+THROTTLE_STATUS = {429, 503}
+
+
+# Shared session cho các trang server-rendered (listing, phân trang chương)
+# event loop -> session: aiohttp session gắn với loop tạo ra nó (Celery mở loop mới cho mỗi task)
+_sessions = weakref.WeakKeyDictionary()
+
+
+def get_session() -> aiohttp.ClientSession:
+    """Get (lazily create) the pooled aiohttp session for static pages on the running loop"""
+    loop = asyncio.get_running_loop()
+    session = _sessions.get(loop)
+    if session is None or session.closed:
+        session = aiohttp.ClientSession(
+            timeout=aiohttp.ClientTimeout(total=30),
+            headers=DEFAULT_HEADERS,
+            # Keep-alive theo host: các trang phân trang dùng lại kết nối TLS thay vì handshake mới
+            # (aiohttp tự gửi Accept-Encoding gzip/deflate, + br khi có package Brotli)
+            connector=aiohttp.TCPConnector(limit=20, limit_per_host=6, ttl_dns_cache=600, keepalive_timeout=60),
+        )
+        _sessions[loop] = session
+    return session
+
+
+async def close_session():
+    """Close the running loop's pooled session (app shutdown / cuối mỗi Celery task)"""
+    session = _sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None:
+        await session.close()
+
+
+# User-Agent của browser đã qua JS challenge (cookie clearance gắn với UA này)
+_browser_user_agent: Optional[str] = None
+
+
+async def fetch_static(url: str, throttled: Optional[set] = None) -> Optional[Union[str, bytes]]:
+    """
+    GET a page over the shared session (caller handles rate limiting)
+    Returns None when blocked (403/429/503) or the body looks like a JS challenge
+    throttled: URLs trả về 429/503 được thêm vào set này
+    
+    Trang UTF-8 trả về bytes thô (parsers nhận thẳng, không decode sang str)
+    """
+    headers = {"User-Agent": _browser_user_agent} if _browser_user_agent else None
+    try:
+        async with get_session().get(url, headers=headers) as response:
+            if response.status in CHALLENGE_STATUS:
+                if throttled is not None and response.status in THROTTLE_STATUS:
+                    throttled.add(url)
+                # 429/503 + Retry-After: mọi worker chờ trước request tiếp theo
+                retry_after = response.headers.get("Retry-After", "")
+                if retry_after.isdigit() and int(retry_after) <= MAX_RETRY_AFTER:
+                    crawl_limiter.defer(int(retry_after))
+                return None
+            response.raise_for_status()
+            body = await response.read()
+            if len(body) <= MIN_HTML_LENGTH:
+                return None
+            charset = (response.charset or "utf-8").lower()
+            if charset in ("utf-8", "utf8"):
+                return body
+            return body.decode(charset, errors="replace")
+    except aiohttp.ClientResponseError:
+        raise
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logger.warning("  ⚠️ aiohttp failed for %s: %s", url, e)
+        return None
+
+
+async def adopt_browser_session(browser: BrowserManager) -> None:
+    """
+    Copy cookies + User-Agent from the browser into the shared session
+    Chromium giải JS challenge 1 lần, các request aiohttp sau dùng lại cookie clearance
+    """
+    global _browser_user_agent
+    try:
+        cookies = await browser.cookies()
+    except Exception as e:
+        logger.warning("  ⚠️ Could not read browser cookies: %s", e)
+        return
+    
+    jar = SimpleCookie()
+    for cookie in cookies:
+        jar[cookie["name"]] = cookie["value"]
+        jar[cookie["name"]]["domain"] = cookie["domain"]
+        jar[cookie["name"]]["path"] = cookie.get("path") or "/"
+    if jar:
+        get_session().cookie_jar.update_cookies(jar)
+        _browser_user_agent = browser.user_agent
+
+
+async def polite_slot(url: str) -> None:
+    """
+    Gate every request to the source site: robots.txt first, then global pacing
+    Crawl-delay trong robots.txt chỉ làm chậm crawl_limiter, không bao giờ nhanh hơn CRAWL_RATE
+    """
+    if _SETTINGS.respect_robots:
+        robots = await get_robots(get_session(), url)
+        if not robots.can_fetch(DEFAULT_HEADERS["User-Agent"], url):
+            raise RobotsDisallowed(url)
+        delay = robots.crawl_delay(DEFAULT_HEADERS["User-Agent"])
+        if delay:
+            crawl_limiter.slow_down(float(delay))
+    await crawl_limiter.acquire()
 
 
 class StoryCrawler:
@@ -24,151 +208,385 @@ class StoryCrawler:
     """
     
     def __init__(self):
-        self.settings = get_settings()
-        self.base_url = self.settings.base_url
+        self.settings = _SETTINGS
+        self.base_url = _SETTINGS.base_url
+        # Trong `async with StoryCrawler()`: 1 Chromium dùng chung cho mọi lần cần browser
+        self._shared_browser = False
+        self._browser: Optional[BrowserManager] = None
+        self._browser_lock = asyncio.Lock()
+    
+    async def __aenter__(self) -> "StoryCrawler":
+        self._shared_browser = True
+        return self
+    
+    async def __aexit__(self, *exc) -> None:
+        self._shared_browser = False
+        if self._browser:
+            await self._browser.stop()
+            self._browser = None
+    
+    @asynccontextmanager
+    async def use_browser(self, browser: Optional[BrowserManager] = None):
+        """
+        Browser for one operation: the one passed in, else the crawler's shared one
+        (launched on first use), else a temporary one outside `async with`
+        """
+        if browser:
+            yield browser
+        elif self._shared_browser:
+            # Lock: nhiều task cùng cần browser lần đầu -> chỉ launch 1 Chromium
+            async with self._browser_lock:
+                if self._browser is None:
+                    self._browser = BrowserManager()
+                    await self._browser.start()
+            yield self._browser
+        else:
+            async with create_browser() as temp_browser:
+                yield temp_browser
+    
+    async def _fetch_html(self, url: str, browser: Optional[BrowserManager] = None) -> Union[str, bytes]:
+        """
+        Fetch a server-rendered page with aiohttp; fall back to Playwright
+        only when blocked (403/429/503) or the body looks like a JS challenge
+        
+        Trang UTF-8 trả về bytes thô (parsers nhận thẳng, không decode sang str)
+        """
+        await polite_slot(url)
+        html = await fetch_static(url)
+        if html is not None:
+            return html
+        
+        logger.info("  🛡️ Blocked, retrying with browser: %s", url)
+        async with self.use_browser(browser) as b:
+            async with b.new_page() as page:
+                await crawl_limiter.acquire()
+                await b.navigate(page, url, polite=False)
+                html = await b.get_page_content(page)
+                await adopt_browser_session(b)
+                return html
     
-    async def crawl_story(self, url: str, include_chapters: bool = False) -> Dict[str, Any]:
+    async def crawl_story(
+        self, url: str, include_chapters: bool = False, browser: Optional[BrowserManager] = None
+    ) -> Dict[str, Any]:
         """
         Crawl a single story
         
         Args:
             url: Story URL
             include_chapters: Whether to crawl chapter content (takes longer)
+            browser: Reuse an already started browser (else launch one)
             
         Returns:
             Story data dict
         """
-        import httpx
-        from bs4 import BeautifulSoup
-        from .parsers import parse_chapter_list, get_pagination_info
+        logger.info("📖 Crawling story: %s", url)
         
-        print(f"📖 Crawling story: {url}")
+        # Plain HTTP for story page (faster, no JS needed)
+        # Fetch page 1
+        html = await self._fetch_html(url, browser)
         
-        # Use httpx for story page (faster, no JS needed)
-        async with httpx.AsyncClient(timeout=30.0, follow_redirects=True) as client:
-            # Fetch page 1
-            response = await client.get(url)
-            response.raise_for_status()
-            html = response.text
+        # Parse 1 lần, dùng chung tree cho story detail + pagination
+        tree = parse_html(html)
+        story = parse_story_detail(tree, url)
+        
+        # Get all chapters from pagination
+        all_chapters = story.get("chapters", [])
+        total_pages = get_total_pages(html, url, tree)
+        del tree
+        
+        if total_pages > 1:
+            logger.info("📄 Found %s pages of chapters, fetching all...", total_pages)
             
-            # Parse story details
-            story = parse_story_detail(html, url)
+            base = url.rstrip("/")
             
-            # Get all chapters from pagination
-            all_chapters = story.get("chapters", [])
-            pagination = get_pagination_info(html)
-            total_pages = pagination.get("total_pages", 1)
+            sem = asyncio.Semaphore(max(1, self.settings.pagination_concurrency))
             
-            if total_pages > 1:
-                print(f"📄 Found {total_pages} pages of chapters, fetching all...")
-                
-                for page_num in range(2, total_pages + 1):
+            async def fetch_page(page_num: int) -> List[Dict[str, Any]]:
+                """Fetch + parse ngay (chỉ giữ list chapters, không giữ HTML)"""
+                async with sem:
                     try:
-                        page_url = url.rstrip("/") + f"/trang-{page_num}/#list-chapter"
-                        print(f"  📃 Fetching page {page_num}/{total_pages}")
-                        
-                        response = await client.get(page_url)
-                        response.raise_for_status()
-                        
-                        soup = BeautifulSoup(response.text, "lxml")
-                        page_chapters = parse_chapter_list(soup, start_index=len(all_chapters) + 1)
-                        
-                        # Release memory immediately
-                        del soup
-                        del response
-                        
-                        all_chapters.extend(page_chapters)
-                        del page_chapters
-                        print(f"  ✅ +chapters (total: {len(all_chapters)})")
-                        
-                        # Rate limit + gc every 5 pages
-                        await asyncio.sleep(0.5)
-                        if page_num % 5 == 0:
-                            import gc
-                            gc.collect()
-                        
+                        page_html = await self._fetch_html(f"{base}/trang-{page_num}/#list-chapter", browser)
+                        return parse_chapter_list(page_html, start_index=None)
                     except Exception as e:
-                        print(f"  ⚠️ Error page {page_num}: {e}")
-                        continue
+                        logger.warning("  ⚠️ Error page %s: %s", page_num, e)
+                        return []
             
-            story["chapters"] = all_chapters
-            story["total_chapters"] = len(all_chapters)
-            
-            print(f"📚 Total chapters found: {len(all_chapters)}")
+            # Tất cả trang chạy song song (giới hạn bởi semaphore), ghép lại theo thứ tự trang
+            pages = await asyncio.gather(*(fetch_page(n) for n in range(2, total_pages + 1)))
+            for page_chapters in pages:
+                for chapter in page_chapters:
+                    # Số chương không đọc được -> vị trí trong danh sách (như start_index cũ)
+                    if not chapter["chapter_number"]:
+                        chapter["chapter_number"] = len(all_chapters) + 1
+                    all_chapters.append(chapter)
+            del pages
+            logger.info("  ✅ +chapters (total: %s)", len(all_chapters))
+        
+        story["chapters"] = all_chapters
+        story["total_chapters"] = len(all_chapters)
         
-        # Crawl chapter content (needs Playwright for anti-bot)
+        logger.info("📚 Total chapters found: %s", len(all_chapters))
+    
+        # Crawl chapter content (aiohttp trước, Playwright khi bị chặn)
         if include_chapters and story.get("chapters"):
-            print(f"📚 Crawling {len(story['chapters'])} chapter contents...")
-            async with create_browser() as browser:
-                async with browser.new_page() as page:
-                    story["chapters"] = await self._crawl_chapters(
-                        browser, page, story["chapters"]
-                    )
+            logger.info("📚 Crawling %s chapter contents...", len(story['chapters']))
+            async with self.use_browser(browser) as b:
+                story["chapters"] = await self.crawl_chapters_parallel(b, story["chapters"])
         
         return story
     
-    async def crawl_single_chapter(self, url: str) -> Dict[str, Any]:
+    async def crawl_single_chapter(self, url: str, browser: Optional[BrowserManager] = None) -> Dict[str, Any]:
         """
         Crawl a single chapter's content
         
         Args:
             url: Chapter URL
+            browser: Reuse an already started browser (else see use_browser)
             
         Returns:
             Chapter data with content
         """
-        async with create_browser() as browser:
-            async with browser.new_page() as page:
-                try:
-                    await browser.navigate(page, url)
-                    html = await browser.get_page_content(page)
-                    chapter = parse_chapter_content(html, url)
-                    return chapter
-                except Exception as e:
-                    print(f"Error crawling chapter {url}: {e}")
-                    return {"content": None, "error": str(e)}
+        cache = open_chapter_cache(url)
+        with cache or nullcontext():
+            cached = cache.get(url) if cache else None
+            if cached:
+                return cached
+            
+            try:
+                await polite_slot(url)
+                html = await fetch_static(url)
+                if html is None:
+                    # Chỉ cần Chromium khi bị chặn
+                    async with self.use_browser(browser) as b:
+                        async with b.new_page() as page:
+                            await b.navigate(page, url)
+                            html = await b.get_page_content(page)
+                        await adopt_browser_session(b)
+                chapter = parse_chapter_content(html, url)
+                if cache and chapter.get("content"):
+                    cache.put(url, chapter)
+                return chapter
+            except Exception as e:
+                logger.error("Error crawling chapter %s: %s", url, e)
+                return {"content": None, "error": str(e)}
     
-    async def _crawl_chapters(
-        self, 
-        browser: BrowserManager, 
-        page, 
+    async def crawl_chapters_parallel(
+        self,
+        browser: BrowserManager,
         chapters: List[Dict[str, Any]],
-        max_chapters: Optional[int] = None
+        concurrency: Optional[int] = None,
+        on_chapter: Optional[Callable[[int, Dict[str, Any]], Awaitable[None]]] = None,
+        max_chapters: Optional[int] = None,
     ) -> List[Dict[str, Any]]:
         """
-        Crawl chapter content for a list of chapters
+        Crawl chapter content with K pages working a shared queue
+        
+        Args:
+            browser: Started browser; all pages share its context
+            chapters: Chapter list (chapter_number, title, source_url)
+            concurrency: Number of pages (default CHAPTER_CONCURRENCY)
+            on_chapter: async callback(index, chapter_data) called as soon as
+                a chapter is done; khi có callback, kết quả không giữ lại trong RAM.
+                Raise CrawlCancelled trong callback -> hủy mọi chapter đang tải
+            max_chapters: Only crawl the first N chapters
+            
+        Returns:
+            Chapter data in input order (None entries when on_chapter is used)
         """
         if max_chapters:
             chapters = chapters[:max_chapters]
         
-        crawled_chapters = []
+        concurrency = max(1, min(concurrency or self.settings.chapter_concurrency, len(chapters) or 1))
+        results: List[Optional[Dict[str, Any]]] = [None] * len(chapters)
+        queue: asyncio.Queue = asyncio.Queue()
+        for item in enumerate(chapters):
+            queue.put_nowait(item)
         
-        for i, chapter in enumerate(chapters):
-            try:
-                print(f"  📄 Chapter {i+1}/{len(chapters)}: {chapter.get('title', 'Unknown')}")
-                
-                await browser.navigate(page, chapter["source_url"])
+        # Checkpoint: chương đã có trong cache (lần crawl trước bị ngắt) không tải lại
+        cache = open_chapter_cache(chapters[0]["source_url"]) if chapters else None
+        stats = {"done": 0, "failed": 0, "cached": 0}
+        # URL bị 429/503 ở lượt chính -> retry phải backoff trước lần thử đầu
+        throttled: set = set()
+        
+        async def fetch(page, url: str) -> Union[str, bytes]:
+            html = await fetch_static(url, throttled)
+            if html is None:
+                # Bị chặn -> Chromium qua challenge, cookies dùng lại cho các chương sau
+                await crawl_limiter.acquire()
+                await browser.navigate(page, url, polite=False)
                 html = await browser.get_page_content(page)
+                await adopt_browser_session(browser)
+            return html
+        
+        async def crawl_one(page, i: int, chapter: Dict[str, Any]) -> Dict[str, Any]:
+            try:
+                url = chapter["source_url"]
+                cached = cache.get(url) if cache else None
+                if cached:
+                    stats["cached"] += 1
+                    cached["chapter_number"] = chapter.get("chapter_number", i + 1)
+                    return cached
                 
-                chapter_data = parse_chapter_content(html, chapter["source_url"])
-                chapter_data["chapter_number"] = chapter.get("chapter_number", i + 1)
-                
-                crawled_chapters.append(chapter_data)
+                logger.debug("  📄 Chapter %s/%s: %s", i+1, len(chapters), chapter.get('title', 'Unknown'))
                 
-                # Extra delay between chapters to be polite
-                await human_delay(2, 5)
+                await polite_slot(url)
+                html = await asyncio.wait_for(fetch(page, url), CHAPTER_TIMEOUT)
                 
+                chapter_data = parse_chapter_content(html, url)
+                chapter_data["chapter_number"] = chapter.get("chapter_number", i + 1)
+                if cache and chapter_data.get("content"):
+                    cache.put(url, chapter_data)
+                return chapter_data
             except Exception as e:
-                print(f"  ❌ Error crawling chapter: {e}")
-                crawled_chapters.append({
+                # TimeoutError có str() rỗng -> dùng tên exception
+                error = str(e) or type(e).__name__
+                logger.error("  ❌ Error crawling chapter: %s", error)
+                return {
                     "chapter_number": chapter.get("chapter_number", i + 1),
                     "title": chapter.get("title", ""),
                     "source_url": chapter.get("source_url", ""),
                     "content": None,
-                    "error": str(e),
-                })
+                    "error": error,
+                }
+        
+        # Dead-letter: chương lỗi ở lượt chính, thử lại sau khi các chương khác xong
+        failed: List[tuple] = []
+        
+        async def report(i: int, chapter_data: Dict[str, Any]) -> None:
+            stats["done"] += 1
+            if not chapter_data.get("content"):
+                stats["failed"] += 1
+            if stats["done"] % PROGRESS_LOG_EVERY == 0:
+                logger.info("  📄 %s/%s chapters", stats["done"], len(chapters))
+            
+            if on_chapter:
+                try:
+                    await on_chapter(i, chapter_data)
+                except CrawlCancelled:
+                    raise
+                except Exception as e:
+                    logger.error("  ❌ Error saving chapter %s: %s", i+1, e)
+            else:
+                results[i] = chapter_data
+        
+        async def worker():
+            # Page bị crash/đóng -> mở page mới thay vì fail mọi chapter còn lại của worker
+            while not queue.empty():
+                async with browser.new_page() as page:
+                    while not page.is_closed():
+                        try:
+                            i, chapter = queue.get_nowait()
+                        except asyncio.QueueEmpty:
+                            return
+                        
+                        chapter_data = await crawl_one(page, i, chapter)
+                        if chapter_data.get("content"):
+                            await report(i, chapter_data)
+                        else:
+                            failed.append((i, chapter))
+                
+                logger.warning("  ⚠️ Page closed, reopening")
         
-        return crawled_chapters
+        async def retry_failed():
+            # Tuần tự + backoff: lỗi thường do 429/503 tạm thời, không dồn thêm request
+            logger.info("  🔁 Retrying %s failed chapters", len(failed))
+            deadline = asyncio.get_running_loop().time() + RETRY_BUDGET
+            for i, chapter in sorted(failed, key=lambda item: item[0]):
+                chapter_data = {
+                    "chapter_number": chapter.get("chapter_number", i + 1),
+                    "title": chapter.get("title", ""),
+                    "source_url": chapter.get("source_url", ""),
+                    "content": None,
+                    "error": "retry budget exhausted",
+                }
+                for attempt in range(CHAPTER_RETRIES):
+                    delay = 0.0
+                    if attempt or chapter.get("source_url") in throttled:
+                        delay = RETRY_BASE_DELAY * 2 ** attempt + random.uniform(0, 0.5)
+                    if asyncio.get_running_loop().time() + delay >= deadline:
+                        break
+                    if delay:
+                        await asyncio.sleep(delay)
+                    async with browser.new_page() as page:
+                        chapter_data = await crawl_one(page, i, chapter)
+                    if chapter_data.get("content"):
+                        break
+                await report(i, chapter_data)
+        
+        # TaskGroup: 1 worker lỗi/bị hủy -> cancel các worker còn lại (page đóng, goto bị abort)
+        with cache or nullcontext():
+            try:
+                async with asyncio.TaskGroup() as tg:
+                    for _ in range(concurrency):
+                        tg.create_task(worker())
+            except* Exception as eg:
+                # Giữ hành vi như gather: caller nhận exception gốc, không phải ExceptionGroup
+                raise eg.exceptions[0] from None
+            
+            if failed:
+                await retry_failed()
+        
+        logger.info(
+            "  ✅ %s chapters done (%s from cache, %s failed)",
+            stats["done"], stats["cached"], stats["failed"],
+        )
+        return results
+    
+    async def iter_story_list(
+        self, 
+        list_url: str, 
+        max_pages: int = 1
+    ) -> AsyncIterator[List[Dict[str, Any]]]:
+        """
+        Crawl story listing page(s), yielding each page's stories as soon as it is parsed
+        
+        Args:
+            list_url: URL of listing page (e.g., /danh-sach/truyen-hot/)
+            max_pages: Maximum number of pages to crawl
+        """
+        logger.info("📃 Crawling list page 1: %s", list_url)
+        try:
+            tree = parse_html(await self._fetch_html(list_url))
+            stories = parse_story_list(tree)
+            pagination = get_pagination_info(tree)
+            del tree
+        except Exception as e:
+            logger.error("  ❌ Error crawling page 1: %s", e)
+            return
+        
+        logger.info("  Found %s stories", len(stories))
+        yield stories
+        
+        # Biết tổng số trang từ pager -> tải trước các trang còn lại song song (giới hạn bởi semaphore),
+        # yield theo đúng thứ tự trang
+        last_page = min(max_pages, pagination["total_pages"])
+        if last_page < 2:
+            return
+        
+        base = list_url.rstrip("/")
+        sem = asyncio.Semaphore(max(1, self.settings.pagination_concurrency))
+        
+        async def fetch_page(page_num: int) -> List[Dict[str, Any]]:
+            async with sem:
+                page_url = f"{base}/trang-{page_num}/"
+                logger.info("📃 Crawling list page %s: %s", page_num, page_url)
+                return parse_story_list(await self._fetch_html(page_url))
+        
+        tasks = [asyncio.create_task(fetch_page(n)) for n in range(2, last_page + 1)]
+        try:
+            for page_num, task in enumerate(tasks, start=2):
+                try:
+                    stories = await task
+                except Exception as e:
+                    logger.error("  ❌ Error crawling page %s: %s", page_num, e)
+                    continue
+                logger.info("  Found %s stories (page %s)", len(stories), page_num)
+                yield stories
+        finally:
+            # Consumer dừng sớm -> hủy các trang chưa tải xong
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
     
     async def crawl_story_list(
         self, 
@@ -185,60 +603,29 @@ class StoryCrawler:
         Returns:
             List of story basic info
         """
-        import httpx
-        from .parsers import get_pagination_info
-        
         all_stories = []
-        current_url = list_url
-        
-        async with httpx.AsyncClient(timeout=30.0, follow_redirects=True) as client:
-            for page_num in range(max_pages):
-                print(f"📃 Crawling list page {page_num + 1}: {current_url}")
-                
-                try:
-                    response = await client.get(current_url)
-                    response.raise_for_status()
-                    html = response.text
-                    
-                    # Parse stories on this page
-                    stories = parse_story_list(html)
-                    all_stories.extend(stories)
-                    
-                    print(f"  Found {len(stories)} stories")
-                    
-                    # Get pagination info
-                    pagination = get_pagination_info(html)
-                    
-                    if pagination["next_page_url"] and page_num < max_pages - 1:
-                        current_url = pagination["next_page_url"]
-                        await asyncio.sleep(2)  # Rate limiting
-                    else:
-                        break
-                        
-                except Exception as e:
-                    print(f"  ❌ Error crawling page {page_num + 1}: {e}")
-                    break
-        
+        async for stories in self.iter_story_list(list_url, max_pages):
+            all_stories.extend(stories)
         return all_stories
     
     async def crawl_hot_stories(self, max_pages: int = 2) -> List[Dict[str, Any]]:
         """Crawl hot/trending stories"""
         return await self.crawl_story_list(
-            f"{self.base_url}/danh-sach/truyen-hot/", 
+            CATEGORY_URLS["hot"],
             max_pages
         )
     
     async def crawl_new_stories(self, max_pages: int = 2) -> List[Dict[str, Any]]:
         """Crawl newly updated stories"""
         return await self.crawl_story_list(
-            f"{self.base_url}/danh-sach/truyen-moi/",
+            CATEGORY_URLS["new"],
             max_pages
         )
     
     async def crawl_completed_stories(self, max_pages: int = 2) -> List[Dict[str, Any]]:
         """Crawl completed stories"""
         return await self.crawl_story_list(
-            f"{self.base_url}/danh-sach/truyen-full/",
+            CATEGORY_URLS["completed"],
             max_pages
         )
 
@@ -3,53 +3,144 @@ HTML Parsers for truyenfull.vision
 Extracts story and chapter data from HTML pages
 """
 import re
-from typing import Optional, List, Dict, Any
-from bs4 import BeautifulSoup
-from urllib.parse import urljoin
+from typing import Optional, List, Dict, Any, Union
+from selectolax.lexbor import LexborHTMLParser, LexborNode
+from urllib.parse import urljoin, urlparse
 
+from ..log import get_logger
+
+logger = get_logger("crawler.parsers")
 
 BASE_URL = "https://truyenfull.vision"
 
+# Compiled once (gọi cho mọi link chương)
+CHAPTER_TITLE_RE = re.compile(r'(?:chương|chapter)\s*(\d+)', re.IGNORECASE)
+CHAPTER_URL_RE = re.compile(r'chuong-(\d+)')
+PAGE_NUMBER_RE = re.compile(r'trang-(\d+)')
+# Dòng quảng cáo trong nội dung chương (1 lần search thay vì lower() + 4 lần "in" mỗi dòng)
+AD_LINE_RE = re.compile(r'quảng cáo|advertisement|ads|click here', re.IGNORECASE)
+
+# Vùng danh sách chương: từ thẻ mở #list-chapter tới pager ngay sau nó
+_LIST_START = r'<[^<>]*(?:id|class)=["\']?list-chapter\b'
+_LIST_END = r'<[^<>]*class=["\'][^"\']*\bpagination\b'
+LIST_START_RE = {str: re.compile(_LIST_START), bytes: re.compile(_LIST_START.encode())}
+LIST_END_RE = {str: re.compile(_LIST_END), bytes: re.compile(_LIST_END.encode())}
+
+# CSS selectors: khai báo 1 lần ở đây (Lexbor biên dịch selector trong C, không có bước CSS -> XPath)
+# Bỏ các nhánh thừa đã bị nhánh khác bao (vd "ul.pagination" ⊂ ".pagination"): ít selector phải khớp hơn
+STORY_ITEM_SEL = ".list-truyen .row, .list-truyen-item"
+STORY_TITLE_SEL = ".truyen-title a"
+STORY_AUTHOR_SEL = ".author"
+STORY_LATEST_SEL = ".text-info a, .chapter-text"
+DETAIL_TITLE_SEL = ".title"
+DETAIL_COVER_SEL = ".book img, .info-holder img"
+DETAIL_INFO_SEL = ".info, .info-holder"
+DETAIL_AUTHOR_SEL = 'a[itemprop="author"], .author a'
+DETAIL_GENRE_SEL = 'a[itemprop="genre"], .genre a'
+DETAIL_STATUS_SEL = ".text-success, .text-primary"
+DETAIL_DESC_SEL = ".desc-text, .desc, div[itemprop='description']"
+CHAPTER_LINK_SEL = ".list-chapter a, #list-chapter a"
+CHAPTER_TITLE_SEL = ".chapter-title, .chapter-c h2"
+CHAPTER_CONTENT_SEL = "#chapter-c, .chapter-c, .chapter-content"
+CHAPTER_JUNK_SEL = ".ads, script, .hidden, [style*='display:none'], .ads-responsive, .ads-mobile, .incontent-ad, div[class*='ad'], div[id*='ad']"
+CHAPTER_NEXT_SEL = "#next_chap, a.next_chap, .btn-next"
+CHAPTER_PREV_SEL = "#prev_chap, a.prev_chap, .btn-prev"
+PAGER_SEL = ".pagination, #pagination"
+PAGER_ACTIVE_SEL = ".active"
+PAGER_LAST_SEL = "a[title*='Cuối'], a:lexbor-contains('Cuối'), a:lexbor-contains('»»')"
+PAGER_PAGE_LINK_SEL = "a[href*='trang-']"
+PAGER_NEXT_SEL = "a[rel='next'], li.next a, a.next, a[title*='Sau'], a:lexbor-contains('»')"
+PAGER_PREV_SEL = "a[rel='prev'], li.prev a, a.prev, a[title*='Trước'], a:lexbor-contains('«')"
+
+
+def _abs(href: str) -> str:
+    """
+    Absolute URL for a link on the site
+    Gần như mọi href là tuyệt đối hoặc bắt đầu bằng "/" -> nối chuỗi, chỉ dùng urljoin cho ca hiếm
+    """
+    if href.startswith(("https://", "http://")):
+        return href
+    if href.startswith("/") and not href.startswith("//"):
+        return BASE_URL + href
+    return urljoin(BASE_URL, href)
+
+
+def parse_html(html: Union[str, bytes, LexborHTMLParser]) -> LexborHTMLParser:
+    """Parse HTML (str/bytes, UTF-8) with Lexbor - nhanh hơn BeautifulSoup ~10x
+    Tree đã parse thì trả lại luôn (1 lần parse dùng chung cho nhiều parser)"""
+    if isinstance(html, LexborHTMLParser):
+        return html
+    return LexborHTMLParser(html)
+
+
+def _chapter_list_fragment(html):
+    """
+    Cut raw HTML down to the chapter-list region before parsing
+    Trang phân trang chỉ cần link chương: bỏ header/sidebar/footer thay vì build cả cây
+    """
+    start = LIST_START_RE[type(html)].search(html)
+    if not start:
+        return html
+    end = LIST_END_RE[type(html)].search(html, start.end())
+    return html[start.start():end.start() if end else len(html)]
+
+
+def _css(node, selector: str) -> List[LexborNode]:
+    """
+    node.css() cho selector nhóm ("a, b"): Lexbor trả trùng phần tử khớp nhiều
+    selector -> khử trùng, giữ thứ tự document (như BeautifulSoup select)
+    """
+    return list({n.mem_id: n for n in node.css(selector)}.values())
+
+
+def _text(node: Optional[LexborNode]) -> str:
+    """Same as BeautifulSoup get_text(strip=True)"""
+    return node.text(strip=True) if node is not None else ""
+
+
+def _attr(node: LexborNode, name: str) -> str:
+    return node.attributes.get(name) or ""
+
 
 def extract_slug_from_url(url: str) -> str:
     """Extract story slug from URL"""
     # https://truyenfull.vision/tam-quoc-dien-nghia/ -> tam-quoc-dien-nghia
-    url = url.rstrip("/")
-    parts = url.split("/")
-    return parts[-1] if parts else ""
+    # rpartition: chỉ cắt đoạn cuối, không tạo list mọi phần của URL
+    return url.rstrip("/").rpartition("/")[2]
 
 
-def parse_story_list(html: str) -> List[Dict[str, Any]]:
+def parse_story_list(html: Union[str, bytes]) -> List[Dict[str, Any]]:
     """
     Parse story listing page (e.g., /danh-sach/truyen-moi/)
     Returns list of story basic info
     """
-    soup = BeautifulSoup(html, "lxml")
+    tree = parse_html(html)
     stories = []
     
     # Find story items (adjust selector based on actual HTML structure)
-    story_items = soup.select(".list-truyen .row, .list-truyen-item")
+    story_items = _css(tree, STORY_ITEM_SEL)
     
+    append = stories.append
     for item in story_items:
         try:
             # Get title and URL
-            title_elem = item.select_one("h3.truyen-title a, .truyen-title a")
-            if not title_elem:
+            title_elem = item.css_first(STORY_TITLE_SEL)
+            if title_elem is None:
                 continue
             
-            title = title_elem.get_text(strip=True)
-            url = urljoin(BASE_URL, title_elem.get("href", ""))
+            title = _text(title_elem)
+            url = _abs(_attr(title_elem, "href"))
             slug = extract_slug_from_url(url)
             
             # Get author
-            author_elem = item.select_one(".author, span.author")
-            author = author_elem.get_text(strip=True) if author_elem else None
+            author_elem = item.css_first(STORY_AUTHOR_SEL)
+            author = _text(author_elem) if author_elem is not None else None
             
             # Get latest chapter
-            chapter_elem = item.select_one(".text-info a, .chapter-text")
-            latest_chapter = chapter_elem.get_text(strip=True) if chapter_elem else None
+            chapter_elem = item.css_first(STORY_LATEST_SEL)
+            latest_chapter = _text(chapter_elem) if chapter_elem is not None else None
             
-            stories.append({
+            append({
                 "title": title,
                 "slug": slug,
                 "source_url": url,
@@ -57,18 +148,18 @@ def parse_story_list(html: str) -> List[Dict[str, Any]]:
                 "latest_chapter": latest_chapter,
             })
         except Exception as e:
-            print(f"Error parsing story item: {e}")
+            logger.debug("Error parsing story item: %s", e)
             continue
     
     return stories
 
 
-def parse_story_detail(html: str, url: str) -> Dict[str, Any]:
+def parse_story_detail(source, url: str) -> Dict[str, Any]:
     """
-    Parse story detail page
+    Parse story detail page (HTML or an already parsed tree)
     Returns full story info including chapter list
     """
-    soup = BeautifulSoup(html, "lxml")
+    tree = parse_html(source)
     
     story = {
         "slug": extract_slug_from_url(url),
@@ -84,62 +175,77 @@ def parse_story_detail(html: str, url: str) -> Dict[str, Any]:
     }
     
     # Title
-    title_elem = soup.select_one("h3.title, .title")
-    if title_elem:
-        story["title"] = title_elem.get_text(strip=True)
+    title_elem = tree.css_first(DETAIL_TITLE_SEL)
+    if title_elem is not None:
+        story["title"] = _text(title_elem)
     
     # Cover image
-    cover_elem = soup.select_one(".book img, .info-holder img")
-    if cover_elem:
-        story["cover_url"] = urljoin(BASE_URL, cover_elem.get("src", ""))
+    cover_elem = tree.css_first(DETAIL_COVER_SEL)
+    if cover_elem is not None:
+        story["cover_url"] = _abs(_attr(cover_elem, "src"))
     
     # Info section
-    info_section = soup.select_one(".info, .info-holder")
-    if info_section:
+    info_section = tree.css_first(DETAIL_INFO_SEL)
+    if info_section is not None:
         # Author
-        author_elem = info_section.select_one('a[itemprop="author"], .author a')
-        if author_elem:
-            story["author"] = author_elem.get_text(strip=True)
+        author_elem = info_section.css_first(DETAIL_AUTHOR_SEL)
+        if author_elem is not None:
+            story["author"] = _text(author_elem)
         
         # Genres
-        genre_elems = info_section.select('a[itemprop="genre"], .genre a')
-        story["genres"] = [g.get_text(strip=True) for g in genre_elems]
+        genre_elems = _css(info_section, DETAIL_GENRE_SEL)
+        story["genres"] = [_text(g) for g in genre_elems]
         
         # Status
-        status_elem = info_section.select_one(".text-success, .text-primary")
-        if status_elem:
-            status_text = status_elem.get_text(strip=True).lower()
+        status_elem = info_section.css_first(DETAIL_STATUS_SEL)
+        if status_elem is not None:
+            status_text = _text(status_elem).lower()
             if "hoàn" in status_text or "full" in status_text:
                 story["status"] = "completed"
     
     # Description
-    desc_elem = soup.select_one(".desc-text, .desc, div[itemprop='description']")
-    if desc_elem:
-        story["description"] = desc_elem.get_text(strip=True)
+    desc_elem = tree.css_first(DETAIL_DESC_SEL)
+    if desc_elem is not None:
+        story["description"] = _text(desc_elem)
     
     # Parse chapter list
-    chapters = parse_chapter_list(soup)
+    chapters = parse_chapter_list(tree)
     story["chapters"] = chapters
     story["total_chapters"] = len(chapters)
     
     return story
 
 
-def parse_chapter_list(soup: BeautifulSoup, start_index: int = 1) -> List[Dict[str, Any]]:
+def parse_chapter_list(source, start_index: Optional[int] = 1) -> List[Dict[str, Any]]:
     """
     Parse chapter list from story page
     Filters out pagination links and only keeps real chapter links
+    
+    Args:
+        source: Page HTML (str/bytes, chỉ parse vùng #list-chapter) or an already parsed tree
+        start_index: Chapter number to use when it can't be extracted
+            (None: để chapter_number = None, caller tự đánh số theo vị trí)
     """
     chapters = []
     
+    if not isinstance(source, LexborHTMLParser):
+        if not source:
+            return chapters
+        source = parse_html(_chapter_list_fragment(source))
+    
     # Find chapter links
-    chapter_links = soup.select(".list-chapter a, #list-chapter a")
+    chapter_links = _css(source, CHAPTER_LINK_SEL)
+    
+    # Bind tên local 1 lần: vòng lặp chạy cho hàng nghìn link mỗi trang
+    append = chapters.append
+    extract = extract_chapter_number
+    abs_url = _abs
     
     valid_index = start_index
     for link in chapter_links:
         try:
-            href = link.get("href", "")
-            title = link.get_text(strip=True)
+            href = link.attributes.get("href") or ""
+            title = link.text(strip=True)
             
             # Skip pagination links (they don't contain 'chuong' in URL)
             if not href or "chuong" not in href.lower():
@@ -154,21 +260,22 @@ def parse_chapter_list(soup: BeautifulSoup, start_index: int = 1) -> List[Dict[s
                 continue
             
             # Extract chapter number from title or URL
-            chapter_num = extract_chapter_number(title, href)
+            chapter_num = extract(title, href)
             
             # If we couldn't extract from title/URL, use sequential index
-            if not chapter_num:
+            if not chapter_num and valid_index is not None:
                 chapter_num = valid_index
             
-            chapters.append({
+            append({
                 "chapter_number": chapter_num,
                 "title": title,
-                "source_url": urljoin(BASE_URL, href),
+                "source_url": abs_url(href),
             })
-            valid_index += 1
+            if valid_index is not None:
+                valid_index += 1
             
         except Exception as e:
-            print(f"Error parsing chapter: {e}")
+            logger.debug("Error parsing chapter: %s", e)
             continue
     
     return chapters
@@ -177,24 +284,24 @@ def parse_chapter_list(soup: BeautifulSoup, start_index: int = 1) -> List[Dict[s
 def extract_chapter_number(title: str, url: str) -> Optional[int]:
     """Extract chapter number from title or URL"""
     # Try from title first: "Chương 123" or "Chapter 123"
-    match = re.search(r'(?:chương|chapter)\s*(\d+)', title, re.IGNORECASE)
+    match = CHAPTER_TITLE_RE.search(title)
     if match:
         return int(match.group(1))
     
     # Try from URL: /ten-truyen/chuong-123/
-    match = re.search(r'chuong-(\d+)', url)
+    match = CHAPTER_URL_RE.search(url)
     if match:
         return int(match.group(1))
     
     return None
 
 
-def parse_chapter_content(html: str, url: str) -> Dict[str, Any]:
+def parse_chapter_content(html: Union[str, bytes], url: str) -> Dict[str, Any]:
     """
     Parse chapter content page
     Returns chapter title and content
     """
-    soup = BeautifulSoup(html, "lxml")
+    tree = parse_html(html)
     
     chapter = {
         "source_url": url,
@@ -204,48 +311,43 @@ def parse_chapter_content(html: str, url: str) -> Dict[str, Any]:
     }
     
     # Chapter title
-    title_elem = soup.select_one(".chapter-title, h2 a.chapter-title, .chapter-c h2")
-    if title_elem:
-        chapter["title"] = title_elem.get_text(strip=True)
+    title_elem = tree.css_first(CHAPTER_TITLE_SEL)
+    if title_elem is not None:
+        chapter["title"] = _text(title_elem)
         chapter["chapter_number"] = extract_chapter_number(chapter["title"], url)
     
     # Chapter content
-    content_elem = soup.select_one("#chapter-c, .chapter-c, .chapter-content")
-    if content_elem:
+    content_elem = tree.css_first(CHAPTER_CONTENT_SEL)
+    if content_elem is not None:
         # Remove ads and unwanted elements (expanded list based on actual site)
-        for unwanted in content_elem.select(".ads, script, .hidden, [style*='display:none'], .ads-responsive, .ads-mobile, .incontent-ad, div[class*='ad'], div[id*='ad']"):
+        # reversed: con bị xóa trước cha (không decompose node đã bị giải phóng theo cha)
+        for unwanted in reversed(_css(content_elem, CHAPTER_JUNK_SEL)):
             unwanted.decompose()
         
         # Get clean content - site uses <br> tags, not <p>
-        # First try to get text with proper line breaks
-        raw_text = content_elem.get_text(separator="\n", strip=True)
-        
-        # Clean up: split into lines, filter garbage, rejoin
-        lines = raw_text.split("\n")
-        content_parts = []
-        for line in lines:
-            line = line.strip()
-            # Keep lines that are actual content (not too short, not ads)
-            if len(line) > 5 and not any(ad in line.lower() for ad in ['quảng cáo', 'advertisement', 'ads', 'click here']):
-                content_parts.append(line)
-        
-        chapter["content"] = "\n\n".join(content_parts)
+        # Text có line breaks -> split, filter garbage, rejoin
+        # (1 biểu thức, không giữ biến raw text: bản copy toàn chương được giải phóng ngay sau split)
+        # Keep lines that are actual content (not too short, not ads)
+        chapter["content"] = "\n\n".join([
+            line for line in map(str.strip, content_elem.text(separator="\n", strip=True).split("\n"))
+            if len(line) > 5 and not AD_LINE_RE.search(line)
+        ])
     
     # Get next/prev chapter links
-    next_elem = soup.select_one("#next_chap, a.next_chap, .btn-next")
-    prev_elem = soup.select_one("#prev_chap, a.prev_chap, .btn-prev")
+    next_elem = tree.css_first(CHAPTER_NEXT_SEL)
+    prev_elem = tree.css_first(CHAPTER_PREV_SEL)
     
-    if next_elem and next_elem.get("href"):
-        chapter["next_chapter_url"] = urljoin(BASE_URL, next_elem.get("href"))
-    if prev_elem and prev_elem.get("href"):
-        chapter["prev_chapter_url"] = urljoin(BASE_URL, prev_elem.get("href"))
+    if next_elem is not None and _attr(next_elem, "href"):
+        chapter["next_chapter_url"] = _abs(_attr(next_elem, "href"))
+    if prev_elem is not None and _attr(prev_elem, "href"):
+        chapter["prev_chapter_url"] = _abs(_attr(prev_elem, "href"))
     
     return chapter
 
 
-def get_pagination_info(html: str) -> Dict[str, Any]:
-    """Extract pagination info from list pages"""
-    soup = BeautifulSoup(html, "lxml")
+def get_pagination_info(source) -> Dict[str, Any]:
+    """Extract pagination info from list pages (HTML or an already parsed tree)"""
+    tree = parse_html(source)
     
     pagination = {
         "current_page": 1,
@@ -255,34 +357,31 @@ def get_pagination_info(html: str) -> Dict[str, Any]:
     }
     
     # Find pagination - try multiple selectors
-    pager = soup.select_one(".pagination, ul.pagination, #pagination")
-    if not pager:
-        # Try finding in #list-chapter area
-        pager = soup.select_one("#list-chapter .pagination, .list-chapter .pagination")
+    pager = tree.css_first(PAGER_SEL)
     
-    if pager:
+    if pager is not None:
         # Current page
-        active = pager.select_one(".active, li.active, a.active")
-        if active:
+        active = pager.css_first(PAGER_ACTIVE_SEL)
+        if active is not None:
             try:
-                pagination["current_page"] = int(active.get_text(strip=True))
+                pagination["current_page"] = int(_text(active))
             except ValueError:
                 pass
         
         # Method 1: Find "Cuối" (Last) link and extract page number
-        last_link = pager.select_one("a[title*='Cuối'], a:contains('Cuối'), a:contains('»»')")
-        if last_link and last_link.get("href"):
-            match = re.search(r'trang-(\d+)', last_link.get("href"))
+        last_link = pager.css_first(PAGER_LAST_SEL)
+        if last_link is not None and _attr(last_link, "href"):
+            match = PAGE_NUMBER_RE.search(_attr(last_link, "href"))
             if match:
                 pagination["total_pages"] = int(match.group(1))
         
         # Method 2: Find max page from all 'trang-X' links
         if pagination["total_pages"] == 1:
-            page_links = pager.select("a[href*='trang-']")
+            page_links = pager.css(PAGER_PAGE_LINK_SEL)
             max_page = 1
             for link in page_links:
-                href = link.get("href", "")
-                match = re.search(r'trang-(\d+)', href)
+                href = _attr(link, "href")
+                match = PAGE_NUMBER_RE.search(href)
                 if match:
                     page_num = int(match.group(1))
                     if page_num > max_page:
@@ -291,22 +390,38 @@ def get_pagination_info(html: str) -> Dict[str, Any]:
         
         # Method 3: Check for page numbers in text
         if pagination["total_pages"] == 1:
-            page_items = pager.select("a, span")
+            page_items = _css(pager, "a, span")
             for item in page_items:
-                text = item.get_text(strip=True)
+                text = _text(item)
                 if text.isdigit():
                     page_num = int(text)
                     if page_num > pagination["total_pages"]:
                         pagination["total_pages"] = page_num
         
         # Next/Prev links
-        next_link = pager.select_one("a[rel='next'], li.next a, a.next, a[title*='Sau'], a:contains('»')")
-        prev_link = pager.select_one("a[rel='prev'], li.prev a, a.prev, a[title*='Trước'], a:contains('«')")
+        next_link = pager.css_first(PAGER_NEXT_SEL)
+        prev_link = pager.css_first(PAGER_PREV_SEL)
         
-        if next_link and next_link.get("href"):
-            pagination["next_page_url"] = urljoin(BASE_URL, next_link.get("href"))
-        if prev_link and prev_link.get("href"):
-            pagination["prev_page_url"] = urljoin(BASE_URL, prev_link.get("href"))
+        if next_link is not None and _attr(next_link, "href"):
+            pagination["next_page_url"] = _abs(_attr(next_link, "href"))
+        if prev_link is not None and _attr(prev_link, "href"):
+            pagination["prev_page_url"] = _abs(_attr(prev_link, "href"))
     
-    print(f"[Pagination] Pages: {pagination['total_pages']}, Current: {pagination['current_page']}")
+    logger.debug("[Pagination] Pages: %s, Current: %s", pagination["total_pages"], pagination["current_page"])
     return pagination
+
+
+def get_total_pages(html: Union[str, bytes], story_url: str, tree: Optional[LexborHTMLParser] = None) -> int:
+    """
+    Fast path for total chapter-list pages of a story page (html: str hoặc bytes)
+    Regex trên các link /<slug>/trang-N thay vì parse lại toàn bộ HTML;
+    chỉ dùng get_pagination_info khi không tìm thấy link nào (trên tree nếu đã có)
+    """
+    path = urlparse(story_url).path.rstrip("/")
+    pattern = re.escape(path) + r"/trang-(\d+)"
+    if isinstance(html, bytes):
+        pattern = pattern.encode()
+    total = max((int(m) for m in re.findall(pattern, html)), default=0)
+    if total:
+        return total
+    return get_pagination_info(tree if tree is not None else html).get("total_pages", 1)
@@ -0,0 +1,61 @@
+"""
+robots.txt - Tôn trọng Disallow / Crawl-delay của site nguồn
+Mỗi host chỉ tải robots.txt 1 lần (cache ROBOTS_TTL giây)
+"""
+import asyncio
+import time
+import weakref
+from typing import Dict, Tuple
+from urllib.parse import urlsplit
+from urllib.robotparser import RobotFileParser
+
+import aiohttp
+
+from ..log import get_logger
+
+logger = get_logger("crawler.robots")
+
+# Tải lại robots.txt sau N giây
+ROBOTS_TTL = 6 * 3600
+
+# host -> (expires_at, parser)
+_robots: Dict[str, Tuple[float, RobotFileParser]] = {}
+# event loop -> host -> lock (asyncio.Lock gắn với loop đầu tiên dùng nó; Celery mở loop mới mỗi task)
+_locks = weakref.WeakKeyDictionary()
+
+
+class RobotsDisallowed(Exception):
+    """URL is disallowed by the site's robots.txt"""
+
+
+async def get_robots(session: aiohttp.ClientSession, url: str) -> RobotFileParser:
+    """
+    Get the parsed robots.txt for the URL's host
+    Không tải được / không phải 200 -> coi như cho phép tất cả
+    """
+    parts = urlsplit(url)
+    host = parts.netloc
+    
+    cached = _robots.get(host)
+    if cached and cached[0] > time.monotonic():
+        return cached[1]
+    
+    # Nhiều workers cùng lúc -> chỉ 1 request robots.txt
+    loop_locks = _locks.setdefault(asyncio.get_running_loop(), {})
+    async with loop_locks.setdefault(host, asyncio.Lock()):
+        cached = _robots.get(host)
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+        
+        parser = RobotFileParser(f"{parts.scheme}://{host}/robots.txt")
+        body = ""
+        try:
+            async with session.get(parser.url) as response:
+                if response.status == 200:
+                    body = await response.text(errors="replace")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.warning("⚠️ Could not fetch %s: %s", parser.url, e)
+        
+        parser.parse(body.splitlines())
+        _robots[host] = (time.monotonic() + ROBOTS_TTL, parser)
+        return parser
@@ -3,6 +3,7 @@ import sys
 import os
 from pathlib import Path
 from datetime import datetime, timezone
+from typing import Optional
 
 # Add project root to path
 # Ensure we can import 'app' module
@@ -10,83 +11,136 @@ project_root = str(Path(__file__).parent.parent.parent)
 if project_root not in sys.path:
     sys.path.append(project_root)
 
-# Set Windows Event Loop Policy for Playwright
-if sys.platform == "win32":
-    asyncio.set_event_loop_policy(asyncio.WindowsProactorEventLoopPolicy())
+# Loop policy chỉ đặt khi chạy như script; import từ worker pool (trong API)
+# thì giữ nguyên loop của uvicorn (loop="auto" đã dùng uvloop)
+if __name__ == "__main__":
+    # Windows: Playwright cần Proactor loop
+    if sys.platform == "win32":
+        asyncio.set_event_loop_policy(asyncio.WindowsProactorEventLoopPolicy())
+    else:
+        # uvloop: event loop nhanh hơn cho crawler nhiều I/O (Linux/Render)
+        try:
+            import uvloop
+            asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+        except ImportError:
+            pass
+
+from app.database import Database, ChapterBuffer, db as shared_db
+from app.crawler.crawler import StoryCrawler, StoryRecord, CrawlCancelled
+from app.crawler.chapter_cache import discard_chapter_cache
+from app.log import get_logger
+
+logger = get_logger("crawler.runner")
+
+# Ghi progress vào crawl_tasks tối đa 1 lần / N giây (không ghi theo từng chương)
+PROGRESS_INTERVAL = 2.0
 
-from app.database import Database
-from app.crawler.crawler import StoryCrawler
+async def _cancel_requested(db: Database, task_id: str) -> bool:
+    """True when the API set status "cancelling" (task còn trong queue cũng hủy được)"""
+    try:
+        task = await db.get_task(task_id)
+    except Exception as e:
+        logger.warning("⚠️ Cancel check failed: %s", e)
+        return False
+    return bool(task) and task.get("status") == "cancelling"
 
-async def run_full_crawl(task_id: str, url: str, crawl_chapters: bool):
+
+async def run_full_crawl(task_id: str, url: str, crawl_chapters: bool, db: Optional[Database] = None):
     """
     Standalone crawler process
+    (db mặc định: singleton của app.database, dùng chung connection với API)
     """
-    print(f"🚀 Runner: Starting task {task_id}")
-    db = Database()
+    logger.info("🚀 Runner: Starting task %s", task_id)
+    db = db or shared_db
     
     try:
+        # Bị hủy khi còn chờ trong queue -> không chạy gì
+        if await _cancel_requested(db, task_id):
+            raise CrawlCancelled()
+        # Không ghi lại status "processing" (init_crawl đã đặt): sẽ xóa cờ "cancelling"
         await db.update_task(task_id, {
-            "status": "processing",
             "message": "Đang tải thông tin truyện (Runner)...",
             "progress": 5,
         })
         
-        crawler = StoryCrawler()
-        
-        # Crawl story info
-        print(f"📖 Crawling story info: {url}")
-        story_data = await crawler.crawl_story(url, include_chapters=False)
-        
-        await db.update_task(task_id, {
-            "message": f"Đang lưu thông tin: {story_data.get('title')}",
-            "progress": 10,
-        })
-        
-        # Save story to DB
-        story_record = {
-            "slug": story_data["slug"],
-            "title": story_data["title"],
-            "author": story_data.get("author"),
-            "description": story_data.get("description"),
-            "genres": story_data.get("genres", []),
-            "status": "Full" if story_data.get("status") == "completed" else "Đang ra",
-            "total_chapters": story_data.get("total_chapters", 0),
-            "cover_url": story_data.get("cover_url"),
-            "source_url": story_data.get("source_url"),
-            "updated_at": datetime.now(timezone.utc).isoformat(),
-        }
-        
-        saved_story = await db.upsert_story(story_record)
-        story_id = saved_story.get("id") if saved_story else None
-        
-        if not story_id:
-            # Fallback retrieve if upsert return None (sometimes happens on update)
-            existing = await db.get_story_by_slug(story_data["slug"])
-            story_id = existing["id"] if existing else None
+        # Một Chromium dùng chung cho cả story info (nếu bị chặn) lẫn chapters
+        async with StoryCrawler() as crawler:
+            # Crawl story info
+            logger.info("📖 Crawling story info: %s", url)
+            story_data = await crawler.crawl_story(url, include_chapters=False)
             
-        if not story_id:
-            raise Exception("Không thể lưu truyện vào database")
-        
-        # Crawl chapters
-        if crawl_chapters and story_data.get("chapters"):
-            total_chapters = len(story_data["chapters"])
-            print(f"📚 Found {total_chapters} chapters to crawl")
+            await db.update_task(task_id, {
+                "message": f"Đang lưu thông tin: {story_data.get('title')}",
+                "progress": 10,
+            })
             
-            for i, chapter_info in enumerate(story_data["chapters"]):
-                try:
-                    progress = 10 + int((i / total_chapters) * 85)
-                    
-                    # Update status every 5 chapters to reduce db load
-                    if i % 3 == 0:
-                        await db.update_task(task_id, {
-                            "message": f"Đang tải chương {i+1}/{total_chapters}...",
-                            "progress": progress,
-                        })
-                    
-                    # Crawl chapter content
-                    chapter_data = await crawler.crawl_single_chapter(chapter_info["source_url"])
+            # Cờ hủy đến trong lúc tải thông tin truyện -> dừng trước khi ghi DB
+            if await _cancel_requested(db, task_id):
+                raise CrawlCancelled()
+            
+            # Save story to DB
+            story_record = StoryRecord.from_crawl(story_data)
+            
+            async def save_story() -> str:
+                saved_story = await db.upsert_story(story_record.to_row())
+                story_id = saved_story.get("id") if saved_story else None
+                if not story_id:
+                    raise Exception("Không thể lưu truyện vào database")
+                return story_id
+            
+            # Chapters chỉ cần source_url -> bắt đầu tải ngay, không chờ upsert story
+            story_task = asyncio.create_task(save_story())
+            
+            # Crawl chapters
+            if not (crawl_chapters and story_data.get("chapters")):
+                story_id = await story_task
+            else:
+                total_chapters = len(story_data["chapters"])
+                logger.info("📚 Found %s chapters to crawl", total_chapters)
+                
+                chapters = story_data["chapters"]
+                done = {"count": 0, "cancelled": False}
+                buffer = ChapterBuffer(db)
+                
+                async def report_progress():
+                    """
+                    Push progress on a timer so the crawl loop never waits on DB writes;
+                    also picks up cancel requests (status "cancelling" set by the API)
+                    """
+                    reported = 0
+                    while True:
+                        await asyncio.sleep(PROGRESS_INTERVAL)
+                        try:
+                            task = await db.get_task(task_id)
+                            if task and task.get("status") == "cancelling":
+                                done["cancelled"] = True
+                                return
+                        except Exception as e:
+                            logger.warning("⚠️ Cancel check failed: %s", e)
+                        
+                        count = done["count"]
+                        if count == reported:
+                            continue
+                        reported = count
+                        try:
+                            await db.update_task(task_id, {
+                                "message": f"Đang tải chương {count}/{total_chapters}...",
+                                "progress": 10 + int((count / total_chapters) * 85),
+                            })
+                        except Exception as e:
+                            logger.warning("⚠️ Progress update failed: %s", e)
+                
+                async def save_chapter(i: int, chapter_data: dict):
+                    """Persist one crawled chapter (progress is reported by report_progress)"""
+                    if done["cancelled"]:
+                        # Hủy mọi chapter đang tải (TaskGroup trong crawl_chapters_parallel)
+                        raise CrawlCancelled()
+                    done["count"] += 1
                     
+                    chapter_info = chapters[i]
                     if chapter_data and chapter_data.get("content"):
+                        # Chỉ các chương xong trước khi upsert story trả về mới phải chờ
+                        story_id = await story_task
                         chapter_record = {
                             "story_id": story_id,
                             "chapter_number": chapter_info.get("chapter_number", i + 1),
@@ -94,14 +148,34 @@ async def run_full_crawl(task_id: str, url: str, crawl_chapters: bool):
                             "content": chapter_data.get("content", ""),
                             "source_url": chapter_info["source_url"],
                         }
-                        await db.upsert_chapter(chapter_record)
+                        await buffer.add(chapter_record)
                     else:
-                        print(f"⚠️ Failed to get content for chapter {i+1}")
-                        
-                except Exception as e:
-                    print(f"❌ Error crawling chapter {i+1}: {e}")
-                    # Continue to next chapter
-                    continue
+                        logger.debug("⚠️ Failed to get content for chapter %s", i+1)
+                
+                # Browser dùng chung của crawler, K pages chạy song song
+                reporter = asyncio.create_task(report_progress())
+                try:
+                    async with crawler.use_browser() as browser:
+                        crawl = asyncio.create_task(
+                            crawler.crawl_chapters_parallel(browser, chapters, on_chapter=save_chapter)
+                        )
+                        try:
+                            story_id = await story_task
+                        except BaseException:
+                            # Không lưu được truyện -> dừng tải chapters
+                            crawl.cancel()
+                            await asyncio.gather(crawl, return_exceptions=True)
+                            raise
+                        await crawl
+                finally:
+                    reporter.cancel()
+                    # Lưu phần còn lại (kể cả khi crawl lỗi giữa chừng)
+                    await buffer.flush()
+                    if buffer.skipped:
+                        logger.info("⏭️ %s unchanged chapters skipped", buffer.skipped)
+                # Mọi chương đã vào DB -> checkpoint không còn cần
+                if not buffer.failed:
+                    discard_chapter_cache(chapters[0]["source_url"])
         
         # Mark as completed
         await db.update_task(task_id, {
@@ -112,10 +186,18 @@ async def run_full_crawl(task_id: str, url: str, crawl_chapters: bool):
             "total_chapters": story_data.get("total_chapters", 0),
             "completed_at": datetime.now(timezone.utc).isoformat(),
         })
-        print("✅ Runner: Task completed successfully")
+        logger.info("✅ Runner: Task completed successfully")
+        
+    except CrawlCancelled:
+        logger.info("🛑 Runner: Task %s cancelled", task_id)
+        await db.update_task(task_id, {
+            "status": "cancelled",
+            "message": "Đã hủy theo yêu cầu (các chương đã tải vẫn được lưu)",
+            "completed_at": datetime.now(timezone.utc).isoformat(),
+        })
         
     except Exception as e:
-        print(f"❌ Runner failed: {e}")
+        logger.error("❌ Runner failed: %s", e)
         await db.update_task(task_id, {
             "status": "failed",
             "error": str(e),
@@ -4,9 +4,22 @@ Implements strategies to avoid bot detection
 """
 import random
 import asyncio
+from itertools import accumulate
 from typing import Optional
 from ..config import USER_AGENTS, get_settings
 
+# Settings không đổi trong process -> đọc 1 lần
+_SETTINGS = get_settings()
+_DELAY_MIN, _DELAY_MAX = _SETTINGS.crawl_delay_min, _SETTINGS.crawl_delay_max
+
+
+def reload_stealth_settings() -> None:
+    """Re-read CRAWL_DELAY_MIN/MAX from the environment (vd trong script test)"""
+    global _SETTINGS, _DELAY_MIN, _DELAY_MAX
+    get_settings.cache_clear()
+    _SETTINGS = get_settings()
+    _DELAY_MIN, _DELAY_MAX = _SETTINGS.crawl_delay_min, _SETTINGS.crawl_delay_max
+
 
 def get_random_user_agent() -> str:
     """Get a random User-Agent string"""
@@ -15,98 +28,140 @@ def get_random_user_agent() -> str:
 
 def get_random_delay() -> float:
     """Get random delay between requests"""
-    settings = get_settings()
-    return random.uniform(settings.crawl_delay_min, settings.crawl_delay_max)
+    return random.uniform(_DELAY_MIN, _DELAY_MAX)
 
 
 async def human_delay(min_seconds: Optional[float] = None, max_seconds: Optional[float] = None):
     """Add human-like random delay"""
-    settings = get_settings()
-    min_s = min_seconds or settings.crawl_delay_min
-    max_s = max_seconds or settings.crawl_delay_max
-    delay = random.uniform(min_s, max_s)
-    await asyncio.sleep(delay)
+    min_s = _DELAY_MIN if min_seconds is None else min_seconds
+    max_s = _DELAY_MAX if max_seconds is None else max_seconds
+    await asyncio.sleep(random.uniform(min_s, max_s))
 
 
-def get_stealth_context_options() -> dict:
-    """Get browser context options for stealth mode"""
-    # Random viewport sizes (common resolutions)
-    viewports = [
-        {"width": 1920, "height": 1080},
-        {"width": 1366, "height": 768},
-        {"width": 1536, "height": 864},
-        {"width": 1440, "height": 900},
-        {"width": 1280, "height": 720},
-    ]
+class RateLimiter:
+    """
+    Global request pacing shared by all workers: at most `rate` requests per `per` seconds
+    (thay cho human_delay cộng dồn ở từng page)
+    """
+    
+    def __init__(self, rate: float, per: float = 1.0):
+        self.interval = per / rate if rate > 0 else 0.0
+        self._next_slot = 0.0
+    
+    async def acquire(self) -> None:
+        """Wait for the next free slot"""
+        if not self.interval:
+            return
+        now = asyncio.get_running_loop().time()
+        slot = max(now, self._next_slot)
+        self._next_slot = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
     
-    viewport = random.choice(viewports)
-    user_agent = get_random_user_agent()
+    def defer(self, seconds: float) -> None:
+        """Hold every worker for `seconds` (vd server trả 429 + Retry-After)"""
+        resume = asyncio.get_running_loop().time() + seconds
+        self._next_slot = max(self._next_slot, resume)
     
+    def slow_down(self, interval: float) -> None:
+        """Never go faster than one request per `interval` seconds (e.g. robots.txt Crawl-delay)"""
+        self.interval = max(self.interval, interval)
+
+
+# Shared limiter cho mọi request tới site nguồn (CRAWL_RATE req/s)
+crawl_limiter = RateLimiter(_SETTINGS.crawl_rate)
+
+
+# Random viewport sizes (common resolutions)
+VIEWPORTS = (
+    {"width": 1920, "height": 1080},
+    {"width": 1366, "height": 768},
+    {"width": 1536, "height": 864},
+    {"width": 1440, "height": 900},
+    {"width": 1280, "height": 720},
+)
+
+
+COLOR_SCHEMES = ("light", "dark")
+SCALE_FACTORS = (1, 1.25, 1.5, 2)
+
+# Phần cố định của context options (chỉ viewport/UA/màu/scale random theo từng context)
+_STEALTH_BASE = {
+    "locale": "vi-VN",
+    "timezone_id": "Asia/Ho_Chi_Minh",
+    "permissions": ("geolocation",),
+    "geolocation": {"latitude": 10.8231, "longitude": 106.6297},  # Ho Chi Minh City
+    "has_touch": False,
+    "is_mobile": False,
+    "java_script_enabled": True,
+    "accept_downloads": False,
+}
+
+
+def get_stealth_context_options() -> dict:
+    """Get browser context options for stealth mode (randomized per call)"""
     return {
-        "user_agent": user_agent,
-        "viewport": viewport,
-        "locale": "vi-VN",
-        "timezone_id": "Asia/Ho_Chi_Minh",
-        "permissions": ["geolocation"],
-        "geolocation": {"latitude": 10.8231, "longitude": 106.6297},  # Ho Chi Minh City
-        "color_scheme": random.choice(["light", "dark"]),
-        "device_scale_factor": random.choice([1, 1.25, 1.5, 2]),
-        "has_touch": False,
-        "is_mobile": False,
-        "java_script_enabled": True,
-        "accept_downloads": False,
+        **_STEALTH_BASE,
+        "user_agent": get_random_user_agent(),
+        "viewport": random.choice(VIEWPORTS),
+        "color_scheme": random.choice(COLOR_SCHEMES),
+        "device_scale_factor": random.choice(SCALE_FACTORS),
     }
 
 
-async def inject_stealth_scripts(page) -> None:
+# Hide automation indicators
+_STEALTH_INIT_JS = """
+    // Overwrite the `navigator.webdriver` property
+    Object.defineProperty(navigator, 'webdriver', {
+        get: () => undefined
+    });
+    
+    // Overwrite the `navigator.plugins` property to make it seem like there are plugins
+    Object.defineProperty(navigator, 'plugins', {
+        get: () => [1, 2, 3, 4, 5]
+    });
+    
+    // Overwrite the `navigator.languages` property
+    Object.defineProperty(navigator, 'languages', {
+        get: () => ['vi-VN', 'vi', 'en-US', 'en']
+    });
+    
+    // Pass the Chrome Test
+    window.chrome = {
+        runtime: {}
+    };
+    
+    // Pass Permissions Test
+    const originalQuery = window.navigator.permissions.query;
+    window.navigator.permissions.query = (parameters) => (
+        parameters.name === 'notifications' ?
+            Promise.resolve({ state: Notification.permission }) :
+            originalQuery(parameters)
+    );
+"""
+
+
+async def inject_stealth_scripts(target) -> None:
     """
     Inject stealth scripts to hide automation indicators
+    (target: BrowserContext -> áp dụng cho mọi page của context, hoặc 1 Page)
     """
-    # Hide webdriver property
-    await page.add_init_script("""
-        // Overwrite the `navigator.webdriver` property
-        Object.defineProperty(navigator, 'webdriver', {
-            get: () => undefined
-        });
-        
-        // Overwrite the `navigator.plugins` property to make it seem like there are plugins
-        Object.defineProperty(navigator, 'plugins', {
-            get: () => [1, 2, 3, 4, 5]
-        });
-        
-        // Overwrite the `navigator.languages` property
-        Object.defineProperty(navigator, 'languages', {
-            get: () => ['vi-VN', 'vi', 'en-US', 'en']
-        });
-        
-        // Pass the Chrome Test
-        window.chrome = {
-            runtime: {}
-        };
-        
-        // Pass Permissions Test
-        const originalQuery = window.navigator.permissions.query;
-        window.navigator.permissions.query = (parameters) => (
-            parameters.name === 'notifications' ?
-                Promise.resolve({ state: Notification.permission }) :
-                originalQuery(parameters)
-        );
-    """)
+    await target.add_init_script(_STEALTH_INIT_JS)
+
+
+# Bước dịch chuyển chuột mỗi lần (px)
+_MOUSE_DX = range(-50, 51)
+_MOUSE_DY = range(-30, 31)
 
 
 def get_random_mouse_movements() -> list:
-    """Generate random mouse movement coordinates"""
-    movements = []
-    x, y = random.randint(100, 800), random.randint(100, 600)
-    
-    for _ in range(random.randint(3, 7)):
-        x += random.randint(-50, 50)
-        y += random.randint(-30, 30)
-        x = max(0, min(x, 1920))
-        y = max(0, min(y, 1080))
-        movements.append((x, y))
-    
-    return movements
+    """Generate random mouse movement coordinates (random walk, offsets drawn in one batch)"""
+    steps = random.randint(3, 7)
+    xs = accumulate(random.choices(_MOUSE_DX, k=steps), initial=random.randint(100, 800))
+    ys = accumulate(random.choices(_MOUSE_DY, k=steps), initial=random.randint(100, 600))
+    # Bỏ điểm xuất phát: chỉ trả về vị trí sau mỗi bước
+    next(xs), next(ys)
+    return [(min(max(x, 0), 1920), min(max(y, 0), 1080)) for x, y in zip(xs, ys)]
 
 
 async def simulate_human_behavior(page) -> None:
@@ -123,5 +178,5 @@ async def simulate_human_behavior(page) -> None:
         try:
             await page.mouse.move(x, y)
             await asyncio.sleep(random.uniform(0.05, 0.15))
-        except:
+        except Exception:
             pass
@@ -1,272 +1,861 @@
 """
 Supabase Database Connection - Full CRUD Operations
 """
-from supabase import create_client, Client
-from functools import lru_cache
+import json
+import asyncio
+import hashlib
+import time
+import uuid
+from datetime import date, datetime
+import orjson
+from supabase import create_client, Client, ClientOptions
+from postgrest import APIResponse
+from postgrest.exceptions import APIError, generate_default_error_message
+from postgrest.types import ReturnMethod
+from functools import cached_property, lru_cache
 from .config import get_settings
+from .redis_client import get_redis, mark_redis_down
+from .db_pool import get_pool
+
+
+# Strong refs to background writes so they are not garbage-collected mid-flight
+_background_tasks: set = set()
+
+
+def _fire_and_forget(coro):
+    """Schedule a coroutine without awaiting it"""
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+
+# task_id -> background progress write mới nhất: các lần ghi cùng 1 task chạy theo thứ tự
+_task_writes: dict = {}
+
+
+class _TTLCache:
+    """
+    Tiny in-process TTL cache: dict + time.monotonic() expiry (cùng kiểu _stats_cache / robots cache)
+    Đầy -> bỏ entry cũ nhất (dict giữ thứ tự insert)
+    """
+    
+    def __init__(self, ttl: float, maxsize: int):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data: dict = {}
+    
+    def get(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires < time.monotonic():
+            self._data.pop(key, None)
+            return None
+        return value
+    
+    def set(self, key, value) -> None:
+        self._data.pop(key, None)
+        if len(self._data) >= self.maxsize:
+            self._data.pop(next(iter(self._data)))
+        self._data[key] = (time.monotonic() + self.ttl, value)
+    
+    def discard_where(self, predicate) -> None:
+        """Drop every entry whose (key, value) matches"""
+        for key in [k for k, (_, v) in self._data.items() if predicate(k, v)]:
+            del self._data[key]
+    
+    def clear(self) -> None:
+        self._data.clear()
+
+
+# Story đọc lặp lại (reader API, crawler kiểm tra truyện đã có) -> cache ngắn trong process
+# Mọi write qua Database đều invalidate; TTL chỉ chặn dữ liệu cũ từ process khác
+READ_CACHE_TTL = 60
+_story_cache = _TTLCache(READ_CACHE_TTL, maxsize=1024)
+
+
+# Request PostgREST treo quá N giây -> lỗi thay vì giữ thread (mặc định supabase-py: 120s)
+POSTGREST_TIMEOUT = 30
 
 
 @lru_cache()
 def get_supabase_client() -> Client:
-    """Get cached Supabase client instance"""
+    """
+    Get cached Supabase client instance
+    PostgREST dùng 1 httpx.Client (HTTP/2, pool 100 connections) cho mọi query/thread
+    -> mọi Database() phải đi qua client này để giữ keep-alive
+    """
     settings = get_settings()
-    return create_client(settings.supabase_url, settings.supabase_key)
+    return create_client(
+        settings.supabase_url,
+        settings.supabase_key,
+        options=ClientOptions(postgrest_client_timeout=POSTGREST_TIMEOUT),
+    )
 
 
 class Database:
     """Database operations wrapper for Supabase"""
     
-    def __init__(self):
-        self.client = get_supabase_client()
+    @cached_property
+    def client(self) -> Client:
+        """Shared Supabase client, created on first use (import app.database không mở connection)"""
+        return get_supabase_client()
+    
+    @staticmethod
+    async def _exec(query):
+        """
+        Run a supabase-py query off the event loop
+        Client là sync: .execute() chặn loop -> chạy trong thread để các crawler khác không bị đứng
+        """
+        return await asyncio.to_thread(query.execute)
+    
+    @staticmethod
+    def _execute_orjson(query) -> APIResponse:
+        """
+        query.execute() with the body encoded by orjson
+        httpx encode json= bằng json stdlib: với content chương (hàng MB) chậm hơn ~15 lần
+        và giữ GIL lâu trong thread -> event loop bị chậm theo
+        """
+        headers = query.headers.copy()
+        headers["Content-Type"] = "application/json"
+        r = query.session.request(
+            query.http_method,
+            query.path,
+            content=orjson.dumps(query.json),
+            params=query.params,
+            headers=headers,
+        )
+        if r.is_success:
+            return APIResponse.from_http_request_response(r)
+        try:
+            error = r.json()
+        except ValueError:
+            error = generate_default_error_message(r)
+        raise APIError(error)
+    
+    async def _exec_write(self, query):
+        """_exec for writes with large JSON bodies (chapter content)"""
+        return await asyncio.to_thread(self._execute_orjson, query)
+    
+    @staticmethod
+    def _record_to_dict(record) -> dict:
+        """asyncpg Record -> dict giống JSON của PostgREST (uuid/timestamp thành str)"""
+        row = dict(record)
+        for key, value in row.items():
+            if isinstance(value, uuid.UUID):
+                row[key] = str(value)
+            elif isinstance(value, (datetime, date)):
+                row[key] = value.isoformat()
+        return row
     
     # ========== Stories (Novels) ==========
     
+    # L2: Redis (story:id:{id} / story:slug:{slug}, JSON) dùng chung giữa các worker/Celery
+    STORY_CACHE_TTL = 300
+    
+    @staticmethod
+    def _story_keys(ids=(), slugs=()) -> list:
+        return [f"story:id:{i}" for i in ids if i] + [f"story:slug:{s}" for s in slugs if s]
+    
+    async def _get_cached_story(self, kind: str, value: str) -> dict | None:
+        """Look up a story in the process cache, then Redis (None on miss / Redis down)"""
+        cached = _story_cache.get((kind, value))
+        if cached is not None:
+            return dict(cached)
+        
+        redis = get_redis()
+        if redis is None:
+            return None
+        try:
+            raw = await redis.get(f"story:{kind}:{value}")
+        except Exception as e:
+            mark_redis_down(e)
+            return None
+        if not raw:
+            return None
+        story = orjson.loads(raw)
+        _story_cache.set(("id", story.get("id")), story)
+        _story_cache.set(("slug", story.get("slug")), story)
+        return dict(story)
+    
+    async def _cache_story(self, story: dict | None) -> dict | None:
+        """Remember a story under both its id and slug, return a copy for the caller"""
+        if not story:
+            return story
+        _story_cache.set(("id", story.get("id")), story)
+        _story_cache.set(("slug", story.get("slug")), story)
+        
+        redis = get_redis()
+        if redis is not None:
+            raw = orjson.dumps(story)
+            try:
+                async with redis.pipeline(transaction=False) as pipe:
+                    for key in self._story_keys([story.get("id")], [story.get("slug")]):
+                        pipe.setex(key, self.STORY_CACHE_TTL, raw)
+                    await pipe.execute()
+            except Exception as e:
+                mark_redis_down(e)
+        return dict(story)
+    
+    async def _invalidate_stories(self, rows=(), ids=(), slugs=()) -> None:
+        """Drop cached stories matching any id/slug, or any written row (cả 2 key của cùng 1 row)"""
+        ids = {*ids, *(r.get("id") for r in rows)}
+        slugs = {*slugs, *(r.get("slug") for r in rows)}
+        _story_cache.discard_where(
+            lambda key, story: story.get("id") in ids or story.get("slug") in slugs
+        )
+        
+        redis = get_redis()
+        keys = self._story_keys(ids, slugs)
+        if redis is not None and keys:
+            try:
+                await redis.delete(*keys)
+            except Exception as e:
+                mark_redis_down(e)
+    
     async def create_story(self, story_data: dict) -> dict:
         """Insert a new story"""
-        result = self.client.table("stories").insert(story_data).execute()
+        result = await self._exec(self.client.table("stories").insert(story_data))
+        await self._invalidate_stories(result.data or [], slugs=[story_data.get("slug")])
         return result.data[0] if result.data else None
     
     async def get_story_by_slug(self, slug: str) -> dict | None:
-        """Get story by slug"""
-        result = self.client.table("stories").select("*").eq("slug", slug).execute()
-        return result.data[0] if result.data else None
+        """Get story by slug (process cache -> Redis -> asyncpg pool nếu có -> PostgREST)"""
+        cached = await self._get_cached_story("slug", slug)
+        if cached is not None:
+            return cached
+        
+        pool = get_pool()
+        if pool is not None:
+            try:
+                record = await pool.fetchrow("SELECT * FROM stories WHERE slug = $1", slug)
+                return await self._cache_story(self._record_to_dict(record) if record else None)
+            except Exception as e:
+                print(f"[DB] asyncpg get_story_by_slug failed, fallback to PostgREST: {e}")
+        
+        result = await self._exec(self.client.table("stories").select("*").eq("slug", slug))
+        return await self._cache_story(result.data[0] if result.data else None)
     
     async def get_story_by_id(self, story_id: str) -> dict | None:
-        """Get story by UUID"""
-        result = self.client.table("stories").select("*").eq("id", story_id).execute()
-        return result.data[0] if result.data else None
+        """Get story by UUID (process cache -> Redis -> asyncpg pool nếu có -> PostgREST)"""
+        cached = await self._get_cached_story("id", story_id)
+        if cached is not None:
+            return cached
+        
+        pool = get_pool()
+        if pool is not None:
+            try:
+                record = await pool.fetchrow("SELECT * FROM stories WHERE id = $1", story_id)
+                return await self._cache_story(self._record_to_dict(record) if record else None)
+            except Exception as e:
+                print(f"[DB] asyncpg get_story_by_id failed, fallback to PostgREST: {e}")
+        
+        result = await self._exec(self.client.table("stories").select("*").eq("id", story_id))
+        return await self._cache_story(result.data[0] if result.data else None)
     
-    async def get_stories(self, limit: int = 50, offset: int = 0) -> list:
-        """Get paginated stories"""
-        result = self.client.table("stories").select("*").range(offset, offset + limit - 1).order("updated_at", desc=True).execute()
+    async def get_stories(
+        self, limit: int = 50, offset: int = 0, after: tuple | None = None, columns: str = "*"
+    ) -> list:
+        """
+        Get paginated stories, newest first
+        
+        after: (updated_at, id) of the last row of the previous page -> keyset pagination
+        (không dùng OFFSET, Postgres không phải quét lại các dòng đã bỏ qua)
+        columns: PostgREST select list, chỉ lấy cột cần thiết
+        """
+        query = self.client.table("stories").select(columns)
+        if after:
+            last_ts, last_id = after
+            query = query.or_(
+                f'updated_at.lt."{last_ts}",and(updated_at.eq."{last_ts}",id.lt.{last_id})'
+            ).limit(limit)
+        else:
+            query = query.range(offset, offset + limit - 1)
+        result = await self._exec(query.order("updated_at", desc=True).order("id", desc=True))
         return result.data or []
     
     async def update_story(self, story_id: str, story_data: dict) -> dict:
         """Update story by ID"""
-        result = self.client.table("stories").update(story_data).eq("id", story_id).execute()
+        result = await self._exec(self.client.table("stories").update(story_data).eq("id", story_id))
+        await self._invalidate_stories(result.data or [], ids=[story_id], slugs=[story_data.get("slug")])
         return result.data[0] if result.data else None
     
     async def upsert_story(self, story_data: dict) -> dict:
-        """Insert or update story by slug"""
-        result = self.client.table("stories").upsert(story_data, on_conflict="slug").execute()
+        """
+        Insert or update story by slug
+        return=representation: cả insert lẫn update (merge-duplicates) đều trả về row (có id)
+        """
+        result = await self._exec(self.client.table("stories").upsert(
+            story_data, on_conflict="slug", returning=ReturnMethod.representation
+        ))
+        await self._invalidate_stories(result.data or [], slugs=[story_data.get("slug")])
         return result.data[0] if result.data else None
     
-    async def search_stories(self, query: str, limit: int = 20) -> list:
-        """Search stories by title or author"""
-        result = self.client.table("stories").select("*").or_(
+    async def upsert_stories_bulk(self, stories: list) -> list:
+        """Insert or update many stories by slug in one request"""
+        if not stories:
+            return []
+        result = await self._exec(self.client.table("stories").upsert(stories, on_conflict="slug"))
+        await self._invalidate_stories(result.data or [], slugs=[s.get("slug") for s in stories])
+        return result.data or []
+    
+    async def search_stories(self, query: str, limit: int = 20, columns: str = "*") -> list:
+        """
+        Search stories by title or author
+        Full-text (cột search + GIN index) trước; không có kết quả -> ILIKE để vẫn
+        khớp từ gõ dở / chuỗi con như trước
+        """
+        try:
+            result = await self._exec(self.client.table("stories").select(columns).filter(
+                "search", "wfts(simple)", query
+            ).limit(limit))
+            if result.data:
+                return result.data
+        except Exception as e:
+            print(f"[DB] Full-text search failed, fallback to ILIKE: {e}")
+        
+        result = await self._exec(self.client.table("stories").select(columns).or_(
             f"title.ilike.%{query}%,author.ilike.%{query}%"
-        ).limit(limit).execute()
+        ).limit(limit))
         return result.data or []
     
     async def get_stories_count(self) -> int:
         """Get total count of stories"""
-        result = self.client.table("stories").select("id", count="exact").execute()
+        # limit(1): chỉ cần Content-Range, không kéo cả danh sách id về
+        result = await self._exec(self.client.table("stories").select("id", count="exact").limit(1))
         return result.count or 0
     
     # ========== Chapters ==========
     
     async def create_chapter(self, chapter_data: dict) -> dict:
         """Insert a new chapter"""
-        result = self.client.table("chapters").insert(chapter_data).execute()
+        result = await self._exec(self.client.table("chapters").insert(chapter_data))
         return result.data[0] if result.data else None
     
     async def get_chapter_by_id(self, chapter_id: str) -> dict | None:
         """Get chapter by UUID"""
-        result = self.client.table("chapters").select("*").eq("id", chapter_id).execute()
+        result = await self._exec(self.client.table("chapters").select("*").eq("id", chapter_id))
         return result.data[0] if result.data else None
     
-    async def get_chapters_by_story(self, story_id: str, limit: int = 100, offset: int = 0) -> list:
-        """Get chapters for a story with pagination"""
-        result = self.client.table("chapters").select("*").eq("story_id", story_id).range(offset, offset + limit - 1).order("chapter_number").execute()
+    async def get_chapters_by_story(
+        self, story_id: str, limit: int = 100, offset: int = 0, after_number: int | None = None
+    ) -> list:
+        """
+        Get chapters for a story with pagination
+        
+        after_number: last chapter_number of the previous page -> keyset pagination
+        on the (story_id, chapter_number) index
+        """
+        query = self.client.table("chapters").select("*").eq("story_id", story_id)
+        if after_number is not None:
+            query = query.gt("chapter_number", after_number).limit(limit)
+        else:
+            query = query.range(offset, offset + limit - 1)
+        result = await self._exec(query.order("chapter_number"))
         return result.data or []
     
+    async def get_story_chapters_page(
+        self, story_id: str, limit: int = 50, offset: int = 0, after_number: int | None = None,
+        chapter_columns: str = "id,chapter_number,title,source_url,created_at"
+    ) -> dict | None:
+        """
+        Story header (total_chapters, updated_at) + one page of its chapters
+        in a single round-trip (PostgREST embedded resource).
+        Returns None if the story does not exist; chapters under key "chapters".
+        """
+        query = self.client.table("stories").select(
+            f"id,total_chapters,updated_at,chapters({chapter_columns})"
+        ).eq("id", story_id)
+        if after_number is not None:
+            query = query.gt("chapters.chapter_number", after_number).limit(limit, foreign_table="chapters")
+        else:
+            query = query.range(offset, offset + limit - 1, foreign_table="chapters")
+        result = await self._exec(query.order("chapter_number", foreign_table="chapters"))
+        if not result.data:
+            return None
+        story = result.data[0]
+        story["chapters"] = story.get("chapters") or []
+        return story
+    
+    async def get_chapter_window(self, chapter_id: str) -> dict | None:
+        """
+        Get chapter by UUID plus prev/next chapter ids in one round-trip
+        (RPC get_chapter_window). Returned dict has extra keys
+        prev_chapter_id / next_chapter_id.
+        """
+        try:
+            result = await self._exec(self.client.rpc("get_chapter_window", {"p_chapter_id": chapter_id}))
+            return result.data or None
+        except Exception as e:
+            print(f"[DB] get_chapter_window RPC failed, fallback to 2 queries: {e}")
+        
+        # Fallback: chapter + both neighbours in a single IN query
+        chapter = await self.get_chapter_by_id(chapter_id)
+        if not chapter:
+            return None
+        num = chapter.get("chapter_number", 0)
+        result = await self._exec(self.client.table("chapters").select("id, chapter_number").eq(
+            "story_id", chapter["story_id"]
+        ).in_("chapter_number", [num - 1, num + 1]))
+        neighbours = {r["chapter_number"]: r["id"] for r in (result.data or [])}
+        chapter["prev_chapter_id"] = neighbours.get(num - 1)
+        chapter["next_chapter_id"] = neighbours.get(num + 1)
+        return chapter
+    
     async def get_chapter(self, story_id: str, chapter_number: int) -> dict | None:
-        """Get specific chapter by story_id and chapter_number"""
-        result = self.client.table("chapters").select("*").eq("story_id", story_id).eq("chapter_number", chapter_number).execute()
+        """Get specific chapter by story_id and chapter_number (asyncpg pool nếu có, else PostgREST)"""
+        pool = get_pool()
+        if pool is not None:
+            try:
+                record = await pool.fetchrow(
+                    "SELECT * FROM chapters WHERE story_id = $1 AND chapter_number = $2",
+                    story_id, chapter_number,
+                )
+                return self._record_to_dict(record) if record else None
+            except Exception as e:
+                print(f"[DB] asyncpg get_chapter failed, fallback to PostgREST: {e}")
+        
+        result = await self._exec(self.client.table("chapters").select("*").eq("story_id", story_id).eq("chapter_number", chapter_number))
         return result.data[0] if result.data else None
     
     async def upsert_chapter(self, chapter_data: dict) -> dict:
         """Insert or update chapter"""
-        result = self.client.table("chapters").upsert(
+        result = await self._exec_write(self.client.table("chapters").upsert(
             chapter_data, 
             on_conflict="story_id,chapter_number"
-        ).execute()
+        ))
         return result.data[0] if result.data else None
     
     async def bulk_upsert_chapters(self, chapters: list) -> list:
-        """Bulk insert/update chapters with logging"""
+        """
+        Bulk insert/update chapters with logging
+        return=minimal: PostgREST không gửi lại cả content vừa upload (nửa payload của mỗi batch).
+        1 request upsert là atomic -> thành công thì mọi row đã lưu, trả về chính các row đã gửi
+        """
         if not chapters:
             return []
         
+        pool = get_pool()
+        if pool is not None:
+            try:
+                await self._pg_upsert_chapters(pool, chapters)
+                print(f"[DB] Upserted {len(chapters)} chapters (asyncpg)")
+                return chapters
+            except Exception as e:
+                print(f"[DB] asyncpg bulk upsert failed, fallback to PostgREST: {e}")
+        
         try:
-            result = self.client.table("chapters").upsert(
+            await self._exec_write(self.client.table("chapters").upsert(
                 chapters,
-                on_conflict="story_id,chapter_number"
-            ).execute()
+                on_conflict="story_id,chapter_number",
+                returning=ReturnMethod.minimal,
+            ))
             
-            saved_count = len(result.data) if result.data else 0
-            print(f"[DB] Upserted {saved_count}/{len(chapters)} chapters")
-            return result.data or []
+            print(f"[DB] Upserted {len(chapters)} chapters")
+            return chapters
         except Exception as e:
             print(f"[DB ERROR] bulk_upsert_chapters failed: {e}")
             # Try one by one as fallback
             saved = []
             for ch in chapters:
                 try:
-                    r = self.client.table("chapters").upsert(
-                        ch, on_conflict="story_id,chapter_number"
-                    ).execute()
-                    if r.data:
-                        saved.extend(r.data)
+                    await self._exec_write(self.client.table("chapters").upsert(
+                        ch, on_conflict="story_id,chapter_number", returning=ReturnMethod.minimal
+                    ))
+                    saved.append(ch)
                 except Exception as inner_e:
                     print(f"[DB ERROR] Single chapter upsert failed: {inner_e}")
             print(f"[DB] Fallback saved {len(saved)}/{len(chapters)} chapters")
             return saved
     
+    # Giới hạn max-rows mặc định của Supabase API
+    CHAPTER_PAGE_SIZE = 1000
+    
+    @staticmethod
+    async def _pg_upsert_chapters(pool, chapters: list) -> None:
+        """
+        COPY rows into a temp table, then one INSERT ... SELECT ... ON CONFLICT merge
+        (COPY: cả batch đi trong 1 luồng dữ liệu, không phải N câu INSERT)
+        """
+        # Các row có thể khác cột (vd content_hash) -> 1 lần COPY + merge / bộ cột
+        groups: dict = {}
+        for ch in chapters:
+            groups.setdefault(tuple(ch), []).append(ch)
+        
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute(
+                    "CREATE TEMP TABLE tmp_chapters (LIKE chapters INCLUDING DEFAULTS) ON COMMIT DROP"
+                )
+                for columns, rows in groups.items():
+                    await conn.copy_records_to_table(
+                        "tmp_chapters",
+                        records=[tuple(row[c] for c in columns) for row in rows],
+                        columns=list(columns),
+                    )
+                    names = ", ".join(f'"{c}"' for c in columns)
+                    updates = ", ".join(
+                        f'"{c}" = EXCLUDED."{c}"' for c in columns if c not in ("story_id", "chapter_number")
+                    )
+                    await conn.execute(
+                        f"INSERT INTO chapters ({names}) SELECT {names} FROM tmp_chapters "
+                        f"ON CONFLICT (story_id, chapter_number) DO UPDATE SET {updates}"
+                    )
+                    await conn.execute("TRUNCATE tmp_chapters")
+    
+    async def get_all_chapters(
+        self, story_id: str, columns: str = "chapter_number", unarchived_only: bool = False,
+        or_filter: str | None = None,
+    ) -> list:
+        """
+        Every chapter of a story (columns phải có chapter_number), ordered by chapter_number
+        Keyset pages (chapter_number > last): PostgREST cắt mỗi response ở max-rows,
+        1 request limit=10000 không lấy đủ truyện dài; OFFSET thì quét lại các trang trước
+        """
+        chapters = []
+        last_number = None
+        while True:
+            query = self.client.table("chapters").select(columns).eq("story_id", story_id)
+            if unarchived_only:
+                query = query.not_.is_("is_archived", "true")
+            if or_filter:
+                query = query.or_(or_filter)
+            if last_number is not None:
+                query = query.gt("chapter_number", last_number)
+            result = await self._exec(query.order("chapter_number").limit(self.CHAPTER_PAGE_SIZE))
+            rows = result.data or []
+            chapters.extend(rows)
+            if len(rows) < self.CHAPTER_PAGE_SIZE:
+                return chapters
+            last_number = rows[-1]["chapter_number"]
+    
+    async def get_chapter_hashes(self, story_id: str) -> dict | None:
+        """
+        chapter_number -> content_hash of every chapter whose content is actually stored
+        (archived, hoặc cột content khác rỗng). Writer khác có thể xóa content mà giữ hash cũ
+        (vd scheduler upsert metadata với content "") -> những chương đó không được bỏ qua
+        None nếu cột content_hash chưa có (migration add_chapter_content_hash.sql chưa chạy)
+        """
+        try:
+            rows = await self.get_all_chapters(
+                story_id, "chapter_number,content_hash", or_filter='is_archived.is.true,content.neq.""'
+            )
+        except Exception as e:
+            print(f"[DB] get_chapter_hashes failed, content hashing disabled: {e}")
+            return None
+        return {row["chapter_number"]: row["content_hash"] for row in rows}
+    
     async def get_chapters_count(self, story_id: str) -> int:
         """Get total count of chapters for a story"""
-        result = self.client.table("chapters").select("id", count="exact").eq("story_id", story_id).execute()
+        result = await self._exec(
+            self.client.table("chapters").select("id", count="exact").eq("story_id", story_id).limit(1)
+        )
         return result.count or 0
     
+    async def get_archive_counts(self, story_id: str) -> tuple[int, int]:
+        """
+        (total, archived) chapter counts of a story
+        Postgres đếm (count=exact, limit 1) -> chỉ 2 số nguyên về client, không kéo cả danh sách chương
+        """
+        total, archived = await asyncio.gather(
+            self._exec(self.client.table("chapters").select("id", count="exact").eq(
+                "story_id", story_id
+            ).limit(1)),
+            self._exec(self.client.table("chapters").select("id", count="exact").eq(
+                "story_id", story_id
+            ).eq("is_archived", True).limit(1)),
+        )
+        return total.count or 0, archived.count or 0
+    
+    async def get_unarchived_chapters(self, story_id: str) -> list:
+        """Chapters not yet saved to Storage (lọc ở Postgres, chỉ lấy cột cần để sync)"""
+        return await self.get_all_chapters(
+            story_id, "story_id,chapter_number,source_url", unarchived_only=True
+        )
+    
     # ========== Crawl Tasks ==========
     
+    # Task state is mirrored in Redis (hash task:{id}) so status polling
+    # does not hit Postgres; crawl_tasks stays the durable record.
+    TASK_CACHE_TTL = 86400  # 1 day
+    
+    async def _cache_task(self, task_id: str, task_data: dict) -> bool:
+        """Merge task fields into Redis. Returns False if Redis is unavailable"""
+        redis = get_redis()
+        if redis is None:
+            return False
+        key = f"task:{task_id}"
+        try:
+            async with redis.pipeline(transaction=False) as pipe:
+                pipe.hset(key, mapping={k: json.dumps(v) for k, v in task_data.items()})
+                pipe.expire(key, self.TASK_CACHE_TTL)
+                await pipe.execute()
+            return True
+        except Exception as e:
+            mark_redis_down(e)
+            return False
+    
+    async def _get_cached_task(self, task_id: str) -> dict | None:
+        """Read task from Redis (None on miss / partial entry / Redis down)"""
+        redis = get_redis()
+        if redis is None:
+            return None
+        try:
+            raw = await redis.hgetall(f"task:{task_id}")
+        except Exception as e:
+            mark_redis_down(e)
+            return None
+        # Entry created only by update_task (không có status) -> không đủ tin cậy
+        if not raw or "status" not in raw:
+            return None
+        return {k: json.loads(v) for k, v in raw.items()}
+    
     async def create_task(self, task_data: dict) -> dict:
         """Create a new crawl task"""
-        result = self.client.table("crawl_tasks").insert(task_data).execute()
+        await self._cache_task(task_data["id"], task_data)
+        result = await self._exec(self.client.table("crawl_tasks").insert(task_data))
         return result.data[0] if result.data else None
     
     async def get_task(self, task_id: str) -> dict | None:
-        """Get task by ID"""
-        result = self.client.table("crawl_tasks").select("*").eq("id", task_id).execute()
+        """Get task by ID (Redis first, then Postgres)"""
+        cached = await self._get_cached_task(task_id)
+        if cached:
+            return cached
+        result = await self._exec(self.client.table("crawl_tasks").select("*").eq("id", task_id))
         return result.data[0] if result.data else None
     
     async def update_task(self, task_id: str, task_data: dict) -> dict:
-        """Update task status"""
-        result = self.client.table("crawl_tasks").update(task_data).eq("id", task_id).execute()
-        return result.data[0] if result.data else None
+        """
+        Update task status
+        Progress-only updates go to Redis first and are written to Postgres
+        in the background; status changes are written synchronously,
+        after any background write of the same task.
+        """
+        cached = await self._cache_task(task_id, task_data)
+        previous = _task_writes.get(task_id)
+        if cached and "status" not in task_data:
+            task = _fire_and_forget(self._chain_task_write(previous, task_id, task_data))
+            _task_writes[task_id] = task
+            task.add_done_callback(
+                lambda t: _task_writes.pop(task_id, None) if _task_writes.get(task_id) is t else None
+            )
+            return task_data
+        # Progress ghi ở background chưa xong -> chờ, không để nó đè status/progress cuối
+        if previous is not None:
+            await asyncio.gather(previous, return_exceptions=True)
+        return await asyncio.to_thread(self._update_task_row, task_id, task_data)
+    
+    async def _chain_task_write(self, previous, task_id: str, task_data: dict) -> dict:
+        """Background progress write, started after the task's previous one finished"""
+        if previous is not None:
+            await asyncio.gather(previous, return_exceptions=True)
+        return await asyncio.to_thread(self._update_task_row, task_id, task_data)
+    
+    def _update_task_row(self, task_id: str, task_data: dict) -> dict:
+        """Write task fields to crawl_tasks"""
+        try:
+            result = self.client.table("crawl_tasks").update(task_data).eq("id", task_id).execute()
+            return result.data[0] if result.data else None
+        except Exception as e:
+            print(f"[DB ERROR] update_task {task_id} failed: {e}")
+            return None
     
     # ========== Genres ==========
     
     async def get_or_create_genre(self, name: str, slug: str) -> dict:
         """Get genre by name or create if not exists"""
-        result = self.client.table("genres").select("*").eq("slug", slug).execute()
+        result = await self._exec(self.client.table("genres").select("id,name,slug").eq("slug", slug))
         if result.data:
             return result.data[0]
         # Create new
         new_genre = {"name": name, "slug": slug}
-        result = self.client.table("genres").insert(new_genre).execute()
+        result = await self._exec(self.client.table("genres").insert(new_genre))
         return result.data[0] if result.data else None
     
     async def link_story_genre(self, story_id: str, genre_id: str):
         """Link story to genre"""
         try:
-            self.client.table("story_genres").upsert({
+            await self._exec(self.client.table("story_genres").upsert({
                 "story_id": story_id, 
                 "genre_id": genre_id
-            }).execute()
+            }))
         except Exception:
             pass  # Ignore duplicate
     
     async def get_genres(self) -> list:
         """Get all genres with story count"""
-        result = self.client.table("genres").select("*").order("story_count", desc=True).execute()
+        result = await self._exec(self.client.table("genres").select("*").order("story_count", desc=True))
         return result.data or []
     
     # ========== Crawl Stats ==========
     
+    # 1 câu atomic (cần UNIQUE(date)): không mất số liệu khi nhiều runner cùng ghi
+    CRAWL_STATS_UPSERT = """
+        INSERT INTO crawl_stats (date, stories_crawled, chapters_crawled, content_fetched, errors)
+        VALUES ($1, $2, $3, $4, $5)
+        ON CONFLICT (date) DO UPDATE SET
+            stories_crawled = crawl_stats.stories_crawled + EXCLUDED.stories_crawled,
+            chapters_crawled = crawl_stats.chapters_crawled + EXCLUDED.chapters_crawled,
+            content_fetched = crawl_stats.content_fetched + EXCLUDED.content_fetched,
+            errors = crawl_stats.errors + EXCLUDED.errors
+    """
+    
     async def update_crawl_stats(self, stories: int = 0, chapters: int = 0, content: int = 0, errors: int = 0):
-        """Update today's crawl statistics"""
-        from datetime import date
-        today = date.today().isoformat()
-        
-        # Try to get existing record
-        result = self.client.table("crawl_stats").select("*").eq("date", today).execute()
+        """
+        Increment today's crawl statistics in one atomic upsert
+        asyncpg pool nếu có, else RPC increment_crawl_stats (cùng câu SQL, qua PostgREST)
+        """
+        pool = get_pool()
+        if pool is not None:
+            try:
+                await pool.execute(self.CRAWL_STATS_UPSERT, date.today(), stories, chapters, content, errors)
+                return
+            except Exception as e:
+                print(f"[DB] asyncpg crawl_stats upsert failed, fallback to PostgREST: {e}")
         
-        if result.data:
-            # Update existing
-            existing = result.data[0]
-            self.client.table("crawl_stats").update({
-                "stories_crawled": existing["stories_crawled"] + stories,
-                "chapters_crawled": existing["chapters_crawled"] + chapters,
-                "content_fetched": existing["content_fetched"] + content,
-                "errors": existing["errors"] + errors,
-            }).eq("date", today).execute()
-        else:
-            # Create new
-            self.client.table("crawl_stats").insert({
-                "date": today,
-                "stories_crawled": stories,
-                "chapters_crawled": chapters,
-                "content_fetched": content,
-                "errors": errors,
-            }).execute()
+        try:
+            await self._exec(self.client.rpc("increment_crawl_stats", {
+                "p_date": date.today().isoformat(),
+                "p_stories": stories,
+                "p_chapters": chapters,
+                "p_content": content,
+                "p_errors": errors,
+            }))
+        except Exception as e:
+            print(f"[DB ERROR] update_crawl_stats failed (migration add_increment_crawl_stats_rpc.sql?): {e}")
     
     async def get_crawl_stats(self, days: int = 7) -> list:
         """Get crawl stats for last N days"""
-        result = self.client.table("crawl_stats").select("*").order("date", desc=True).limit(days).execute()
+        result = await self._exec(self.client.table("crawl_stats").select("*").order("date", desc=True).limit(days))
         return result.data or []
     
     # ========== Reading History ==========
     
     async def add_reading_history(self, user_id: str, story_id: str, chapter_id: str):
         """Add reading history entry"""
-        self.client.table("reading_history").insert({
+        await self._exec(self.client.table("reading_history").insert({
             "user_id": user_id,
             "story_id": story_id,
             "chapter_id": chapter_id,
-        }).execute()
+        }))
     
     async def get_reading_history(self, user_id: str, limit: int = 20) -> list:
         """Get user's reading history"""
-        result = self.client.table("reading_history").select(
+        result = await self._exec(self.client.table("reading_history").select(
             "*, stories(id, title, cover_url), chapters(id, chapter_number, title)"
-        ).eq("user_id", user_id).order("read_at", desc=True).limit(limit).execute()
+        ).eq("user_id", user_id).order("read_at", desc=True).limit(limit))
         return result.data or []
     
     # ========== Storage (GZIP Compressed Chapter Content) ==========
     
     STORAGE_BUCKET = "chapters"
+    # Level 6 (mặc định của zlib): cùng kích thước với 9 trên text chương, nén nhanh hơn ~25%
+    GZIP_LEVEL = 6
+    # Storage API: list/remove tối đa 1000 object mỗi request
+    STORAGE_BATCH_SIZE = 1000
+    STORAGE_CONCURRENCY = 8
+    
+    def _list_storage(self, prefix: str = "") -> list:
+        """List every object name under prefix (blocking; list() mặc định chỉ trả 100 -> phân trang)"""
+        bucket = self.client.storage.from_(self.STORAGE_BUCKET)
+        names, offset = [], 0
+        while True:
+            page = bucket.list(prefix, {"limit": self.STORAGE_BATCH_SIZE, "offset": offset})
+            names.extend(item["name"] for item in page if item.get("name"))
+            if len(page) < self.STORAGE_BATCH_SIZE:
+                return names
+            offset += len(page)
     
     def _get_storage_path(self, story_id: str, chapter_number: int) -> str:
         """Generate storage path for chapter content"""
         return f"{story_id}/chap_{chapter_number}.gz"
     
-    async def upload_chapter_content(self, story_id: str, chapter_number: int, content: str) -> bool:
+    async def upload_chapter_content(
+        self, story_id: str, chapter_number: int, content: str, mark_archived: bool = True
+    ) -> bool:
         """
         Compress and upload chapter content to Supabase Storage
         Returns True if successful
+        
+        mark_archived=False: chỉ upload, caller tự gọi mark_chapters_archived theo batch
         """
         import gzip
         
         if not content:
             return False
         
-        try:
-            # Compress content with GZIP
-            compressed_data = gzip.compress(content.encode('utf-8'))
-            path = self._get_storage_path(story_id, chapter_number)
-            
-            # Upload to storage
-            result = self.client.storage.from_(self.STORAGE_BUCKET).upload(
+        def compress_and_upload() -> bytes:
+            # Nén trong thread cùng upload, không chiếm event loop
+            # mtime=0: cùng content -> cùng bytes (ETag ổn định khi upload lại)
+            data = gzip.compress(content.encode('utf-8'), compresslevel=self.GZIP_LEVEL, mtime=0)
+            self.client.storage.from_(self.STORAGE_BUCKET).upload(
                 path,
-                compressed_data,
+                data,
                 file_options={"content-type": "application/octet-stream", "upsert": "true"}
             )
+            return data
+        
+        try:
+            path = self._get_storage_path(story_id, chapter_number)
+            compressed_data = await asyncio.to_thread(compress_and_upload)
             
             print(f"[Storage] Uploaded {path} ({len(content)} chars -> {len(compressed_data)} bytes)")
             
+            if not mark_archived:
+                return True
+            
             # Update chapter record with storage path
-            self.client.table("chapters").update({
+            await self._exec(self.client.table("chapters").update({
                 "storage_path": path,
                 "is_archived": True,
                 "content": None  # Clear DB content to save space
-            }).eq("story_id", story_id).eq("chapter_number", chapter_number).execute()
+            }).eq("story_id", story_id).eq("chapter_number", chapter_number))
             
             return True
         except Exception as e:
             print(f"[Storage ERROR] Upload failed: {e}")
             return False
     
+    async def mark_chapters_archived(self, story_id: str, chapter_numbers: list) -> int:
+        """
+        Mark many uploaded chapters as archived in ONE upsert
+        (thay vì 1 UPDATE mỗi chương). Returns number of rows updated.
+        """
+        if not chapter_numbers:
+            return 0
+        
+        rows = [{
+            "story_id": story_id,
+            "chapter_number": num,
+            "storage_path": self._get_storage_path(story_id, num),
+            "is_archived": True,
+            "content": None,  # Clear DB content to save space
+        } for num in chapter_numbers]
+        
+        try:
+            result = await self._exec(self.client.table("chapters").upsert(
+                rows, on_conflict="story_id,chapter_number"
+            ))
+            return len(result.data) if result.data else 0
+        except Exception as e:
+            print(f"[DB ERROR] mark_chapters_archived failed: {e}")
+            return 0
+    
+    async def download_chapter_blob(self, story_id: str, chapter_number: int) -> bytes | None:
+        """
+        Download the raw GZIP object from Supabase Storage (no decompression)
+        Returns compressed bytes or None if not found
+        """
+        try:
+            path = self._get_storage_path(story_id, chapter_number)
+            data = await asyncio.to_thread(self.client.storage.from_(self.STORAGE_BUCKET).download, path)
+            return data or None
+        except Exception as e:
+            print(f"[Storage] Download failed for {story_id}/chap_{chapter_number}: {e}")
+            return None
+    
     async def download_chapter_content(self, story_id: str, chapter_number: int) -> str | None:
         """
         Download and decompress chapter content from Supabase Storage
@@ -274,20 +863,17 @@ class Database:
         """
         import gzip
         
-        try:
-            path = self._get_storage_path(story_id, chapter_number)
-            
-            # Download from storage
-            data = self.client.storage.from_(self.STORAGE_BUCKET).download(path)
-            
-            if data:
-                # Decompress
-                content = gzip.decompress(data).decode('utf-8')
-                print(f"[Storage] Downloaded {path} ({len(data)} bytes -> {len(content)} chars)")
-                return content
+        data = await self.download_chapter_blob(story_id, chapter_number)
+        if not data:
             return None
+        
+        try:
+            # Decompress
+            content = gzip.decompress(data).decode('utf-8')
+            print(f"[Storage] Downloaded {story_id}/chap_{chapter_number} ({len(data)} bytes -> {len(content)} chars)")
+            return content
         except Exception as e:
-            print(f"[Storage] Download failed for {story_id}/chap_{chapter_number}: {e}")
+            print(f"[Storage] Decompress failed for {story_id}/chap_{chapter_number}: {e}")
             return None
     
     async def get_chapter_content(self, story_id: str, chapter_number: int) -> str | None:
@@ -307,35 +893,58 @@ class Database:
         return None
     
     async def is_chapter_archived(self, story_id: str, chapter_number: int) -> bool:
-        """Check if chapter content is saved in storage"""
-        chapter = await self.get_chapter(story_id, chapter_number)
-        return chapter.get("is_archived", False) if chapter else False
+        """Check if chapter content is saved in storage (chỉ lấy cột is_archived, không kéo content)"""
+        result = await self._exec(self.client.table("chapters").select("is_archived").eq(
+            "story_id", story_id
+        ).eq("chapter_number", chapter_number).limit(1))
+        return bool(result.data and result.data[0].get("is_archived"))
     
     async def clear_all_data(self) -> dict:
         """
         XÓA TOÀN BỘ DATA - Stories, Chapters, và Storage
         Dùng để re-crawl từ đầu
         """
+        _story_cache.clear()
+        redis = get_redis()
+        if redis is not None:
+            try:
+                keys = [key async for key in redis.scan_iter(match="story:*", count=1000)]
+                if keys:
+                    await redis.delete(*keys)
+            except Exception as e:
+                mark_redis_down(e)
         try:
             # 1. Delete all chapters first (foreign key constraint)
-            chapters_result = self.client.table("chapters").delete().neq("id", "00000000-0000-0000-0000-000000000000").execute()
+            chapters_result = await self._exec(self.client.table("chapters").delete().neq("id", "00000000-0000-0000-0000-000000000000"))
             chapters_deleted = len(chapters_result.data) if chapters_result.data else 0
             
             # 2. Delete all stories
-            stories_result = self.client.table("stories").delete().neq("id", "00000000-0000-0000-0000-000000000000").execute()
+            stories_result = await self._exec(self.client.table("stories").delete().neq("id", "00000000-0000-0000-0000-000000000000"))
             stories_deleted = len(stories_result.data) if stories_result.data else 0
             
-            # 3. Clear storage bucket
+            # 3. Clear storage bucket: list các folder song song, xóa theo batch (1 request / 1000 file)
             storage_cleared = 0
             try:
-                files = self.client.storage.from_(self.STORAGE_BUCKET).list()
-                for folder in files:
-                    if folder.get("name"):
-                        folder_files = self.client.storage.from_(self.STORAGE_BUCKET).list(folder["name"])
-                        for file in folder_files:
-                            if file.get("name"):
-                                self.client.storage.from_(self.STORAGE_BUCKET).remove([f"{folder['name']}/{file['name']}"])
-                                storage_cleared += 1
+                bucket = self.client.storage.from_(self.STORAGE_BUCKET)
+                slots = asyncio.Semaphore(self.STORAGE_CONCURRENCY)
+                
+                async def in_thread(fn, *args):
+                    async with slots:
+                        return await asyncio.to_thread(fn, *args)
+                
+                folders = await asyncio.to_thread(self._list_storage)
+                folder_files = await asyncio.gather(*(in_thread(self._list_storage, f) for f in folders))
+                paths = [
+                    f"{folder}/{name}"
+                    for folder, names in zip(folders, folder_files)
+                    for name in names
+                ]
+                batches = [
+                    paths[i:i + self.STORAGE_BATCH_SIZE]
+                    for i in range(0, len(paths), self.STORAGE_BATCH_SIZE)
+                ]
+                await asyncio.gather(*(in_thread(bucket.remove, batch) for batch in batches))
+                storage_cleared = len(paths)
             except Exception as e:
                 print(f"[Clear Storage] Warning: {e}")
             
@@ -352,6 +961,124 @@ class Database:
             }
 
 
-# Singleton instance
+
+def hash_chapter_content(content: str) -> str:
+    """Content hash of a chapter (stored in chapters.content_hash)"""
+    return hashlib.blake2b(content.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class ChapterBuffer:
+    """
+    Buffer crawled chapters and upsert them in batches (1 round trip / batch thay vì / chương)
+    Flush khi đủ max_rows, tổng content vượt max_chars (giữ payload dưới giới hạn của PostgREST)
+    hoặc batch đã chờ quá max_delay giây
+    Chương có content_hash trùng với DB (crawl lại truyện đã đủ) thì bỏ qua, không upsert
+    
+    Batch được ghi ở background (tối đa max_writers batch cùng lúc): worker crawl không phải
+    chờ round trip DB, chỉ bị chặn khi DB ghi chậm hơn tốc độ crawl (back-pressure)
+    """
+    
+    def __init__(
+        self,
+        db: Database,
+        max_rows: int = 100,
+        max_chars: int = 1_000_000,
+        max_delay: float = 2.0,
+        max_writers: int = 2,
+    ):
+        self.db = db
+        self.max_rows = max_rows
+        self.max_chars = max_chars
+        self.max_delay = max_delay
+        # chapter_number -> record (1 batch upsert không được chạm cùng 1 dòng 2 lần)
+        self._pending: dict = {}
+        self._chars = 0
+        self._first_at = 0.0
+        # story_id -> task loading {chapter_number: content_hash} (1 SELECT / truyện)
+        self._stored_hashes: dict = {}
+        self.skipped = 0
+        # Số chương không ghi được (caller giữ checkpoint để crawl lại)
+        self.failed = 0
+        self._write_slots = asyncio.Semaphore(max_writers)
+        self._writes: set = set()
+        # Rows saved by finished writes since the last flush()
+        self._saved: list = []
+    
+    async def _hashes_for(self, story_id: str) -> dict | None:
+        task = self._stored_hashes.get(story_id)
+        if task is None:
+            # Nhiều worker add() cùng lúc -> dùng chung 1 task
+            task = self._stored_hashes[story_id] = asyncio.ensure_future(self.db.get_chapter_hashes(story_id))
+        return await task
+    
+    async def add(self, record: dict) -> None:
+        """Buffer one chapter row, starting a background write when a threshold is reached"""
+        hashes = await self._hashes_for(record["story_id"])
+        if hashes is not None:
+            content_hash = hash_chapter_content(record.get("content") or "")
+            if hashes.get(record["chapter_number"]) == content_hash:
+                self.skipped += 1
+                return
+            record["content_hash"] = content_hash
+        
+        now = asyncio.get_running_loop().time()
+        if not self._pending:
+            self._first_at = now
+        self._pending[record["chapter_number"]] = record
+        self._chars += len(record.get("content") or "")
+        if (
+            len(self._pending) >= self.max_rows
+            or self._chars >= self.max_chars
+            or now - self._first_at >= self.max_delay
+        ):
+            await self._start_write()
+    
+    async def _start_write(self) -> None:
+        """Hand the pending batch to a background writer"""
+        if not self._pending:
+            return
+        batch = list(self._pending.values())
+        self._pending.clear()
+        self._chars = 0
+        # Đủ max_writers batch đang ghi -> chờ 1 batch xong
+        await self._write_slots.acquire()
+        task = asyncio.create_task(self._write(batch))
+        self._writes.add(task)
+        task.add_done_callback(self._writes.discard)
+    
+    async def _write(self, batch: list) -> None:
+        # Kết quả giữ ở đây: task xong bị bỏ khỏi _writes trước khi flush() chạy
+        try:
+            saved = await self.db.bulk_upsert_chapters(batch)
+            self.failed += len(batch) - len(saved)
+            self._saved.extend(saved)
+        except Exception as e:
+            self.failed += len(batch)
+            print(f"[DB ERROR] ChapterBuffer write failed: {e}")
+        finally:
+            self._write_slots.release()
+    
+    async def flush(self) -> list:
+        """Upsert everything buffered and wait for in-flight writes (returns the rows saved since the last flush)"""
+        await self._start_write()
+        await asyncio.gather(*self._writes, return_exceptions=True)
+        saved, self._saved = self._saved, []
+        return saved
+
+# Singleton instance (rẻ: client chỉ được tạo khi query đầu tiên chạy)
 db = Database()
 
+
+# ========== Cross-worker cache invalidation ==========
+# Trigger gửi NOTIFY khi stories đổi (migrations/add_cache_invalidation_notify.sql)
+# -> mọi worker xóa cache ngay, kể cả khi write đến từ process khác
+
+def _on_stories_changed(payload: str) -> None:
+    story_id, _, slug = payload.partition(":")
+    _fire_and_forget(db._invalidate_stories(ids=[story_id], slugs=[slug]))
+
+
+CACHE_INVALIDATION_CHANNELS = {
+    "stories_changed": _on_stories_changed,
+}
+
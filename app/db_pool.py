@@ -0,0 +1,111 @@
+"""
+Postgres Connection Pool (optional)
+asyncpg nói chuyện trực tiếp với Postgres (binary protocol, connection giữ sẵn) thay vì
+HTTP + JSON qua PostgREST. Chỉ bật khi có DATABASE_URL; nếu không, get_pool() trả None
+và Database fallback về supabase-py.
+"""
+from urllib.parse import urlsplit
+
+from .config import get_settings
+
+try:
+    import asyncpg
+except ImportError:  # asyncpg chưa được cài
+    asyncpg = None
+
+
+# Supabase giới hạn số connection trực tiếp (free tier ~60) -> pool nhỏ, giữ ấm vài connection
+POOL_MIN_SIZE = 2
+POOL_MAX_SIZE = 20
+# Supabase pooler ở transaction mode (PgBouncer) không giữ prepared statements giữa các transaction
+TRANSACTION_POOLER_PORT = 6543
+
+_pool = None
+# Connection riêng cho LISTEN (connection trong pool bị trả lại / dùng chung, không giữ listener được)
+_listener = None
+
+
+async def init_pool():
+    """Create the pool for the running loop (call once at startup), or None if disabled"""
+    global _pool
+    settings = get_settings()
+    if asyncpg is None or not settings.database_url or _pool is not None:
+        return _pool
+    # asyncpg prepare() mỗi câu SQL 1 lần / connection rồi dùng lại (bỏ bước parse + plan)
+    # -> chỉ tắt khi đi qua transaction pooler
+    statement_cache_size = settings.database_statement_cache
+    try:
+        if urlsplit(settings.database_url).port == TRANSACTION_POOLER_PORT:
+            statement_cache_size = 0
+    except ValueError:
+        pass
+    try:
+        _pool = await asyncpg.create_pool(
+            settings.database_url,
+            min_size=POOL_MIN_SIZE,
+            max_size=POOL_MAX_SIZE,
+            max_inactive_connection_lifetime=300,
+            statement_cache_size=statement_cache_size,
+            command_timeout=30,
+        )
+        print(
+            f"🐘 Postgres pool ready ({POOL_MIN_SIZE}-{POOL_MAX_SIZE} connections, "
+            f"statement cache {statement_cache_size})"
+        )
+    except Exception as e:
+        print(f"[Postgres] Pool unavailable, using PostgREST: {e}")
+        _pool = None
+    return _pool
+
+
+async def start_listener(callbacks: dict):
+    """
+    LISTEN on each channel -> callback(payload), on a dedicated connection
+    Returns the connection, or None if disabled (không có DATABASE_URL / transaction pooler)
+    """
+    global _listener
+    settings = get_settings()
+    if asyncpg is None or not settings.database_url or _listener is not None:
+        return _listener
+    try:
+        # PgBouncer transaction mode không hỗ trợ LISTEN
+        if urlsplit(settings.database_url).port == TRANSACTION_POOLER_PORT:
+            print("[Postgres] LISTEN needs a direct/session connection, cache invalidation uses TTL only")
+            return None
+    except ValueError:
+        pass
+    
+    def on_terminate(conn):
+        # Mất connection -> cache chỉ còn dựa vào TTL (tới lần gọi start_listener() sau)
+        global _listener
+        _listener = None
+        print("[Postgres] Listener connection lost, cache invalidation uses TTL only")
+    
+    try:
+        conn = await asyncpg.connect(settings.database_url, statement_cache_size=0)
+        for channel, callback in callbacks.items():
+            await conn.add_listener(
+                channel, lambda _conn, _pid, _channel, payload, callback=callback: callback(payload)
+            )
+        conn.add_termination_listener(on_terminate)
+        _listener = conn
+        print(f"👂 Listening on {', '.join(callbacks)}")
+    except Exception as e:
+        print(f"[Postgres] Listener unavailable, cache invalidation uses TTL only: {e}")
+    return _listener
+
+
+def get_pool():
+    """Get the asyncpg pool, or None if not configured"""
+    return _pool
+
+
+async def close_pool():
+    """Close the pool (and the listener connection) at shutdown"""
+    global _pool, _listener
+    if _listener is not None:
+        listener, _listener = _listener, None
+        await listener.close()
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
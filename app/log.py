@@ -0,0 +1,38 @@
+"""
+Buffered Logging
+Hot loops chỉ đẩy record vào queue; 1 thread nền ghi ra stdout
+(thay cho print() trực tiếp: không tranh I/O lock giữa các workers)
+"""
+import atexit
+import logging
+import logging.handlers
+import queue
+import sys
+
+from .config import get_settings
+
+_queue: queue.SimpleQueue = queue.SimpleQueue()
+_listener: logging.handlers.QueueListener | None = None
+
+
+def _start_listener() -> None:
+    global _listener
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter("%(message)s"))  # Giữ nguyên format như print()
+    _listener = logging.handlers.QueueListener(_queue, handler)
+    _listener.start()
+    atexit.register(_listener.stop)  # Flush phần còn lại khi thoát
+
+
+def get_logger(name: str = "crawler") -> logging.Logger:
+    """Get a logger whose records go through the shared queue"""
+    if _listener is None:
+        _start_listener()
+    
+    logger = logging.getLogger(name)
+    if not logger.handlers:
+        logger.addHandler(logging.handlers.QueueHandler(_queue))
+        # Log từng chương/từng item chỉ bật khi DEBUG=true
+        logger.setLevel(logging.DEBUG if get_settings().debug else logging.INFO)
+        logger.propagate = False
+    return logger
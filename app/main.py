@@ -2,11 +2,19 @@
 FastAPI Application Entry Point
 """
 from contextlib import asynccontextmanager
+import httpx
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 
-from .config import get_settings
+from .config import get_settings, DEFAULT_HEADERS, HTTP2_AVAILABLE
 from .api.routes import router
+from .worker_pool import worker_pool
+from .cloudinary_utils import close_client as close_image_client
+from .crawler.crawler import close_session as close_crawler_session
+from .scheduler import scheduler
+from .db_pool import init_pool as init_db_pool, close_pool as close_db_pool, start_listener as start_db_listener
+from .database import CACHE_INVALIDATION_CHANNELS
 import sys
 import asyncio
 
@@ -23,10 +31,28 @@ async def lifespan(app: FastAPI):
     print(f"📡 Base URL: {settings.base_url}")
     print(f"🗄️  Supabase: {settings.supabase_url}")
     
+    # Shared HTTP client: 1 connection pool (keep-alive TCP+TLS, HTTP/2 multiplex) cho mọi request tới nguồn
+    app.state.http = httpx.AsyncClient(
+        http2=HTTP2_AVAILABLE,
+        timeout=30.0,
+        follow_redirects=True,
+        headers=DEFAULT_HEADERS,
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=50, keepalive_expiry=120),
+    )
+    app.state.db_pool = await init_db_pool()
+    await start_db_listener(CACHE_INVALIDATION_CHANNELS)
+    await worker_pool.start(settings.max_concurrent_crawls)
+    
     yield
     
     # Shutdown
     print("👋 Shutting down Crawler Service...")
+    await worker_pool.stop()
+    await app.state.http.aclose()
+    await close_image_client()
+    await close_crawler_session()
+    await scheduler.close()
+    await close_db_pool()
 
 
 def create_app() -> FastAPI:
@@ -52,6 +78,7 @@ A robust, scalable web crawler service built with:
         """,
         version="1.0.0",
         lifespan=lifespan,
+        default_response_class=ORJSONResponse,  # C-level JSON encoding (chapter content lớn)
         docs_url="/docs",
         redoc_url="/redoc",
     )
@@ -0,0 +1,50 @@
+"""
+Redis Connection (optional)
+Dùng cho state "nóng" (task progress...). Nếu Redis không có/không chạy,
+get_redis() trả None và caller fallback về Supabase.
+"""
+import asyncio
+import time
+import weakref
+
+from .config import get_settings
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # redis chưa được cài
+    aioredis = None
+
+
+# Sau khi lỗi kết nối, bỏ qua Redis trong N giây để không làm chậm mọi request
+RETRY_AFTER_SECONDS = 60
+
+# event loop -> client (asyncio connections gắn với loop tạo ra chúng)
+_clients = weakref.WeakKeyDictionary()
+_disabled_until = 0.0
+
+
+def get_redis():
+    """Get pooled async Redis client for the running loop, or None if unavailable"""
+    if aioredis is None or time.monotonic() < _disabled_until:
+        return None
+
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        settings = get_settings()
+        pool = aioredis.ConnectionPool.from_url(
+            settings.redis_url,
+            decode_responses=True,
+            socket_connect_timeout=0.5,
+            socket_timeout=0.5,
+        )
+        client = aioredis.Redis(connection_pool=pool)
+        _clients[loop] = client
+    return client
+
+
+def mark_redis_down(error: Exception):
+    """Disable Redis for a while after a connection error"""
+    global _disabled_until
+    _disabled_until = time.monotonic() + RETRY_AFTER_SECONDS
+    print(f"[Redis] Unavailable, using database for {RETRY_AFTER_SECONDS}s: {error}")
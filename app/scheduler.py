@@ -7,9 +7,19 @@ from typing import Optional, List
 from collections import deque
 import gc  # Memory management
 
+import httpx
+
+from .config import DEFAULT_HEADERS, HTTP2_AVAILABLE
+
 # Giới hạn concurrent requests để tránh tràn RAM
 CRAWL_SEMAPHORE = asyncio.Semaphore(2)  # Chỉ 2 requests cùng lúc
 
+# Số truyện tải trước metadata (trang truyện + danh sách chương) trong lúc truyện hiện tại tải nội dung
+STORY_PREFETCH = 3
+
+# Chapter metadata (content rỗng, vài trăm byte / dòng) -> 1 upsert cho 500 chương
+CHAPTER_META_BATCH = 500
+
 class CrawlScheduler:
     def __init__(self):
         self.is_running = False
@@ -17,6 +27,7 @@ class CrawlScheduler:
         self.interval_minutes = 15
         self.last_run: Optional[datetime] = None
         self.task: Optional[asyncio.Task] = None
+        self._client: Optional[httpx.AsyncClient] = None
         
         # Realtime tracking
         self.current_story = ""
@@ -36,6 +47,25 @@ class CrawlScheduler:
             "status": "idle",  # idle, crawling_list, crawling_story, saving_chapters, done
         }
         
+    def _get_client(self) -> httpx.AsyncClient:
+        """Get (lazily create) the client for chapter content, kept across runs"""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                http2=HTTP2_AVAILABLE,
+                timeout=30.0,
+                follow_redirects=True,
+                headers=DEFAULT_HEADERS,
+                # Giới hạn connections để tiết kiệm RAM
+                limits=httpx.Limits(max_keepalive_connections=1, max_connections=2, keepalive_expiry=60),
+            )
+        return self._client
+    
+    async def close(self):
+        """Close the shared client (app shutdown)"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+    
     def _log(self, message: str):
         """Add log entry"""
         entry = {
@@ -83,35 +113,55 @@ class CrawlScheduler:
     
     async def _run_crawl_job(self):
         """Chạy crawl job"""
-        from .crawler.crawler import StoryCrawler
-        from .database import Database
-        
-        crawler = StoryCrawler()
-        db = Database()
+        from .crawler.crawler import StoryCrawler, CATEGORY_URLS
+        from .database import db
         
         self._log("📚 Đang lấy danh sách truyện mới...")
         try:
-            stories = await crawler.crawl_story_list(
-                f"{crawler.settings.base_url}/danh-sach/truyen-moi/",
-                max_pages=2
-            )
-            self._log(f"📋 Tìm thấy {len(stories)} truyện")
-            
-            # Chỉ xử lý 3 truyện mỗi lần để tiết kiệm RAM
-            for story_info in stories[:3]:
-                if not self.auto_enabled:
-                    break
-                try:
-                    await self._crawl_and_save_story(crawler, db, story_info["source_url"])
-                except Exception as e:
-                    self.stats["errors"] += 1
-                    continue
+            # 1 Chromium dùng chung cho mọi trang bị chặn (listing + truyện prefetch song song)
+            async with StoryCrawler() as crawler:
+                stories = await crawler.crawl_story_list(
+                    CATEGORY_URLS["new"],
+                    max_pages=2
+                )
+                self._log(f"📋 Tìm thấy {len(stories)} truyện")
+                
+                # Chỉ xử lý 3 truyện mỗi lần để tiết kiệm RAM
+                await self._crawl_stories(crawler, db, stories[:3], lambda: self.auto_enabled)
                     
         except Exception as e:
             self._log(f"❌ Lỗi crawl: {e}")
     
-    async def _crawl_and_save_story(self, crawler, db, url: str):
-        """Crawl và lưu 1 truyện + TẤT CẢ chapters trước khi sang truyện khác"""
+    async def _crawl_stories(self, crawler, db, story_infos: list, keep_going):
+        """
+        Crawl + lưu lần lượt từng truyện (nội dung vẫn tuần tự để giữ RAM thấp)
+        Metadata của STORY_PREFETCH truyện kế tiếp được tải song song trong lúc chờ
+        """
+        urls = [info["source_url"] for info in story_infos]
+        prefetched: dict = {}
+        try:
+            for idx, url in enumerate(urls):
+                if not keep_going():
+                    break
+                for ahead in urls[idx:idx + STORY_PREFETCH]:
+                    if ahead not in prefetched:
+                        prefetched[ahead] = asyncio.create_task(
+                            crawler.crawl_story(ahead, include_chapters=False)
+                        )
+                try:
+                    await self._crawl_and_save_story(crawler, db, url, prefetched.pop(url))
+                except Exception:
+                    self.stats["errors"] += 1
+        finally:
+            for task in prefetched.values():
+                task.cancel()
+            await asyncio.gather(*prefetched.values(), return_exceptions=True)
+    
+    async def _crawl_and_save_story(self, crawler, db, url: str, prefetched: Optional[asyncio.Task] = None):
+        """
+        Crawl và lưu 1 truyện + TẤT CẢ chapters trước khi sang truyện khác
+        prefetched: task crawl_story đã chạy trước (xem _crawl_stories)
+        """
         # Extract title from URL for display
         slug = url.rstrip('/').split('/')[-1]
         self.current_story = slug
@@ -125,7 +175,10 @@ class CrawlScheduler:
             # Crawl story VÀ lấy danh sách chapters từ TẤT CẢ pages
             # include_chapters=False nghĩa là không crawl NỘI DUNG chapter (chậm)
             # nhưng VẪN lấy DANH SÁCH chapters (title, source_url, chapter_number)
-            story = await crawler.crawl_story(url, include_chapters=False)
+            if prefetched is not None:
+                story = await prefetched
+            else:
+                story = await crawler.crawl_story(url, include_chapters=False)
             
             raw_chapters = story.get("chapters", [])
             
@@ -152,13 +205,15 @@ class CrawlScheduler:
             # Lưu story trước
             cover_url = story.get("cover_url")
             
-            # Upload cover to Cloudinary if not already there
+            cover_fields = {}
+            
+            # Upload cover to Cloudinary if not already there (skip if unchanged)
             if cover_url and "cloudinary.com" not in cover_url:
                 try:
-                    from .cloudinary_utils import upload_cover_from_url
-                    new_cover_url = await upload_cover_from_url(cover_url, story["slug"])
-                    if new_cover_url:
-                        cover_url = new_cover_url
+                    from .cloudinary_utils import sync_cover
+                    existing = await db.get_story_by_slug(story["slug"])
+                    cover_fields = await sync_cover(cover_url, story["slug"], existing)
+                    if cover_fields.get("cover_hash"):
                         self._log(f"  🖼️ Cover uploaded to Cloudinary")
                 except Exception as e:
                     self._log(f"  ⚠️ Cover upload failed: {e}")
@@ -175,14 +230,11 @@ class CrawlScheduler:
                 "source_url": story.get("source_url"),
                 "updated_at": datetime.now(timezone.utc).isoformat(),
             }
+            story_record.update(cover_fields)
             
             saved_story = await db.upsert_story(story_record)
             story_id = saved_story.get("id") if saved_story else None
             
-            if not story_id:
-                existing = await db.get_story_by_slug(story["slug"])
-                story_id = existing["id"] if existing else None
-            
             if not story_id:
                 self._log(f"  ❌ Không lưu được truyện: {story['title']}")
                 self.stats["errors"] += 1
@@ -194,7 +246,7 @@ class CrawlScheduler:
             
             # Lưu TẤT CẢ chapters theo batch để tối ưu
             saved_count = 0
-            batch_size = 50
+            batch_size = CHAPTER_META_BATCH
             
             for i in range(0, total_chapters, batch_size):
                 if not self.is_running and not self.auto_enabled:
@@ -237,86 +289,75 @@ class CrawlScheduler:
             # ===== PHASE 2: Crawl nội dung chapters (Memory-optimized) =====
             self._log(f"  📥 Đang tải nội dung (low-memory mode)...")
             
-            import httpx
             from .crawler.parsers import parse_chapter_content
-            
-            headers = {
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36",
-                "Accept-Language": "vi-VN,vi;q=0.9",
-                "Referer": "https://truyenfull.vision/",
-            }
+            from .crawler.crawler import polite_slot
             
             content_saved = 0
             content_errors = 0
             
-            # Giới hạn connections để tiết kiệm RAM
-            limits = httpx.Limits(max_keepalive_connections=1, max_connections=2)
-            
-            async with httpx.AsyncClient(
-                timeout=30.0, 
-                follow_redirects=True, 
-                headers=headers,
-                limits=limits  # Giới hạn kết nối
-            ) as client:
-                for idx, ch in enumerate(chapters):
-                    if not self.is_running and not self.auto_enabled:
-                        self._log(f"  ⏹️ Dừng tải nội dung")
-                        break
+            # Client dùng chung giữa các truyện (không handshake DNS/TLS lại mỗi truyện)
+            client = self._get_client()
+            for idx, ch in enumerate(chapters):
+                if not self.is_running and not self.auto_enabled:
+                    self._log(f"  ⏹️ Dừng tải nội dung")
+                    break
+                
+                try:
+                    # Check if already archived
+                    is_archived = await db.is_chapter_archived(story_id, ch["chapter_number"])
+                    if is_archived:
+                        content_saved += 1
+                        continue
                     
-                    try:
-                        # Check if already archived
-                        is_archived = await db.is_chapter_archived(story_id, ch["chapter_number"])
-                        if is_archived:
-                            content_saved += 1
-                            continue
+                    # Fetch with Semaphore to limit concurrent requests
+                    async with CRAWL_SEMAPHORE:
+                        # robots.txt + crawl_limiter như mọi request khác tới nguồn
+                        await polite_slot(ch["source_url"])
+                        response = await client.get(ch["source_url"])
+                        response.raise_for_status()
                         
-                        # Fetch with Semaphore to limit concurrent requests
-                        async with CRAWL_SEMAPHORE:
-                            response = await client.get(ch["source_url"])
-                            response.raise_for_status()
-                            
-                            # Parse and immediately release response memory
-                            html_text = response.text
-                            del response  # Xóa ngay khỏi RAM
-                            
-                            parsed = parse_chapter_content(html_text, ch["source_url"])
-                            del html_text  # Xóa ngay khỏi RAM
-                            
-                            content = parsed.get("content", "")
-                            del parsed  # Xóa ngay khỏi RAM
+                        # Parse and immediately release response memory
+                        html_text = response.content  # bytes: không decode sang str
+                        del response  # Xóa ngay khỏi RAM
                         
-                        if content:
-                            # Save to Storage (GZIP)
-                            success = await db.upload_chapter_content(
-                                story_id, 
-                                ch["chapter_number"], 
-                                content
-                            )
-                            content = None  # Release content memory
-                            if success:
-                                content_saved += 1
+                        parsed = parse_chapter_content(html_text, ch["source_url"])
+                        del html_text  # Xóa ngay khỏi RAM
                         
-                        # Progress update
-                        self.progress["current_chapter"] = idx + 1
-                        self.progress["percent"] = int(((idx + 1) / total_chapters) * 100)
-                        
-                        # Rate limiting - 0.5s between requests (reduced from 0.3s for stability)
-                        await asyncio.sleep(0.5)
-                        
-                    except Exception as e:
-                        content_errors += 1
-                        if content_errors <= 3:
-                            self._log(f"    ⚠️ Lỗi chương {ch.get('chapter_number')}: {str(e)[:50]}")
+                        content = parsed.get("content", "")
+                        del parsed  # Xóa ngay khỏi RAM
                     
-                    # Log progress and collect garbage every 5 chapters (ultra-slow mode)
-                    if (idx + 1) % 5 == 0:
-                        gc.collect()  # Force garbage collection
-                        self._log(f"  📥 Progress: {idx+1}/{total_chapters} (saved: {content_saved})")
-                        
-                        # Batch cooldown - give RAM time to recover
-                        if (idx + 1) < total_chapters:
-                            self._log(f"  ⏸️ Nghỉ 30s để giải phóng RAM...")
-                            await asyncio.sleep(30)
+                    if content:
+                        # Save to Storage (GZIP)
+                        success = await db.upload_chapter_content(
+                            story_id, 
+                            ch["chapter_number"], 
+                            content
+                        )
+                        content = None  # Release content memory
+                        if success:
+                            content_saved += 1
+                    
+                    # Progress update
+                    self.progress["current_chapter"] = idx + 1
+                    self.progress["percent"] = int(((idx + 1) / total_chapters) * 100)
+                    
+                    # Rate limiting - 0.5s between requests (reduced from 0.3s for stability)
+                    await asyncio.sleep(0.5)
+                    
+                except Exception as e:
+                    content_errors += 1
+                    if content_errors <= 3:
+                        self._log(f"    ⚠️ Lỗi chương {ch.get('chapter_number')}: {str(e)[:50]}")
+                
+                # Log progress and collect garbage every 5 chapters (ultra-slow mode)
+                if (idx + 1) % 5 == 0:
+                    gc.collect()  # Force garbage collection
+                    self._log(f"  📥 Progress: {idx+1}/{total_chapters} (saved: {content_saved})")
+                    
+                    # Batch cooldown - give RAM time to recover
+                    if (idx + 1) < total_chapters:
+                        self._log(f"  ⏸️ Nghỉ 30s để giải phóng RAM...")
+                        await asyncio.sleep(30)
             
             self.progress["status"] = "done"
             self.progress["percent"] = 100
@@ -346,38 +387,24 @@ class CrawlScheduler:
         self._log(f"🚀 Bắt đầu crawl: {categories}")
         
         try:
-            from .crawler.crawler import StoryCrawler
-            from .database import Database
-            
-            crawler = StoryCrawler()
-            db = Database()
+            from .crawler.crawler import StoryCrawler, CATEGORY_URLS
+            from .database import db
             
-            category_urls = {
-                "hot": f"{crawler.settings.base_url}/danh-sach/truyen-hot/",
-                "new": f"{crawler.settings.base_url}/danh-sach/truyen-moi/",
-                "completed": f"{crawler.settings.base_url}/danh-sach/truyen-full/",
-            }
-            
-            for category in categories:
-                if not self.is_running:
-                    self._log("⏹️ Đã dừng bởi người dùng")
-                    break
-                    
-                if category not in category_urls:
-                    continue
-                    
-                self._log(f"📂 Danh mục: {category}")
-                stories = await crawler.crawl_story_list(category_urls[category], max_pages=max_pages)
-                self._log(f"  📋 Tìm thấy {len(stories)} truyện")
-                
-                for story_info in stories:
+            # 1 Chromium dùng chung cho mọi trang bị chặn (listing + truyện prefetch song song)
+            async with StoryCrawler() as crawler:
+                for category in categories:
                     if not self.is_running:
+                        self._log("⏹️ Đã dừng bởi người dùng")
                         break
-                    try:
-                        await self._crawl_and_save_story(crawler, db, story_info["source_url"])
-                    except Exception as e:
-                        self.stats["errors"] += 1
+                        
+                    if category not in CATEGORY_URLS:
                         continue
+                        
+                    self._log(f"📂 Danh mục: {category}")
+                    stories = await crawler.crawl_story_list(CATEGORY_URLS[category], max_pages=max_pages)
+                    self._log(f"  📋 Tìm thấy {len(stories)} truyện")
+                    
+                    await self._crawl_stories(crawler, db, stories, lambda: self.is_running)
             
             self._log(f"🎉 Hoàn thành! {self.stats['stories_crawled']} truyện, {self.stats['chapters_saved']} chương")
             return {"status": "completed", "stats": self.stats}
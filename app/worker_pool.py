@@ -0,0 +1,134 @@
+"""
+Worker Pool - Chạy crawl jobs trong process hiện tại (thay cho subprocess.Popen)
+"""
+import asyncio
+from datetime import datetime, timezone
+from typing import Optional, List
+
+from .config import get_settings
+
+
+class CrawlWorkerPool:
+    """
+    Long-lived asyncio workers consuming crawl jobs from a queue
+    Bulk job chạy hàng giờ -> queue + worker riêng, không chiếm worker của /crawler/init
+    """
+
+    def __init__(self):
+        # kind ("story" / "bulk") -> queue
+        self.queues: dict = {}
+        self.workers: List[asyncio.Task] = []
+        # Jobs cut off by stop() while running
+        self._interrupted: List[dict] = []
+
+    async def start(self, num_workers: Optional[int] = None, num_bulk_workers: int = 1):
+        """Start N story workers (mặc định = MAX_CONCURRENT_CRAWLS) + bulk workers"""
+        if self.workers:
+            return
+
+        num_workers = num_workers or get_settings().max_concurrent_crawls
+        self.queues = {"story": asyncio.Queue(), "bulk": asyncio.Queue()}
+        self.workers = [
+            asyncio.create_task(self._worker("story", i)) for i in range(max(1, num_workers))
+        ] + [
+            asyncio.create_task(self._worker("bulk", i)) for i in range(max(1, num_bulk_workers))
+        ]
+        print(f"👷 Worker pool started ({len(self.workers)} workers, {max(1, num_bulk_workers)} for bulk)")
+
+    async def stop(self):
+        """Cancel all workers; jobs still queued or cut off are marked failed"""
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+
+        dropped, self._interrupted = self._interrupted, []
+        for queue in self.queues.values():
+            while not queue.empty():
+                job = queue.get_nowait()
+                dropped.append(job)
+                on_done = job.get("on_done")
+                if on_done:
+                    on_done()
+        self.queues = {}
+        await self._fail_jobs(dropped)
+
+    async def submit(self, job: dict):
+        """Enqueue a crawl job (non-blocking for the caller)"""
+        if not self.queues:
+            await self.start()
+        queue = self.queues.get(job.get("kind", "story"), self.queues["story"])
+        await queue.put(job)
+
+    def pending(self) -> int:
+        """Number of jobs waiting in the queues"""
+        return sum(queue.qsize() for queue in self.queues.values())
+
+    async def _worker(self, kind: str, worker_id: int):
+        """Consume jobs of one kind forever"""
+        queue = self.queues[kind]
+        while True:
+            job = await queue.get()
+            try:
+                await self._run_job(job)
+            except asyncio.CancelledError:
+                self._interrupted.append(job)
+                raise
+            except Exception as e:
+                print(f"❌ Worker {kind}-{worker_id}: job {job.get('task_id')} failed: {e}")
+            finally:
+                queue.task_done()
+                # Optional callback, e.g. release a semaphore held by the caller
+                on_done = job.get("on_done")
+                if on_done:
+                    on_done()
+
+    async def _fail_jobs(self, jobs: List[dict]):
+        """Mark story tasks that will never finish as failed (bulk jobs have no crawl_tasks row)"""
+        story_jobs = [job for job in jobs if job.get("kind", "story") == "story" and job.get("task_id")]
+        if not story_jobs:
+            return
+
+        from .database import db
+        for job in story_jobs:
+            # Insert crawl_tasks phải xong trước update
+            ready = job.get("ready")
+            if ready is not None:
+                await asyncio.gather(ready, return_exceptions=True)
+            try:
+                await db.update_task(job["task_id"], {
+                    "status": "failed",
+                    "error": "Server dừng trước khi task hoàn thành",
+                    "message": "Server dừng, hãy gửi lại yêu cầu",
+                    "completed_at": datetime.now(timezone.utc).isoformat(),
+                })
+            except Exception as e:
+                print(f"❌ Could not mark task {job['task_id']} failed: {e}")
+        print(f"⚠️ Worker pool stopped: {len(story_jobs)} unfinished tasks marked failed")
+
+    async def _run_job(self, job: dict):
+        """Dispatch job to the same coroutines the CLI runners use"""
+        kind = job.get("kind", "story")
+
+        # Wait for the caller's setup (e.g. crawl_tasks insert); its errors are logged there
+        ready = job.get("ready")
+        if ready is not None:
+            await asyncio.gather(ready, return_exceptions=True)
+
+        if kind == "story":
+            from .crawler.runner import run_full_crawl
+            await run_full_crawl(job["task_id"], job["url"], job.get("crawl_chapters", True))
+        elif kind == "bulk":
+            from .crawler.bulk_runner import bulk_crawl_stories
+            await bulk_crawl_stories(
+                job["task_id"],
+                job.get("categories", []),
+                job.get("max_pages", 5),
+                job.get("crawl_chapters", True),
+            )
+        else:
+            print(f"⚠️ Unknown job kind: {kind}")
+
+
+# Singleton instance
+worker_pool = CrawlWorkerPool()
@@ -0,0 +1,37 @@
+-- Migration: Notify API workers when stories change (in-process cache invalidation)
+-- Run this in Supabase SQL Editor
+-- Mỗi worker LISTEN trên stories_changed qua DATABASE_URL (xem app/db_pool.py)
+
+-- Payload "id:slug" of the changed story
+CREATE OR REPLACE FUNCTION notify_stories_changed()
+RETURNS TRIGGER AS $$
+DECLARE
+    row_data stories%ROWTYPE;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        row_data := OLD;
+    ELSE
+        row_data := NEW;
+    END IF;
+    PERFORM pg_notify('stories_changed', row_data.id::text || ':' || coalesce(row_data.slug, ''));
+    -- Đổi slug: xóa cả entry theo slug cũ
+    IF TG_OP = 'UPDATE' AND OLD.slug IS DISTINCT FROM NEW.slug THEN
+        PERFORM pg_notify('stories_changed', OLD.id::text || ':' || coalesce(OLD.slug, ''));
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS stories_notify ON stories;
+CREATE TRIGGER stories_notify
+    AFTER INSERT OR UPDATE OR DELETE ON stories
+    FOR EACH ROW EXECUTE FUNCTION notify_stories_changed();
+
+-- Không còn cache danh sách chương trong process: bỏ trigger chapters (nếu đã chạy bản cũ)
+DROP TRIGGER IF EXISTS chapters_notify ON chapters;
+DROP FUNCTION IF EXISTS notify_chapters_changed();
+
+-- Verify triggers
+SELECT trigger_name, event_object_table
+FROM information_schema.triggers
+WHERE trigger_name = 'stories_notify';
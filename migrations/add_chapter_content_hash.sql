@@ -0,0 +1,12 @@
+-- Migration: Skip re-upserting unchanged chapters on re-crawl
+-- Run this in Supabase SQL Editor
+
+-- BLAKE2b (16 bytes, hex) of the chapter content last written by the crawler
+ALTER TABLE chapters 
+ADD COLUMN IF NOT EXISTS content_hash TEXT;
+
+-- Verify column added
+SELECT column_name, data_type 
+FROM information_schema.columns 
+WHERE table_name = 'chapters' 
+AND column_name = 'content_hash';
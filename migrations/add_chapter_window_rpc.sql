@@ -0,0 +1,19 @@
+-- Migration: Chapter + prev/next navigation in one round-trip
+-- Run this in Supabase SQL Editor
+-- Dùng cho GET /api/v1/chapters/{id} (trước đây 3 query: chương + chương trước + chương sau)
+
+CREATE OR REPLACE FUNCTION get_chapter_window(p_chapter_id UUID)
+RETURNS JSONB AS $$
+    SELECT to_jsonb(c) || jsonb_build_object(
+        'prev_chapter_id', (
+            SELECT p.id FROM chapters p
+            WHERE p.story_id = c.story_id AND p.chapter_number = c.chapter_number - 1
+        ),
+        'next_chapter_id', (
+            SELECT n.id FROM chapters n
+            WHERE n.story_id = c.story_id AND n.chapter_number = c.chapter_number + 1
+        )
+    )
+    FROM chapters c
+    WHERE c.id = p_chapter_id;
+$$ LANGUAGE sql STABLE;
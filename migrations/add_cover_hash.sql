@@ -0,0 +1,16 @@
+-- Migration: Track cover image versions to skip unchanged Cloudinary re-uploads
+-- Run this in Supabase SQL Editor
+
+-- BLAKE2b (16 bytes, hex) of the source image bytes last uploaded
+ALTER TABLE stories 
+ADD COLUMN IF NOT EXISTS cover_hash TEXT;
+
+-- ETag / Last-Modified of the source image (checked with HEAD before downloading)
+ALTER TABLE stories 
+ADD COLUMN IF NOT EXISTS cover_etag TEXT;
+
+-- Verify columns added
+SELECT column_name, data_type 
+FROM information_schema.columns 
+WHERE table_name = 'stories' 
+AND column_name IN ('cover_hash', 'cover_etag');
@@ -0,0 +1,13 @@
+-- Migration: Fast approximate row counts for the admin dashboard
+-- Run this in Supabase SQL Editor
+-- COUNT(*) exact phải quét toàn bộ bảng; reltuples là ước lượng do ANALYZE/autovacuum cập nhật
+
+CREATE OR REPLACE FUNCTION estimate_row_count(table_name TEXT)
+RETURNS BIGINT AS $$
+    SELECT reltuples::BIGINT
+    FROM pg_class
+    WHERE oid = to_regclass('public.' || table_name);
+$$ LANGUAGE sql STABLE;
+
+-- Test
+SELECT estimate_row_count('stories'), estimate_row_count('chapters');
@@ -0,0 +1,20 @@
+-- Migration: Atomic crawl_stats increment in one round-trip
+-- Run this in Supabase SQL Editor (cần constraint crawl_stats_date_key, xem add_crawl_stats_constraint.sql)
+-- Dùng cho Database.update_crawl_stats (trước đây SELECT rồi UPDATE/INSERT -> mất số liệu khi nhiều runner cùng ghi)
+
+CREATE OR REPLACE FUNCTION increment_crawl_stats(
+    p_date DATE,
+    p_stories INTEGER DEFAULT 0,
+    p_chapters INTEGER DEFAULT 0,
+    p_content INTEGER DEFAULT 0,
+    p_errors INTEGER DEFAULT 0
+)
+RETURNS VOID AS $$
+    INSERT INTO crawl_stats (date, stories_crawled, chapters_crawled, content_fetched, errors)
+    VALUES (p_date, p_stories, p_chapters, p_content, p_errors)
+    ON CONFLICT (date) DO UPDATE SET
+        stories_crawled = crawl_stats.stories_crawled + EXCLUDED.stories_crawled,
+        chapters_crawled = crawl_stats.chapters_crawled + EXCLUDED.chapters_crawled,
+        content_fetched = crawl_stats.content_fetched + EXCLUDED.content_fetched,
+        errors = crawl_stats.errors + EXCLUDED.errors;
+$$ LANGUAGE sql VOLATILE;
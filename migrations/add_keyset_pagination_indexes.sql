@@ -0,0 +1,11 @@
+-- Migration: Indexes for keyset (cursor) pagination
+-- Run this in Supabase SQL Editor
+
+-- GET /api/v1/novels: ORDER BY updated_at DESC, id DESC + WHERE (updated_at, id) < (...)
+CREATE INDEX IF NOT EXISTS idx_stories_updated_id
+ON stories(updated_at DESC, id DESC);
+
+-- GET /api/v1/novels/{id}/chapters: WHERE story_id = ? AND chapter_number > ?
+-- (covered by unique constraint on (story_id, chapter_number))
+CREATE INDEX IF NOT EXISTS idx_chapters_story_number
+ON chapters(story_id, chapter_number);
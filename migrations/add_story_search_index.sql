@@ -0,0 +1,17 @@
+-- Migration: Full-text search on stories (title + author)
+-- Run this in Supabase SQL Editor
+-- Dùng cho GET /api/v1/search (trước đây title/author ILIKE '%q%' -> seq scan toàn bảng)
+
+-- 'simple': không stemming/stopword tiếng Anh, giữ nguyên dấu tiếng Việt
+ALTER TABLE stories ADD COLUMN IF NOT EXISTS search tsvector
+GENERATED ALWAYS AS (
+    to_tsvector('simple', coalesce(title, '') || ' ' || coalesce(author, ''))
+) STORED;
+
+-- Tên mới: idx_stories_search (supabase_schema.sql) là expression index cũ trên
+-- to_tsvector(title || author), không dùng được cho cột search -> IF NOT EXISTS sẽ bỏ qua
+CREATE INDEX IF NOT EXISTS stories_search_gin
+ON stories USING GIN(search);
+
+-- Expression index cũ không còn query nào dùng, chỉ làm chậm mỗi lần ghi stories
+DROP INDEX IF EXISTS idx_stories_search;
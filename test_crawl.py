@@ -7,7 +7,6 @@ sys.path.append('.')
 async def test():
     import httpx
     from app.crawler.parsers import parse_story_detail, get_pagination_info, parse_chapter_list
-    from bs4 import BeautifulSoup
     
     url = "https://truyenfull.vision/tam-quoc-dien-nghia/"
     print(f"Testing with HTTPX: {url}\n")
@@ -37,8 +36,7 @@ async def test():
                 print(f"Fetching page {page_num}: {page_url}")
                 
                 response = await client.get(page_url)
-                soup = BeautifulSoup(response.text, "lxml")
-                page_chapters = parse_chapter_list(soup)
+                page_chapters = parse_chapter_list(response.content)
                 
                 all_chapters.extend(page_chapters)
                 print(f"  -> Found {len(page_chapters)} chapters")
@@ -7,7 +7,7 @@ from datetime import datetime, timezone
 from typing import Optional
 
 from .celery_app import celery_app
-from app.crawler.crawler import StoryCrawler
+from app.crawler.crawler import StoryCrawler, close_session
 from app.database import db
 
 
@@ -18,6 +18,8 @@ def run_async(coro):
     try:
         return loop.run_until_complete(coro)
     finally:
+        # aiohttp session của crawler gắn với loop này -> đóng trước khi đóng loop
+        loop.run_until_complete(close_session())
         loop.close()
 
 
@@ -113,15 +115,16 @@ def crawl_story_list_task(self, category: str = "hot", max_pages: int = 2):
     async def _crawl_list():
         print(f"📃 Crawling {category} stories, {max_pages} pages...")
         
-        crawler = StoryCrawler()
         stories = []
         
-        if category == "hot":
-            stories = await crawler.crawl_hot_stories(max_pages)
-        elif category == "new":
-            stories = await crawler.crawl_new_stories(max_pages)
-        elif category == "completed":
-            stories = await crawler.crawl_completed_stories(max_pages)
+        # Các trang listing tải song song: dùng chung 1 Chromium khi bị chặn
+        async with StoryCrawler() as crawler:
+            if category == "hot":
+                stories = await crawler.crawl_hot_stories(max_pages)
+            elif category == "new":
+                stories = await crawler.crawl_new_stories(max_pages)
+            elif category == "completed":
+                stories = await crawler.crawl_completed_stories(max_pages)
         
         # Save basic story info
         for story in stories:
@@ -150,7 +153,7 @@ def check_story_updates():
         print("🔄 Checking for story updates...")
         
         # Get all ongoing stories
-        stories = await db.get_stories(limit=50)
+        stories = await db.get_stories(limit=50, columns="id,status,source_url")
         ongoing = [s for s in stories if s.get("status") == "ongoing"]
         
         print(f"📚 Found {len(ongoing)} ongoing stories to check")